@@ -0,0 +1,78 @@
+"""
+Authentication of requests to the Sapelli API (``/api/sapelli/``).
+"""
+
+from rest_framework.settings import api_settings
+
+from geokey.users.models import User
+
+from oauth2_provider.models import AccessToken
+
+try:
+    from oauth2_provider.contrib.rest_framework import OAuth2Authentication
+except ImportError:  # django-oauth-toolkit < 1.0
+    from oauth2_provider.ext.rest_framework import OAuth2Authentication
+
+from .helper.metrics import metrics
+from .helper.token_cache import (
+    get_token_cache_ttl,
+    get_cached_token,
+    cache_token,
+    invalidate_cached_token
+)
+
+
+def get_bearer_token(request):
+    """Return the token of the request's 'Authorization: Bearer' header, or None."""
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not authorization.startswith('Bearer '):
+        return None
+    return authorization[len('Bearer '):].strip() or None
+
+
+class CachedOAuth2Authentication(OAuth2Authentication):
+    """
+    OAuth2Authentication which caches the bearer tokens it has validated
+    (see helper.token_cache), so that repeated requests with the same token
+    only look its user up.
+    """
+
+    def authenticate(self, request):
+        token = get_bearer_token(request)
+        if token is None or not get_token_cache_ttl():
+            return super(CachedOAuth2Authentication, self).authenticate(request)
+
+        details = get_cached_token(token)
+        metrics.inc('sapelli_cache_requests_total', cache='access_token', result='miss' if details is None else 'hit')
+        if details is None:
+            result = super(CachedOAuth2Authentication, self).authenticate(request)
+            if result is not None:
+                cache_token(result[1])
+            return result
+
+        try:
+            user = User.objects.get(pk=details['user_id'])
+        except User.DoesNotExist:
+            invalidate_cached_token(token)
+            return None
+        access_token = AccessToken(
+            pk=details['id'],
+            token=token,
+            user=user,
+            application_id=details['application_id'],
+            scope=details['scope'],
+            expires=details['expires'])
+        return user, access_token
+
+
+def get_api_authentication_classes():
+    """
+    Return the authentication classes of the Sapelli API views: the default
+    ones, with OAuth2Authentication replaced by CachedOAuth2Authentication.
+    """
+    classes = list(api_settings.DEFAULT_AUTHENTICATION_CLASSES)
+    if OAuth2Authentication in classes:
+        classes[classes.index(OAuth2Authentication)] = CachedOAuth2Authentication
+    else:
+        classes.insert(0, CachedOAuth2Authentication)
+    return classes
@@ -0,0 +1,34 @@
+"""Helpers to run work outside of the request/response cycle."""
+
+import logging
+import threading
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Runs the given function in a daemon thread of the current process.
+
+    Any exception is logged rather than raised, and the thread's database
+    connection is closed once the function returns.
+
+    Returns
+    -------
+    threading.Thread
+        The started thread.
+    """
+    def target():
+        try:
+            func(*args, **kwargs)
+        except BaseException:
+            logger.exception('Background task %s failed', getattr(func, '__name__', func))
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    return thread
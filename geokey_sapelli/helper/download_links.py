@@ -0,0 +1,118 @@
+"""
+Stateless, signed download links of SAP files and of log files.
+
+Rather than creating an AccessToken (and SAPDownloadQRLink) for every QR code,
+the download URL carries an expiry time and an HMAC signature (keyed with the
+SECRET_KEY) of the project, the user it was issued to, the expiry time and the
+download key version of the project and of the user (see
+SapelliProject.get_download_key_version). Both key versions are stored on the
+project row, so verifying a link requires no lookup besides the project.
+Incrementing the key version of a project revokes all of its links,
+incrementing that of a user revokes theirs only (see
+SapelliProject.revoke_download_links). Whether the user can still contribute
+to the project is not checked: a link remains valid until it expires or is
+revoked.
+
+Expiry times are rounded up to whole buckets, so the same link (and QR image)
+is issued for all requests within a bucket.
+
+Log file links (see SapelliLogFile.get_url) carry a signature of the project
+and the log only: like the media URLs of uncompressed logs, they work for
+anyone who has them and do not expire.
+"""
+
+import time
+
+from datetime import datetime
+from pytz import utc
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac, constant_time_compare
+
+SALT = 'geokey_sapelli.sap_download'
+LOG_FILE_SALT = 'geokey_sapelli.log_file'
+DEFAULT_VALIDITY = 24 * 60 * 60  # seconds
+DEFAULT_EXPIRY_BUCKET = 60 * 60  # seconds
+
+
+def signed_download_links_enabled():
+    """Return `True` if SAP download links are signed rather than token-based."""
+    return getattr(settings, 'SAPELLI_SIGNED_DOWNLOAD_LINKS', False)
+
+
+def sign_download(project_id, user_id, expires, key_version):
+    """Return the signature of a download link."""
+    return salted_hmac(SALT, '%s|%s|%s|%s' % (project_id, user_id, expires, key_version)).hexdigest()
+
+
+def create_download_link_params(sapelli_project, user, validity=DEFAULT_VALIDITY):
+    """
+    Creates the query parameters of a signed download link.
+
+    Parameters
+    ----------
+    sapelli_project : SapelliProject
+        The project to download the SAP file of.
+    user : geokey.users.models.User
+        User the link is issued to.
+    validity : int
+        Minimum number of seconds the link remains valid (optional).
+
+    Returns
+    -------
+    dict
+        The 'user', 'expires' (epoch seconds) and 'signature' parameters.
+    """
+    bucket = getattr(settings, 'SAPELLI_SIGNED_LINK_EXPIRY_BUCKET', DEFAULT_EXPIRY_BUCKET)
+    expires = int(time.time()) + validity
+    expires += -expires % bucket  # round up to the end of the bucket
+    return {
+        'user': user.id,
+        'expires': expires,
+        'signature': sign_download(
+            sapelli_project.pk, user.id, expires, sapelli_project.get_download_key_version(user.id)),
+    }
+
+
+def get_expiry_datetime(params):
+    """Return the (timezone-aware) expiry time of a signed link's parameters."""
+    return datetime.fromtimestamp(int(params['expires']), utc)
+
+
+def verify_download_link_params(sapelli_project, params):
+    """
+    Checks the query parameters of a signed download link.
+
+    Parameters
+    ----------
+    sapelli_project : SapelliProject
+        The project whose SAP file is being downloaded.
+    params : dict
+        The query parameters of the request.
+
+    Returns
+    -------
+    bool
+        `True` if the signature is valid, the link has not expired and has not
+        been revoked.
+    """
+    try:
+        user_id = int(params.get('user'))
+        expires = int(params.get('expires'))
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return constant_time_compare(
+        params.get('signature', ''),
+        sign_download(sapelli_project.pk, user_id, expires, sapelli_project.get_download_key_version(user_id)))
+
+
+def sign_log_file(project_id, log_id):
+    """Return the signature of a log file link."""
+    return salted_hmac(LOG_FILE_SALT, '%s|%s' % (project_id, log_id)).hexdigest()
+
+
+def verify_log_file_signature(project_id, log_id, signature):
+    """Return `True` if the signature of a log file link is valid."""
+    return constant_time_compare(signature or '', sign_log_file(project_id, log_id))
@@ -0,0 +1,193 @@
+"""
+Serving of (large) files, e.g. SAP files, with strong ETags, conditional GET
+(If-None-Match), single byte range requests (Range, If-Range) and optional
+offloading of the transfer to the web server (X-Sendfile/X-Accel-Redirect).
+"""
+
+import hashlib
+import os
+import re
+import urllib
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+SENDFILE_X_SENDFILE = 'x-sendfile'
+SENDFILE_X_ACCEL_REDIRECT = 'x-accel-redirect'
+
+
+def file_sha256(path):
+    """
+    Return the (hex) SHA-256 hash of a file's contents.
+
+    Parameters
+    ----------
+    path : str
+        Absolute path to the file.
+
+    Returns
+    -------
+    str
+        The hash, or None if the file could not be read.
+    """
+    sha256 = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha256.update(data)
+    except (IOError, OSError):
+        return None
+    return sha256.hexdigest()
+
+
+def get_sendfile_mode():
+    """Return how file transfers are offloaded to the web server (None if they are not)."""
+    return getattr(settings, 'SAPELLI_SENDFILE', None)
+
+
+def get_accel_redirect_url(path):
+    """
+    Return the internal URL (e.g. an nginx `internal` location) at which the
+    web server serves the given file, or None if the file is not covered by
+    the SAPELLI_SENDFILE_ROOT directory.
+    """
+    root = os.path.join(os.path.abspath(getattr(settings, 'SAPELLI_SENDFILE_ROOT', settings.MEDIA_ROOT)), '')
+    path = os.path.abspath(path)
+    if not path.startswith(root):
+        return None
+    url = getattr(settings, 'SAPELLI_SENDFILE_URL', '/sapelli-internal/')
+    return url.rstrip('/') + '/' + urllib.quote(path[len(root):].replace(os.sep, '/').encode('utf-8'))
+
+
+def etag_matches(header, etag):
+    """Return `True` if an If-None-Match header value matches the ETag (weak comparison)."""
+    if header.strip() == '*':
+        return True
+    return any(
+        candidate.strip().replace('W/', '', 1) == etag
+        for candidate in header.split(','))
+
+
+def parse_range(header, size):
+    """
+    Parse the Range header of a request for a file of the given size.
+
+    Only single byte ranges are supported, other (e.g. multiple) ranges are
+    ignored, as the HTTP spec allows.
+
+    Returns
+    -------
+    tuple
+        The (start, end) offsets (inclusive) of the range, `False` if the
+        range cannot be satisfied, or None if the header is to be ignored.
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:  # suffix range: the last `end` bytes
+        length = int(end)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def _read_file(path, start, length):
+    """Generate `length` bytes of a file, starting at the `start` offset."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def serve_file(request, path, content_type, filename=None, etag_hash=None):
+    """
+    Creates the response to a GET request for a file.
+
+    Parameters
+    ----------
+    request : django.http.HttpRequest or rest_framework.request.Request
+        The request.
+    path : str
+        Absolute path to the (existing) file.
+    content_type : str
+        Content type of the file.
+    filename : str
+        Name to offer the file as attachment under (optional).
+    etag_hash : str
+        Hash of the file's contents, used as strong ETag (optional).
+
+    Returns
+    -------
+    django.http.HttpResponse
+        The full file (200), the requested byte range (206), an unsatisfiable
+        range (416) or not modified (304) response.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    last_modified = http_date(stat.st_mtime)
+    etag = '"%s"' % etag_hash if etag_hash else None
+
+    def add_headers(response):
+        if etag:
+            response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        response['Accept-Ranges'] = 'bytes'
+        if filename:
+            response['Content-Disposition'] = 'attachment; filename=%s' % filename
+        return response
+
+    if etag and etag_matches(request.META.get('HTTP_IF_NONE_MATCH', ''), etag):
+        return add_headers(HttpResponse(status=304))
+
+    sendfile_mode = get_sendfile_mode()
+    if sendfile_mode == SENDFILE_X_SENDFILE:
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path.encode('utf-8') if isinstance(path, unicode) else path
+        return add_headers(response)
+    if sendfile_mode == SENDFILE_X_ACCEL_REDIRECT:
+        url = get_accel_redirect_url(path)
+        if url is not None:
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = url
+            return add_headers(response)
+
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header:
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range or if_range.strip() in (etag, last_modified):
+            byte_range = parse_range(range_header, size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%s' % size
+        return add_headers(response)
+
+    if byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _read_file(path, start, end - start + 1),
+            status=206,
+            content_type=content_type)
+        response['Content-Range'] = 'bytes %s-%s/%s' % (start, end, size)
+        response['Content-Length'] = end - start + 1
+    else:
+        response = StreamingHttpResponse(_read_file(path, 0, size), content_type=content_type)
+        response['Content-Length'] = size
+    return add_headers(response)
@@ -0,0 +1,190 @@
+"""
+Memory use of CSV imports (see SapelliProject.import_from_csv): measuring it
+and keeping imports within a memory budget (SAPELLI_IMPORT_MEMORY_BUDGET).
+"""
+
+import gc
+import os
+import platform
+
+from django.conf import settings
+from django.db import reset_queries
+
+from .sapelli_exceptions import SapelliCSVException
+
+try:
+    import tracemalloc  # Python 3 (or the pytracemalloc backport)
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:  # e.g. on Windows
+    resource = None
+
+# Number of rows between checks of the memory used by an import:
+CHECK_EVERY = 100
+
+# Number of allocation sites reported in the memory profile of an import:
+TOP_ALLOCATIONS = 10
+
+
+def get_peak_rss_kb():
+    """Return the peak resident set size of the process so far (in KiB), or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in KiB elsewhere:
+    return peak // 1024 if platform.system() == 'Darwin' else peak
+
+
+def get_rss_kb():
+    """
+    Return the current resident set size of the process (in KiB), falling
+    back to the peak one where it cannot be read (i.e. outside of Linux).
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (IOError, OSError, ValueError, IndexError):
+        return get_peak_rss_kb()
+
+
+def get_memory_budget_kb():
+    """Return the memory budget of an import (in KiB), or None if it is unlimited."""
+    budget = getattr(settings, 'SAPELLI_IMPORT_MEMORY_BUDGET', None)  # in MiB
+    return int(budget * 1024) if budget else None
+
+
+class MemoryBudget(object):
+    """
+    Keeps an import within a memory budget: every CHECK_EVERY rows, the growth
+    of the process's resident set size since the start of the import is
+    compared with the budget. When it is over, the importer is asked to shrink
+    (dropping its caches), the queries logged by Django are dropped and
+    garbage is collected.
+
+    Memory freed that way is not necessarily returned to the system, but is
+    reused by the rows which follow: the import carries on as long as it is
+    back within the budget or has not grown since it last shrank, and is only
+    stopped when it keeps growing over the budget in spite of shrinking.
+    """
+
+    def __init__(self, limit_kb, shrink=None, check_every=CHECK_EVERY):
+        self.limit_kb = limit_kb
+        self.shrink = shrink
+        self.check_every = check_every
+        self.baseline_kb = get_rss_kb() or 0
+        self.rows = 0
+        self.shrinks = 0
+        self.shrunk_kb = None  # memory used after shrinking, while still over the budget
+
+    def get_used_kb(self):
+        """Return the memory used since the start of the import (in KiB)."""
+        return (get_rss_kb() or 0) - self.baseline_kb
+
+    def row_done(self):
+        """
+        Count a row as processed, checking the memory used every
+        check_every rows.
+
+        Raises
+        ------
+        SapelliCSVException
+            When the import has grown further over its budget since it last
+            shrank.
+        """
+        self.rows += 1
+        if self.limit_kb is None or self.rows % self.check_every:
+            return
+        if self.get_used_kb() <= self.limit_kb:
+            self.shrunk_kb = None
+            return
+
+        self.shrinks += 1
+        if self.shrink is not None:
+            self.shrink()
+        reset_queries()
+        gc.collect()
+
+        used_kb = self.get_used_kb()
+        if used_kb <= self.limit_kb:
+            self.shrunk_kb = None
+        elif self.shrunk_kb is None or used_kb <= self.shrunk_kb:
+            self.shrunk_kb = used_kb
+        else:
+            raise SapelliCSVException(
+                'The import was stopped after %s rows as it used %s MiB of memory (budget: %s MiB). '
+                'The rows imported so far are kept: upload the rest of the file separately, '
+                'or upload it again to skip them as duplicates.' % (
+                    self.rows, used_kb // 1024, self.limit_kb // 1024))
+
+
+class MemoryProfile(object):
+    """
+    Profiles the memory of an import: the peak resident set size of the
+    process and, if traced (and tracemalloc is available), the memory
+    allocated in each stage and the allocation sites holding the most memory
+    at the end.
+    """
+
+    def __init__(self, trace=False):
+        self.start_rss_kb = get_rss_kb()
+        self.allocated = {}
+        self.top_allocations = []
+        self.traced_peak_kb = None
+        self.peak_rss_kb = None
+        self.end_rss_kb = None
+        self.started_tracing = trace and tracemalloc is not None and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        self.traced = trace and tracemalloc is not None
+
+    def get_traced(self):
+        """Return the memory currently traced (in bytes), or None."""
+        if not self.traced or not tracemalloc.is_tracing():
+            return None
+        return tracemalloc.get_traced_memory()[0]
+
+    def add(self, stage, start_traced):
+        """Record the memory allocated (or freed) by a span of a stage."""
+        end_traced = self.get_traced()
+        if start_traced is not None and end_traced is not None:
+            self.allocated[stage] = self.allocated.get(stage, 0) + end_traced - start_traced
+
+    def stop(self):
+        """Take the final snapshot of the import's memory."""
+        if self.traced and tracemalloc.is_tracing():
+            self.traced_peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+            snapshot = tracemalloc.take_snapshot()
+            self.top_allocations = [
+                {'site': str(statistic.traceback), 'kb': statistic.size // 1024, 'count': statistic.count}
+                for statistic in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]]
+            if self.started_tracing:
+                tracemalloc.stop()
+        self.peak_rss_kb = get_peak_rss_kb()
+        self.end_rss_kb = get_rss_kb()
+
+    def to_dict(self):
+        """
+        Return the memory profile of the import.
+
+        Returns
+        -------
+        dict
+            The 'peak_rss_kb' of the process, the 'rss_growth_kb' during the
+            import and, when traced, the 'traced_peak_kb', the KiB allocated
+            in each stage ('stages') and the 'top_allocations'.
+        """
+        profile = {
+            'peak_rss_kb': self.peak_rss_kb,
+            'rss_growth_kb': (
+                self.end_rss_kb - self.start_rss_kb
+                if self.end_rss_kb is not None and self.start_rss_kb is not None else None),
+        }
+        if self.traced_peak_kb is not None:
+            profile['traced_peak_kb'] = self.traced_peak_kb
+            profile['stages'] = dict((stage, size // 1024) for stage, size in self.allocated.items())
+            profile['top_allocations'] = self.top_allocations
+        return profile
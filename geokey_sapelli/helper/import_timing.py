@@ -0,0 +1,193 @@
+"""
+Timing of the stages of CSV imports (see SapelliProject.import_from_csv).
+"""
+
+import cProfile
+import errno
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .import_memory import MemoryProfile
+
+logger = logging.getLogger(__name__)
+
+# Stages of an import, in order:
+HEADER = 'header'  # parsing the header row
+FORM = 'form'  # resolving the form the records were collected with
+MAPPING = 'mapping'  # mapping rows to contributions
+LOOKUP = 'lookup'  # looking up existing contributions (duplicates)
+COMPARISON = 'comparison'  # comparing rows with existing contributions
+VALIDATION = 'validation'  # validating contributions
+SAVE = 'save'  # saving contributions
+STAGES = (HEADER, FORM, MAPPING, LOOKUP, COMPARISON, VALIDATION, SAVE)
+
+# Upper bounds (in milliseconds) of the histogram buckets of span durations:
+BUCKETS = (0.1, 1, 10, 100, 1000)
+
+
+def get_bucket_name(index):
+    """Return the name of a histogram bucket."""
+    if index < len(BUCKETS):
+        return '<%gms' % BUCKETS[index]
+    return '>=%gms' % BUCKETS[-1]
+
+
+class _Span(object):
+    """Times a span of a stage (see ImportTimer.span)."""
+
+    def __init__(self, timer, stage):
+        self.timer = timer
+        self.stage = stage
+        self.start = None
+        self.start_traced = None
+
+    def __enter__(self):
+        self.start_traced = self.timer.memory.get_traced()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.add(self.stage, time.time() - self.start)
+        self.timer.memory.add(self.stage, self.start_traced)
+
+
+class ImportTimer(object):
+    """
+    Collects the total time, number and histogram of durations of the spans
+    of each stage of an import, and its memory profile (tracing the memory
+    allocated in each stage if trace_memory, which defaults to the
+    SAPELLI_IMPORT_TRACE_MEMORY setting).
+    """
+
+    def __init__(self, trace_memory=None):
+        if trace_memory is None:
+            trace_memory = getattr(settings, 'SAPELLI_IMPORT_TRACE_MEMORY', False)
+        self.memory = MemoryProfile(trace=trace_memory)
+        self.start = time.time()
+        self.end = None
+        self.totals = dict((stage, 0.0) for stage in STAGES)
+        self.counts = dict((stage, 0) for stage in STAGES)
+        self.histograms = dict((stage, [0] * (len(BUCKETS) + 1)) for stage in STAGES)
+        self.profile_path = None
+
+    def span(self, stage):
+        """Return a context manager timing a span of the given stage."""
+        return _Span(self, stage)
+
+    def add(self, stage, seconds):
+        """Record a span of a stage which took the given number of seconds."""
+        self.totals[stage] += seconds
+        self.counts[stage] += 1
+        milliseconds = seconds * 1000
+        index = 0
+        while index < len(BUCKETS) and milliseconds >= BUCKETS[index]:
+            index += 1
+        self.histograms[stage][index] += 1
+
+    def stop(self):
+        """Mark the end of the import."""
+        self.end = time.time()
+        self.memory.stop()
+
+    def to_dict(self):
+        """
+        Return the timing of the import.
+
+        Returns
+        -------
+        dict
+            The 'total_ms' of the import, its 'memory' profile (see
+            MemoryProfile.to_dict) and, per stage (in 'stages'), the
+            'total_ms', 'count' of spans and 'histogram' of their durations.
+        """
+        timing = {
+            'total_ms': round(((self.end or time.time()) - self.start) * 1000, 3),
+            'stages': dict((stage, {
+                'total_ms': round(self.totals[stage] * 1000, 3),
+                'count': self.counts[stage],
+                'histogram': dict(
+                    (get_bucket_name(index), count)
+                    for index, count in enumerate(self.histograms[stage])),
+            }) for stage in STAGES),
+            'memory': self.memory.to_dict(),
+        }
+        if self.profile_path:
+            timing['profile'] = self.profile_path
+        return timing
+
+    def format(self):
+        """Return a (plain text) breakdown of the import's time by stage."""
+        timing = self.to_dict()
+        lines = ['Import took %.1f ms:' % timing['total_ms']]
+        for stage in STAGES:
+            line = ' - %s: %.1f ms (%s spans)' % (stage, self.totals[stage] * 1000, self.counts[stage])
+            if stage in timing['memory'].get('stages', {}):
+                line += ', %s KiB allocated' % timing['memory']['stages'][stage]
+            lines.append(line)
+        if timing['memory']['peak_rss_kb'] is not None:
+            lines.append('Peak memory of the process: %s KiB' % timing['memory']['peak_rss_kb'])
+        if self.profile_path:
+            lines.append('Profile saved to %s' % self.profile_path)
+        return '\n'.join(lines)
+
+
+class _NullSpan(object):
+    """No-op stand-in for _Span."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class NullTimer(object):
+    """No-op stand-in for ImportTimer, used when an import is not timed."""
+
+    null_span = _NullSpan()
+    profile_path = None
+
+    def span(self, stage):
+        return self.null_span
+
+    def stop(self):
+        pass
+
+
+def get_profile_path(sapelli_project):
+    """
+    Return the path to save the profile of an import into a project to
+    (creating its directory if needed), or None if imports are not to be
+    profiled (SAPELLI_IMPORT_PROFILE_DIR) or the directory cannot be created.
+    """
+    profile_dir = getattr(settings, 'SAPELLI_IMPORT_PROFILE_DIR', None)
+    if not profile_dir:
+        return None
+    try:
+        os.makedirs(profile_dir)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            logger.warning('Cannot create import profile directory %s: %s', profile_dir, e)
+            return None
+    return os.path.join(profile_dir, 'import-%s-%s.prof' % (
+        sapelli_project.pk, timezone.now().strftime('%Y%m%dT%H%M%S%f')))
+
+
+def run_profiled(profile_path, func, *args, **kwargs):
+    """
+    Call a function under cProfile, saving the profile to the given path.
+    Failing to save the profile is only logged, so that it neither replaces
+    the function's result nor hides its exception.
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        try:
+            profiler.dump_stats(profile_path)
+        except (IOError, OSError), e:
+            logger.warning('Cannot save import profile to %s: %s', profile_path, e)
@@ -1,15 +1,24 @@
-import commands
 import re
+import time
 
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
 
 from geokey.applications.models import Application
 
 from .sapelli_exceptions import SapelliException
 from .sapelli_loader import get_sapelli_dir_path, get_sapelli_jar_path
+from .java_runner import run_java
+from .background import run_in_background
+from .metrics import metrics
 
 MINIMAL_JAVA_VERSION = '1.7.0'
 
+STATUS_CACHE_KEY = 'geokey_sapelli:extension_status'
+STATUS_REFRESH_LOCK_KEY = 'geokey_sapelli:extension_status:refreshing'
+DEFAULT_HEALTH_CHECK_TTL = 300  # seconds
+
 
 def check_extension():
     # Check if SAPELLI_CLIENT_ID value is set in settings.py:
@@ -24,10 +33,11 @@ def check_extension():
         raise SapelliException('geokey_sapelli is not registered as an application (with password authorisation) on the server.')
     # Check if java 1.7.0 or more recent is installed:
     try:
-        status_output = commands.getstatusoutput('java -version')
-        if(status_output[0] != 0):
+        result = run_java(['-version'], timeout=30, bounded=False)
+        if not result.succeeded:
             raise SapelliException('java not installed, please install JRE v7 or later.')
-        java_version = re.match(r'java version "(?P<java_version>[0-9]+\.[0-9]+\.[0-9]+)_.*', status_output[1]).group('java_version')
+        # java -version reports on stderr:
+        java_version = re.match(r'java version "(?P<java_version>[0-9]+\.[0-9]+\.[0-9]+)_.*', result.stderr or result.stdout).group('java_version')
         if(java_version < MINIMAL_JAVA_VERSION):
             raise SapelliException('installed version of java is too old (installed: %s, minimum required: %s).' % (java_version, MINIMAL_JAVA_VERSION))
     except BaseException, e:
@@ -36,3 +46,58 @@ def check_extension():
     get_sapelli_dir_path()  # raises SapelliException
     # Check if we have the sapelli JAR:
     get_sapelli_jar_path()  # raises SapelliException
+
+
+def get_health_check_ttl():
+    """Return the time (in seconds) for which an extension status remains fresh."""
+    return getattr(settings, 'SAPELLI_HEALTH_CHECK_TTL', DEFAULT_HEALTH_CHECK_TTL)
+
+
+def refresh_extension_status():
+    """
+    Runs check_extension() and stores its outcome in the (shared) cache.
+
+    Returns
+    -------
+    dict
+        The new status, with keys 'ok' (bool), 'error' (str or None),
+        'checked_at' (ISO 8601 timestamp) and 'checked_at_ts' (UNIX timestamp).
+    """
+    try:
+        check_extension()
+        error = None
+    except SapelliException, e:
+        error = str(e)
+    status = {
+        'ok': error is None,
+        'error': error,
+        'checked_at': timezone.now().isoformat(),
+        'checked_at_ts': time.time(),
+    }
+    # Keep stale statuses around for a while, so they can be served while refreshing:
+    cache.set(STATUS_CACHE_KEY, status, get_health_check_ttl() * 10)
+    cache.delete(STATUS_REFRESH_LOCK_KEY)
+    return status
+
+
+def get_extension_status():
+    """
+    Returns the cached outcome of check_extension().
+
+    The status is computed right away when none is cached. When the cached
+    status is older than SAPELLI_HEALTH_CHECK_TTL it is still returned, but a
+    single background refresh is started (across all workers sharing the cache).
+
+    Returns
+    -------
+    dict
+        See refresh_extension_status().
+    """
+    status = cache.get(STATUS_CACHE_KEY)
+    metrics.inc('sapelli_cache_requests_total', cache='extension_status', result='miss' if status is None else 'hit')
+    if status is None:
+        return refresh_extension_status()
+    ttl = get_health_check_ttl()
+    if time.time() - status['checked_at_ts'] > ttl and cache.add(STATUS_REFRESH_LOCK_KEY, True, ttl):
+        run_in_background(refresh_extension_status)
+    return status
@@ -0,0 +1,277 @@
+"""
+Runs Java subprocesses (i.e. the Sapelli Collector CmdLn client) in a bounded,
+timeout-aware fashion.
+
+The number of JVMs which may run at the same time is capped across all server
+processes by means of a set of lock files (one per "slot") in the Sapelli
+working directory.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .sapelli_exceptions import SapelliException
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT = 2
+DEFAULT_TIMEOUT = 300  # seconds
+DEFAULT_SLOT_WAIT = 600  # seconds
+SLOT_POLL_INTERVAL = 0.25  # seconds
+
+_tracking = threading.local()
+
+
+class JavaRunResult(object):
+    """Outcome and resource usage of a single Java subprocess run."""
+
+    def __init__(self, args, returncode, stdout, stderr, wall_time, cpu_time, max_rss, timed_out=False):
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.wall_time = wall_time  # seconds
+        self.cpu_time = cpu_time  # seconds (user + system)
+        self.max_rss = max_rss  # kilobytes (as reported by getrusage on Linux)
+        self.timed_out = timed_out
+
+    @property
+    def succeeded(self):
+        """Return `True` if the process completed with exit code 0."""
+        return not self.timed_out and self.returncode == 0
+
+
+def get_java_command():
+    """
+    Return the command (as list of arguments) which runs Java, e.g. to use a
+    particular JRE or a stand-in for benchmarks (SAPELLI_JAVA_COMMAND).
+    """
+    command = getattr(settings, 'SAPELLI_JAVA_COMMAND', 'java')
+    if isinstance(command, basestring):
+        return shlex.split(command)
+    return list(command)
+
+
+def get_max_concurrent():
+    """Return the maximum number of Java processes allowed to run at once."""
+    return max(1, int(getattr(settings, 'SAPELLI_JAVA_MAX_CONCURRENT', DEFAULT_MAX_CONCURRENT)))
+
+
+def get_timeout():
+    """Return the default timeout (in seconds) for a single Java process."""
+    return getattr(settings, 'SAPELLI_JAVA_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def get_slot_wait():
+    """Return the time (in seconds) to wait for a free Java slot."""
+    return getattr(settings, 'SAPELLI_JAVA_SLOT_WAIT', DEFAULT_SLOT_WAIT)
+
+
+def get_max_run_duration():
+    """Return the longest time (in seconds) a bounded run_java call may take."""
+    return get_slot_wait() + (get_timeout() or 0)
+
+
+def get_lock_dir_path():
+    """
+    Return (and create if needed) the directory holding the slot lock files.
+
+    Raises
+    ------
+    SapelliException:
+        When the directory could not be created.
+    """
+    from .sapelli_loader import get_sapelli_dir_path  # avoid circular import
+    lock_dir_path = os.path.join(get_sapelli_dir_path(), 'locks', '')
+    if not os.path.exists(lock_dir_path):
+        try:
+            os.makedirs(lock_dir_path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise SapelliException('Failed to create lock directory (%s): %s' % (lock_dir_path, str(e)))
+    return lock_dir_path
+
+
+class JavaSlot(object):
+    """
+    Context manager which acquires one of the (cross-process) Java slots,
+    waiting up to `wait` seconds for one to become available.
+    """
+
+    def __init__(self, wait=None):
+        self.wait = get_slot_wait() if wait is None else wait
+        self.lock_file = None
+
+    def __enter__(self):
+        lock_dir_path = get_lock_dir_path()
+        deadline = time.time() + self.wait
+        while True:
+            for slot in range(get_max_concurrent()):
+                lock_file = open(os.path.join(lock_dir_path, 'java-%d.lock' % slot), 'a')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    lock_file.close()
+                else:
+                    self.lock_file = lock_file
+                    return self
+            if time.time() >= deadline:
+                raise SapelliException('Timed out waiting for a free Java slot (%s running).' % get_max_concurrent())
+            time.sleep(SLOT_POLL_INTERVAL)
+
+    def __exit__(self, *exc_info):
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        finally:
+            self.lock_file.close()
+            self.lock_file = None
+
+
+class _NoSlot(object):
+    """No-op stand-in for JavaSlot, used for unbounded runs."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+@contextmanager
+def track_java_runs():
+    """
+    Collects the Java runs made by the current thread within the block.
+
+    Returns
+    -------
+    dict
+        The number of 'runs', the seconds spent waiting for a Java slot
+        ('wait') and running Java ('time'), updated while the block runs.
+    """
+    usage = {'runs': 0, 'wait': 0.0, 'time': 0.0}
+    previous = getattr(_tracking, 'usage', None)
+    _tracking.usage = usage
+    try:
+        yield usage
+    finally:
+        _tracking.usage = previous
+        if previous is not None:
+            for key in usage:
+                previous[key] += usage[key]
+
+
+def _read_stream(stream, chunks):
+    """Read a pipe until EOF, collecting the data in the given list."""
+    for data in iter(lambda: stream.read(4096), b''):
+        chunks.append(data)
+    stream.close()
+
+
+def _kill(process, state):
+    """Kill a process (and anything it spawned) which outlived its timeout."""
+    state['timed_out'] = True
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def run_java(args, timeout=None, bounded=True):
+    """
+    Runs java with the given arguments, respecting the concurrency cap and timeout.
+
+    Parameters
+    ----------
+    args : list
+        Arguments to pass to the java command (excluding 'java' itself, see
+        get_java_command).
+    timeout : int
+        Seconds after which the process is killed (optional, defaults to the
+        SAPELLI_JAVA_TIMEOUT setting).
+    bounded : bool
+        Whether the run counts towards the concurrency cap (optional, defaults
+        to True; only trivial runs such as `java -version` should bypass it).
+
+    Returns
+    -------
+    JavaRunResult:
+        Exit code, separately captured stdout/stderr and resource usage.
+
+    Raises
+    ------
+    SapelliException:
+        When the java command could not be started, or no Java slot became available.
+    """
+    if timeout is None:
+        timeout = get_timeout()
+    args = get_java_command() + list(args)
+
+    requested = time.time()
+    with JavaSlot() if bounded else _NoSlot():
+        start = time.time()
+        with open(os.devnull, 'rb') as devnull:
+            try:
+                process = subprocess.Popen(
+                    args,
+                    stdin=devnull,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    close_fds=True,
+                    preexec_fn=os.setsid)  # own process group, so a timeout kills it entirely
+            except OSError, e:
+                metrics.inc('sapelli_java_runs_total', outcome='not_started')
+                raise SapelliException('Could not run java command: %s' % str(e))
+
+        state = {'timed_out': False}
+        timer = threading.Timer(timeout, _kill, [process, state]) if timeout else None
+        stdout_chunks, stderr_chunks = [], []
+        readers = [
+            threading.Thread(target=_read_stream, args=(process.stdout, stdout_chunks)),
+            threading.Thread(target=_read_stream, args=(process.stderr, stderr_chunks))]
+        try:
+            if timer:
+                timer.start()
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+            # Reap the child ourselves so we get its individual resource usage:
+            pid, status, rusage = os.wait4(process.pid, 0)
+        finally:
+            if timer:
+                timer.cancel()
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+    result = JavaRunResult(
+        args=args,
+        returncode=process.returncode,
+        stdout=b''.join(stdout_chunks),
+        stderr=b''.join(stderr_chunks),
+        wall_time=time.time() - start,
+        cpu_time=rusage.ru_utime + rusage.ru_stime,
+        max_rss=rusage.ru_maxrss,
+        timed_out=state['timed_out'])
+    metrics.inc(
+        'sapelli_java_runs_total',
+        outcome='timed_out' if result.timed_out else ('succeeded' if result.succeeded else 'failed'))
+    usage = getattr(_tracking, 'usage', None)
+    if usage is not None:
+        usage['runs'] += 1
+        usage['wait'] += start - requested
+        usage['time'] += result.wall_time
+    logger.info(
+        'java run: returncode=%s timed_out=%s wall=%.3fs cpu=%.3fs max_rss=%skB args=%s',
+        result.returncode, result.timed_out, result.wall_time, result.cpu_time, result.max_rss, ' '.join(args))
+    return result
@@ -0,0 +1,423 @@
+"""
+Incrementally maintained, per-project and per-day ZIP archives ("segments")
+of Sapelli log files.
+
+Each log file is deflated once, into the segment of the day it was created
+on, when it is stored. Downloading the logs of a date range then only copies
+the already compressed entries out of the segments, rather than reading and
+compressing every log file again.
+
+Segments live at `<MEDIA_ROOT>/sapelli/logs/archives/<project>/<Y>/<m>/<d>.zip`
+and name their entries after the primary key and upload time of the log. They
+are appended to under an exclusive lock on the segment file, and their central
+directory is read under a shared lock.
+
+Logs which are past their project's retention period are compacted into
+monthly archives (`<MEDIA_ROOT>/sapelli/logs/archives/<project>/<Y>/<m>.zip`),
+see helper.log_retention.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+from contextlib import contextmanager
+from zipfile import (
+    ZipFile, ZipInfo, BadZipfile, LargeZipFile, is_zipfile, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT, sizeFileHeader
+)
+from pytz import utc
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .log_compression import GZIP, get_gzip_member, read_file_range
+
+logger = logging.getLogger(__name__)
+
+ARCHIVES_DIR = 'sapelli/logs/archives'
+CHUNK_SIZE = 64 * 1024
+
+
+def daily_archives_enabled():
+    """Return `True` if stored log files are added to the daily segments."""
+    return getattr(settings, 'SAPELLI_DAILY_LOG_ARCHIVES', True)
+
+
+def get_log_day(created_at):
+    """Return the (UTC) day a log created at the given time belongs to."""
+    if timezone.is_aware(created_at):
+        created_at = created_at.astimezone(utc)
+    return created_at.date()
+
+
+def get_project_archives_path(sapelli_project_id):
+    """Return the absolute path of the directory holding a project's segments."""
+    return default_storage.path(os.path.join(ARCHIVES_DIR, str(sapelli_project_id)))
+
+
+def get_segment_path(sapelli_project_id, day):
+    """
+    Return the absolute path of a daily segment.
+
+    Parameters
+    ----------
+    sapelli_project_id : int
+        Identifies the Sapelli project in the database.
+    day : datetime.date
+        Day of the segment.
+
+    Returns
+    -------
+    str
+        Path of the segment (which does not necessarily exist yet).
+    """
+    return os.path.join(
+        get_project_archives_path(sapelli_project_id),
+        day.strftime('%Y'),
+        day.strftime('%m'),
+        day.strftime('%d.zip'))
+
+
+@contextmanager
+def _open_segment(path, exclusive):
+    """
+    Open a segment and lock it (exclusively for writing, shared for reading).
+    When reading, None is yielded if the segment does not exist.
+    """
+    if exclusive:
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        segment_file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0644), 'r+b')
+    else:
+        try:
+            segment_file = open(path, 'rb')
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            yield None
+            return
+
+    try:
+        fcntl.flock(segment_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield segment_file
+    finally:
+        segment_file.close()  # also releases the lock
+
+
+def _entry_name(log):
+    # Include the upload time, so entries never match a log which merely
+    # reuses the primary key (e.g. after the database was reset):
+    return '%s-%s' % (log.pk, log.uploaded_at.strftime('%Y%m%dT%H%M%S%f'))
+
+
+def _write_entry(archive, log, name):
+    """Add the (decompressed) contents of a log to an archive opened for appending."""
+    path = log.file.path
+
+    member = get_gzip_member(path) if log.compression == GZIP else None
+    if member is not None and max(member[1], member[3]) >= ZIP64_LIMIT:
+        # Entries this large need ZIP64 extra fields, leave them to ZipFile.write:
+        member = None
+    if member is not None:
+        # Copy the deflate stream of the gzip file as it is, writing the entry
+        # the way ZipFile.write does (zipfile has no API for raw entries).
+        # This relies on Python 2.7's zipfile: ZipInfo.FileHeader() writing
+        # the local header from CRC, compress_size and file_size (without a
+        # data descriptor), close() writing the central directory from
+        # filelist, and _didModify making it do so in append mode.
+        data_offset, compress_size, crc, file_size = member
+        info = ZipInfo(name, log.created_at.astimezone(utc).timetuple()[:6])
+        info.compress_type = ZIP_DEFLATED
+        info.external_attr = 0644 << 16
+        info.CRC = crc
+        info.compress_size = compress_size
+        info.file_size = file_size
+        info.header_offset = archive.fp.tell()
+        archive.fp.write(info.FileHeader())
+        for data in read_file_range(path, data_offset, compress_size):
+            archive.fp.write(data)
+        archive.filelist.append(info)
+        archive.NameToInfo[name] = info
+        archive._didModify = True
+    elif log.compression:
+        with tempfile.NamedTemporaryFile() as decompressed_file:
+            with log.open_decompressed() as log_file:
+                shutil.copyfileobj(log_file, decompressed_file, CHUNK_SIZE)
+            decompressed_file.flush()
+            archive.write(decompressed_file.name, name)
+    else:
+        archive.write(path, name)
+
+
+def append_to_daily_archives(logs):
+    """
+    Adds log files to the segments of the days they were created on. Logs
+    which are already part of their segment are skipped.
+
+    Failures are logged rather than raised: logs missing from the segments
+    are still compressed on the fly when downloaded.
+
+    Parameters
+    ----------
+    logs : iterable
+        SapelliLogFile instances (already saved, with their file stored).
+    """
+    segments = {}
+    for log in logs:
+        key = (log.sapelli_project_id, get_log_day(log.created_at))
+        segments.setdefault(key, []).append(log)
+
+    for (sapelli_project_id, day), segment_logs in segments.items():
+        path = get_segment_path(sapelli_project_id, day)
+        try:
+            with _open_segment(path, exclusive=True) as segment_file:
+                segment_file.seek(0, os.SEEK_END)
+                if segment_file.tell() and not is_zipfile(segment_file):
+                    # An interrupted append left the segment unreadable, start it afresh:
+                    logger.warning('Rebuilding corrupt Sapelli log segment %s', path)
+                    segment_file.truncate(0)
+                segment_file.seek(0)
+                with ZipFile(segment_file, 'a', ZIP_DEFLATED, allowZip64=True) as archive:
+                    names = set(archive.namelist())
+                    for log in segment_logs:
+                        if _entry_name(log) not in names:
+                            _write_entry(archive, log, _entry_name(log))
+        except (IOError, OSError, BadZipfile, LargeZipFile), e:
+            logger.warning('Failed to add logs to Sapelli log segment %s: %s', path, str(e))
+
+
+def get_monthly_archive_path(sapelli_project_id, month):
+    """
+    Return the absolute path of a monthly archive.
+
+    Parameters
+    ----------
+    sapelli_project_id : int
+        Identifies the Sapelli project in the database.
+    month : datetime.date
+        (First) day of the month.
+
+    Returns
+    -------
+    str
+        Path of the archive (which does not necessarily exist yet).
+    """
+    return os.path.join(
+        get_project_archives_path(sapelli_project_id),
+        month.strftime('%Y'),
+        month.strftime('%m.zip'))
+
+
+def get_monthly_entry_name(log):
+    """Return the name of a log's entry in a monthly archive."""
+    return '%s_%s' % (_entry_name(log), log.name)
+
+
+def _save_central_directory(path, journal_path):
+    """
+    Save the central directory of an archive (all that appending to it
+    overwrites), with its offset, to a journal.
+    """
+    with open(path, 'rb') as archive_file:
+        start_dir = ZipFile(archive_file).start_dir
+        archive_file.seek(start_dir)
+        central_directory = archive_file.read()
+    with open(journal_path + '.tmp', 'wb') as journal_file:
+        journal_file.write(struct.pack('<Q', start_dir))
+        journal_file.write(central_directory)
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+    os.rename(journal_path + '.tmp', journal_path)
+
+
+def _restore_central_directory(path, journal_path):
+    """
+    Restore an archive to its state before an (interrupted) append, from the
+    journal saved by _save_central_directory, and remove the journal.
+    """
+    with open(journal_path, 'rb') as journal_file:
+        start_dir, = struct.unpack('<Q', journal_file.read(8))
+        central_directory = journal_file.read()
+    with open(path, 'r+b') as archive_file:
+        archive_file.truncate(start_dir)
+        archive_file.seek(start_dir)
+        archive_file.write(central_directory)
+        archive_file.flush()
+        os.fsync(archive_file.fileno())
+    os.remove(journal_path)
+
+
+def append_to_monthly_archive(sapelli_project_id, month, logs, batch_size=500, sleep=0):
+    """
+    Adds log files to a monthly archive. Logs which are already part of the
+    archive are skipped.
+
+    A new archive is written to a temporary file and moved into place. An
+    existing archive is appended to in place, so a run only writes the logs
+    it adds (and the central directory): the central directory it overwrites
+    is first saved to a journal, from which the archive is restored should
+    the run fail or be interrupted.
+
+    Parameters
+    ----------
+    sapelli_project_id : int
+        Identifies the Sapelli project in the database.
+    month : datetime.date
+        (First) day of the month.
+    logs : iterable
+        SapelliLogFile instances created in that month.
+    batch_size : int
+        Number of logs to add before pausing (optional).
+    sleep : float
+        Seconds to pause after each batch of logs, to bound the I/O load
+        (optional).
+
+    Returns
+    -------
+    tuple
+        The primary keys of the logs which are part of the archive, and the
+        number of entries in the archive.
+
+    Raises
+    ------
+    IOError, OSError, BadZipfile, LargeZipFile:
+        When the archive could not be written (or the existing one is corrupt).
+    """
+    path = get_monthly_archive_path(sapelli_project_id, month)
+    journal_path = path + '.journal'
+    archived = []
+    with _open_segment(path + '.lock', exclusive=True):
+        if os.path.exists(journal_path):
+            # A previous run was interrupted while appending:
+            logger.warning('Restoring Sapelli log archive %s after an interrupted append', path)
+            _restore_central_directory(path, journal_path)
+        exists = os.path.exists(path)
+        if exists:
+            if not is_zipfile(path):
+                # Unlike the daily segments, monthly archives cannot be rebuilt:
+                raise BadZipfile('Sapelli log archive is corrupt: %s' % path)
+            _save_central_directory(path, journal_path)
+            write_path = path
+        else:
+            write_path = path + '.tmp'
+        try:
+            with open(write_path, 'r+b' if exists else 'wb') as archive_file:
+                with ZipFile(archive_file, 'a' if exists else 'w', ZIP_DEFLATED, allowZip64=True) as archive:
+                    names = set(archive.namelist())
+                    for index, log in enumerate(logs, 1):
+                        name = get_monthly_entry_name(log)
+                        if name not in names:
+                            try:
+                                _write_entry(archive, log, name)
+                            except (IOError, OSError), e:
+                                logger.warning('Failed to archive Sapelli log file %s: %s', log.file.name, str(e))
+                                continue
+                            names.add(name)
+                        archived.append(log.pk)
+                        if sleep and index % batch_size == 0:
+                            time.sleep(sleep)
+                archive_file.flush()
+                os.fsync(archive_file.fileno())
+            if exists:
+                os.remove(journal_path)
+            else:
+                os.rename(write_path, path)
+        except BaseException:
+            if exists:
+                _restore_central_directory(path, journal_path)
+            elif os.path.exists(write_path):
+                os.remove(write_path)
+            raise
+    return archived, len(names)
+
+
+class DailyArchiveReader(object):
+    """
+    Finds the compressed entries of logs in the daily segments of a project.
+
+    Logs are expected to be looked up in order of their creation, so only the
+    segment of the current day needs to be kept open.
+    """
+
+    def __init__(self, sapelli_project_id):
+        self.sapelli_project_id = sapelli_project_id
+        self.day = None
+        self.segment_file = None
+        self.entries = {}
+
+    def _open_day(self, day):
+        self.close()
+        self.day = day
+        path = get_segment_path(self.sapelli_project_id, day)
+        try:
+            with _open_segment(path, exclusive=False) as segment_file:
+                if segment_file is None:
+                    return
+                infos = ZipFile(segment_file).infolist()
+            # Entries listed in the central directory are never modified again,
+            # so their data can be read without holding the lock:
+            self.segment_file = open(path, 'rb')
+        except (IOError, OSError, BadZipfile), e:
+            logger.warning('Failed to read Sapelli log segment %s: %s', path, str(e))
+            return
+        self.entries = dict((info.filename, info) for info in infos)
+
+    def get_entry(self, log):
+        """
+        Looks up the compressed entry of a log.
+
+        Parameters
+        ----------
+        log : SapelliLogFile
+            The log to look up.
+
+        Returns
+        -------
+        tuple
+            The entry's zipfile.ZipInfo and the offset of its compressed data
+            in the segment, or None if the log is not part of its segment.
+        """
+        day = get_log_day(log.created_at)
+        if day != self.day:
+            self._open_day(day)
+
+        info = self.entries.get(_entry_name(log))
+        if info is None or info.compress_type not in (ZIP_DEFLATED, ZIP_STORED):
+            return None
+
+        self.segment_file.seek(info.header_offset)
+        header = self.segment_file.read(sizeFileHeader)
+        if len(header) != sizeFileHeader or header[:4] != b'PK\x03\x04':
+            return None
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        return info, info.header_offset + sizeFileHeader + name_length + extra_length
+
+    def read_raw(self, info, data_offset):
+        """
+        Generates the compressed data of an entry found by get_entry.
+        """
+        self.segment_file.seek(data_offset)
+        remaining = info.compress_size
+        while remaining > 0:
+            data = self.segment_file.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                raise IOError('Sapelli log segment is truncated.')
+            remaining -= len(data)
+            yield data
+
+    def close(self):
+        """Close the currently open segment."""
+        if self.segment_file is not None:
+            self.segment_file.close()
+        self.day = None
+        self.segment_file = None
+        self.entries = {}
@@ -0,0 +1,69 @@
+"""
+Reading of ZIP archives ("bundles") of Sapelli Collector log files, uploaded by
+devices at once instead of one request per log.
+"""
+
+import os
+
+from zipfile import ZipFile, BadZipfile, is_zipfile
+
+from django.core.files import File
+
+from .sapelli_exceptions import SapelliException
+from .upload_sessions import get_upload_max_size
+
+
+def iter_log_bundle(file):
+    """
+    Generates the log files in a ZIP archive, as streams of the (compressed)
+    entries, so no entry is ever extracted in full into memory or onto disk.
+
+    Directories and hidden files (e.g. `__MACOSX/._Collector_...log`) are
+    skipped.
+
+    Parameters
+    ----------
+    file : django.core.files.File
+        The uploaded ZIP archive.
+
+    Returns
+    -------
+    generator
+        Yields a tuple of the log's name and either a django.core.files.File
+        reading the entry (which must be read before the next one is
+        generated), or None and the reason the entry was rejected.
+
+    Raises
+    ------
+    SapelliException:
+        When the file is not a ZIP archive.
+    """
+    file.seek(0)
+    if not is_zipfile(file):
+        raise SapelliException('File is not a ZIP archive.')
+    file.seek(0)
+    try:
+        archive = ZipFile(file)
+    except BadZipfile, e:
+        raise SapelliException('File is not a valid ZIP archive: %s' % str(e))
+
+    max_size = get_upload_max_size()
+    with archive:
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if not name or name.startswith('.') or '__MACOSX/' in info.filename:
+                continue
+            if info.file_size > max_size:
+                yield name, None, 'Log file is too large (max. %s bytes).' % max_size
+                continue
+            try:
+                entry = archive.open(info)
+            except (BadZipfile, RuntimeError, NotImplementedError), e:  # e.g. encrypted or unsupported entries
+                yield name, None, 'Failed to read log file: %s' % str(e)
+                continue
+            log_file = File(entry, name=name)
+            log_file.size = info.file_size
+            try:
+                yield name, log_file, None
+            finally:
+                entry.close()
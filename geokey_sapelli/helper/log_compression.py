@@ -0,0 +1,201 @@
+"""
+Compression of stored Sapelli log files.
+
+Log files are compressed when they are stored, with the codec chosen by the
+SAPELLI_LOG_COMPRESSION setting: 'gzip' (the default), 'zstd' (requires the
+optional `zstandard` package) or None (to store them as uploaded).
+
+The deflate stream of a gzip file is the same as that of a (deflated) ZIP
+entry, so gzip compressed logs can be copied into ZIP archives as they are.
+"""
+
+import gzip
+import os
+import struct
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+
+from .sapelli_exceptions import SapelliException
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+COMPRESSIONS = (
+    (GZIP, 'gzip'),
+    (ZSTD, 'Zstandard'),
+)
+EXTENSIONS = {
+    GZIP: '.gz',
+    ZSTD: '.zst',
+}
+CHUNK_SIZE = 64 * 1024
+
+GZIP_FTEXT, GZIP_FHCRC, GZIP_FEXTRA, GZIP_FNAME, GZIP_FCOMMENT = 1, 2, 4, 8, 16
+
+
+def get_log_compression():
+    """
+    Return the codec new log files are compressed with (None if they are not).
+
+    Raises
+    ------
+    SapelliException:
+        When the configured codec is unknown or not available.
+    """
+    compression = getattr(settings, 'SAPELLI_LOG_COMPRESSION', GZIP)
+    if compression and compression not in EXTENSIONS:
+        raise SapelliException('Unknown SAPELLI_LOG_COMPRESSION: %s' % compression)
+    if compression == ZSTD and zstandard is None:
+        raise SapelliException('SAPELLI_LOG_COMPRESSION is zstd, but the zstandard package is not installed.')
+    return compression
+
+
+def compress_log_file(file, compression, digest=None):
+    """
+    Compresses an (uploaded) log file.
+
+    Parameters
+    ----------
+    file : django.core.files.File
+        The log file.
+    compression : str
+        The codec to compress the file with.
+    digest : hashlib hash object
+        Hash to update with the (uncompressed) contents of the file, while
+        they are read (optional).
+
+    Returns
+    -------
+    django.core.files.File
+        Temporary file holding the compressed log, named after the log file
+        (with the extension of the codec added).
+    """
+    compressed_file = tempfile.TemporaryFile()
+    if compression == GZIP:
+        # No file name or modification time in the header, so that identical
+        # logs are compressed identically:
+        gzip_file = gzip.GzipFile(filename='', mode='wb', fileobj=compressed_file, mtime=0)
+        compress, finish = gzip_file.write, gzip_file.close
+    elif compression == ZSTD:
+        compressor = zstandard.ZstdCompressor().compressobj()
+        compress = lambda data: compressed_file.write(compressor.compress(data))
+        finish = lambda: compressed_file.write(compressor.flush())
+    else:
+        raise SapelliException('Unknown log compression: %s' % compression)
+
+    try:
+        file.seek(0)
+    except (AttributeError, IOError):
+        pass  # not seekable (e.g. an entry of a ZIP archive), read from the start
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+        if digest is not None:
+            digest.update(chunk)
+        compress(chunk)
+    finish()
+    compressed_file.seek(0)
+    return File(compressed_file, name=os.path.basename(file.name) + EXTENSIONS[compression])
+
+
+def open_log_file(path, compression):
+    """
+    Opens a stored log file for reading its (decompressed) contents.
+
+    Parameters
+    ----------
+    path : str
+        Absolute path to the stored file.
+    compression : str
+        The codec the file is compressed with (None if it is not).
+
+    Returns
+    -------
+    file
+        File-like object to read the log from.
+    """
+    if compression == GZIP:
+        return gzip.open(path, 'rb')
+    if compression == ZSTD:
+        if zstandard is None:
+            raise SapelliException('Reading zstd compressed logs requires the zstandard package.')
+        return _ZstdReader(path)
+    return open(path, 'rb')
+
+
+class _ZstdReader(object):
+    """Closable reader of a zstd compressed file."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.reader = zstandard.ZstdDecompressor().stream_reader(self.file)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.reader.read(CHUNK_SIZE), b''))
+        return self.reader.read(size)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def get_gzip_member(path):
+    """
+    Locates the deflate stream in a (single member) gzip file, so it can be
+    copied into a ZIP archive without decompressing and compressing it again.
+
+    Parameters
+    ----------
+    path : str
+        Absolute path to the gzip file.
+
+    Returns
+    -------
+    tuple
+        The offset and size of the deflate stream, the CRC-32 and the size of
+        the uncompressed data, or None if the file is not a (simple) gzip file.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(10)
+        if len(header) != 10 or header[:3] != b'\x1f\x8b\x08':
+            return None
+        flags = ord(header[3])
+        if flags & GZIP_FEXTRA:
+            extra_length, = struct.unpack('<H', f.read(2))
+            f.seek(extra_length, os.SEEK_CUR)
+        for flag in (GZIP_FNAME, GZIP_FCOMMENT):
+            if flags & flag:
+                while f.read(1) not in (b'\x00', b''):
+                    pass
+        if flags & GZIP_FHCRC:
+            f.seek(2, os.SEEK_CUR)
+        data_offset = f.tell()
+
+        f.seek(-8, os.SEEK_END)
+        trailer_offset = f.tell()
+        crc, file_size = struct.unpack('<LL', f.read(8))
+    if trailer_offset < data_offset:
+        return None
+    return data_offset, trailer_offset - data_offset, crc, file_size
+
+
+def read_file_range(path, offset, size):
+    """Generate `size` bytes of a file, starting at `offset`."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while size > 0:
+            data = f.read(min(CHUNK_SIZE, size))
+            if not data:
+                raise IOError('File is truncated: %s' % path)
+            size -= len(data)
+            yield data
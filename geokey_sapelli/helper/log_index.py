@@ -0,0 +1,179 @@
+"""
+Searchable index of the contents of Sapelli Collector log files.
+
+Log lines are parsed when a log file is stored, into SapelliLogEntry rows
+(timestamp, device, level, event type and message) with a full-text search
+vector, so logs can be searched without reading the files.
+
+Collector log lines consist of fields separated by semicolons, starting with
+an ISO 8601 timestamp (e.g. `2015-01-20T18:02:12.345+00:00;Form started;...`).
+The parser is tolerant: lines without a timestamp inherit the one of the
+previous line (or the log's creation time), and lines without separators are
+kept as message.
+"""
+
+import logging
+import re
+
+from datetime import datetime, timedelta
+from pytz import utc
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CONFIG = 'simple'  # no stemming/stop words: logs are mostly identifiers
+BATCH_SIZE = 1000
+FIELD_SEPARATOR = ';'
+LEVELS = {
+    'TRACE': 'debug',
+    'DEBUG': 'debug',
+    'INFO': 'info',
+    'WARN': 'warning',
+    'WARNING': 'warning',
+    'ERROR': 'error',
+    'FATAL': 'error',
+}
+TIMESTAMP_RE = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2})[:.](\d{2})[:.](\d{2})'  # date and time
+    r'(?:[.,](\d{1,6})\d*)?'  # fraction of a second
+    r'\s*(Z|([+-])(\d{2}):?(\d{2}))?$')  # UTC offset
+DEVICE_ID_RE = re.compile(r'device\s*_?id\W*(\d+)', re.IGNORECASE)
+EVENT_TYPE_MAX_LENGTH = 100
+
+
+def log_index_enabled():
+    """Return `True` if the contents of stored log files are indexed."""
+    return getattr(settings, 'SAPELLI_LOG_INDEX', True)
+
+
+def parse_timestamp(value):
+    """
+    Return the (timezone-aware) time in a timestamp field, or None.
+
+    Times without UTC offset are assumed to be in UTC.
+    """
+    match = TIMESTAMP_RE.match(value)
+    if match is None:
+        return None
+    groups = match.groups()
+    try:
+        timestamp = datetime(
+            *[int(group) for group in groups[:6]],
+            microsecond=int((groups[6] or '0').ljust(6, '0')),
+            tzinfo=utc)
+    except ValueError:
+        return None
+    if groups[8]:
+        offset = timedelta(hours=int(groups[9]), minutes=int(groups[10]))
+        timestamp -= offset if groups[8] == '+' else -offset
+    return timestamp
+
+
+def parse_log_lines(lines, default_timestamp):
+    """
+    Parses the lines of a log file.
+
+    Parameters
+    ----------
+    lines : iterable
+        The lines of the log file (str, UTF-8 encoded).
+    default_timestamp : datetime.datetime
+        Time assumed for lines before the first one with a timestamp.
+
+    Returns
+    -------
+    generator
+        Yields a dict (line_number, timestamp, device_id, level, event_type and
+        message) for each non-empty line.
+    """
+    timestamp = default_timestamp
+    device_id = None
+    for line_number, line in enumerate(lines, 1):
+        line = line.decode('utf-8', 'replace').strip()
+        if not line:
+            continue
+        fields = [field.strip() for field in line.split(FIELD_SEPARATOR)]
+
+        line_timestamp = parse_timestamp(fields[0])
+        if line_timestamp is not None:
+            timestamp = line_timestamp
+            fields.pop(0)
+
+        level = None
+        for index, field in enumerate(fields[:2]):
+            if field.upper() in LEVELS:
+                level = LEVELS[field.upper()]
+                fields.pop(index)
+                break
+        if level is None:
+            level = 'error' if 'exception' in line.lower() else 'info'
+
+        match = DEVICE_ID_RE.search(line)
+        if match:
+            device_id = int(match.group(1))
+
+        if len(fields) > 1:
+            event_type = fields[0][:EVENT_TYPE_MAX_LENGTH]
+            message = '; '.join(fields[1:])
+        else:
+            event_type = ''
+            message = fields[0] if fields else ''
+
+        yield {
+            'line_number': line_number,
+            'timestamp': timestamp,
+            'device_id': device_id,
+            'level': level,
+            'event_type': event_type,
+            'message': message,
+        }
+
+
+def index_log_file(log):
+    """
+    Parses a stored log file into (searchable) log entries, replacing any
+    entries indexed before.
+
+    Failures are logged rather than raised, so they do not prevent the log
+    file from being stored.
+
+    Parameters
+    ----------
+    log : SapelliLogFile
+        The log file.
+
+    Returns
+    -------
+    int
+        The number of entries indexed.
+    """
+    from ..models import SapelliLogEntry  # avoid circular import
+    count = 0
+    try:
+        with transaction.atomic():
+            log.entries.all().delete()
+            batch = []
+            with log.open_decompressed() as log_file:
+                for entry in parse_log_lines(log_file, log.created_at):
+                    batch.append(SapelliLogEntry(log_file=log, sapelli_project_id=log.sapelli_project_id, **entry))
+                    if len(batch) >= BATCH_SIZE:
+                        SapelliLogEntry.objects.bulk_create(batch)
+                        count += len(batch)
+                        batch = []
+            SapelliLogEntry.objects.bulk_create(batch)
+            count += len(batch)
+            log.entries.update(search_vector=(
+                SearchVector('event_type', weight='A', config=SEARCH_CONFIG) +
+                SearchVector('message', weight='B', config=SEARCH_CONFIG)))
+    except Exception, e:
+        logger.warning('Failed to index Sapelli log file %s: %s', log.file.name, str(e))
+        return 0
+    return count
+
+
+def search_log_entries(entries, query):
+    """Filter log entries by a full-text search query (plain text)."""
+    return entries.filter(search_vector=SearchQuery(query, config=SEARCH_CONFIG))
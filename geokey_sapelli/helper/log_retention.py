@@ -0,0 +1,171 @@
+"""
+Retention of Sapelli log files.
+
+Log files are kept as they are for a number of days (per project, defaulting
+to the SAPELLI_LOG_RETENTION_DAYS setting), then compacted into monthly ZIP
+archives, which are in turn deleted after a number of days (per project,
+defaulting to SAPELLI_LOG_ARCHIVE_RETENTION_DAYS). Without a retention period
+logs (or archives) are kept forever.
+
+A log is only deleted once its archive has been written and recorded, so the
+logs page lists every log (as a file or as part of an archive) throughout.
+"""
+
+import logging
+import os
+import time
+
+from datetime import date, datetime, timedelta
+from zipfile import BadZipfile, LargeZipFile
+from pytz import utc
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .log_archives import get_segment_path, append_to_monthly_archive
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def get_log_retention_days(sapelli_project):
+    """Return the number of days a project's logs are kept raw (None for ever)."""
+    if sapelli_project.log_retention_days is not None:
+        return sapelli_project.log_retention_days
+    return getattr(settings, 'SAPELLI_LOG_RETENTION_DAYS', None)
+
+
+def get_log_archive_retention_days(sapelli_project):
+    """Return the number of days a project's log archives are kept (None for ever)."""
+    if sapelli_project.log_archive_retention_days is not None:
+        return sapelli_project.log_archive_retention_days
+    return getattr(settings, 'SAPELLI_LOG_ARCHIVE_RETENTION_DAYS', None)
+
+
+def get_month(value):
+    """Return the first day of the (UTC) month of a date or time."""
+    if hasattr(value, 'astimezone') and timezone.is_aware(value):
+        value = value.astimezone(utc)
+    return date(value.year, value.month, 1)
+
+
+def get_next_month(month):
+    """Return the first day of the month after the given one."""
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _start_of_day(day):
+    """Return the start (in UTC) of a day."""
+    return datetime(day.year, day.month, day.day, tzinfo=utc)
+
+
+def apply_log_retention(sapelli_project, now=None, batch_size=DEFAULT_BATCH_SIZE, sleep=0, dry_run=False):
+    """
+    Compacts the logs of a project which are past their retention period into
+    monthly archives, and deletes archives past their retention period.
+
+    Parameters
+    ----------
+    sapelli_project : SapelliProject
+        The project.
+    now : datetime.datetime
+        Time to apply the retention periods at (optional, defaults to now).
+    batch_size : int
+        Number of logs to archive or delete at once (optional).
+    sleep : float
+        Seconds to pause after each batch, to bound the I/O load (optional).
+    dry_run : bool
+        Only count what would be compacted and deleted (optional).
+
+    Returns
+    -------
+    dict
+        The number of logs 'compacted', monthly 'archives' written to and
+        'deleted_archives'.
+    """
+    from ..models import SapelliLogFile  # avoid circular import
+    now = now or timezone.now()
+    result = {'compacted': 0, 'archives': 0, 'deleted_archives': 0}
+
+    retention_days = get_log_retention_days(sapelli_project)
+    if retention_days is not None:
+        cutoff = now - timedelta(days=retention_days)
+        logs = sapelli_project.logs.filter(created_at__lt=cutoff)
+        months = [month.date() for month in logs.datetimes('created_at', 'month', tzinfo=utc)]
+        if dry_run:
+            result['compacted'] = logs.count()
+            result['archives'] = len(months)
+            months = []
+        for month in months:
+            month_logs = logs.filter(
+                created_at__gte=_start_of_day(month),
+                created_at__lt=_start_of_day(get_next_month(month))).order_by('created_at', 'id')
+            try:
+                archived, count = append_to_monthly_archive(
+                    sapelli_project.pk,
+                    month,
+                    month_logs.iterator(),
+                    batch_size=batch_size,
+                    sleep=sleep)
+            except (IOError, OSError, BadZipfile, LargeZipFile), e:
+                logger.error('Failed to compact Sapelli logs of %s (project %s): %s',
+                             month.strftime('%Y-%m'), sapelli_project.pk, str(e))
+                continue
+            _record_archive(sapelli_project, month, count)
+            result['archives'] += 1
+
+            for start in range(0, len(archived), batch_size):
+                batch = archived[start:start + batch_size]
+                file_names = list(SapelliLogFile.objects.filter(pk__in=batch).values_list('file', flat=True))
+                SapelliLogFile.objects.filter(pk__in=batch).delete()  # also deletes their index entries
+                for file_name in file_names:
+                    default_storage.delete(file_name)
+                result['compacted'] += len(batch)
+                if sleep:
+                    time.sleep(sleep)
+
+            _delete_compacted_segments(sapelli_project, month, cutoff)
+
+    archive_retention_days = get_log_archive_retention_days(sapelli_project)
+    if archive_retention_days is not None:
+        # Archives are deleted once their whole month is past the retention period:
+        archives = sapelli_project.log_archives.filter(
+            month__lt=get_month(now - timedelta(days=archive_retention_days)))
+        if dry_run:
+            result['deleted_archives'] = archives.count()
+        else:
+            for archive in archives:
+                archive.delete()
+                result['deleted_archives'] += 1
+
+    return result
+
+
+def _record_archive(sapelli_project, month, log_count):
+    """Create or update the record of a (written) monthly archive."""
+    from ..models import SapelliLogArchive  # avoid circular import
+    archive, created = SapelliLogArchive.objects.get_or_create(
+        sapelli_project=sapelli_project,
+        month=month)
+    archive.log_count = log_count
+    archive.size = os.path.getsize(archive.get_path())
+    archive.save()
+    return archive
+
+
+def _delete_compacted_segments(sapelli_project, month, cutoff):
+    """Delete the daily segments of a month which no longer hold any log."""
+    day = month
+    end = min(get_next_month(month), cutoff.astimezone(utc).date())
+    while day < end:
+        next_day = day + timedelta(days=1)
+        if not sapelli_project.logs.filter(
+                created_at__gte=_start_of_day(day),
+                created_at__lt=_start_of_day(next_day)).exists():
+            try:
+                os.remove(get_segment_path(sapelli_project.pk, day))
+            except OSError:
+                pass
+        day = next_day
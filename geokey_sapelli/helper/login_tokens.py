@@ -0,0 +1,118 @@
+"""
+Issuing of OAuth tokens to Sapelli Collector logins (see views.LoginAPI).
+
+The password grant is handled directly rather than through oauthlib (via
+TokenView): the credentials are checked and the access and refresh tokens are
+created and returned as they are, without a synthetic request, JSON response
+to decode again and lookup of the token just created.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.db import transaction
+from django.utils import timezone
+
+from geokey.applications.models import Application
+
+from oauth2_provider.models import AccessToken, RefreshToken
+from oauth2_provider.settings import oauth2_settings
+from oauthlib.common import generate_token
+
+from .sapelli_exceptions import SapelliException, SapelliLoginException
+
+
+def get_sapelli_application():
+    """
+    Return the application geokey-sapelli is registered as (SAPELLI_CLIENT_ID).
+
+    Raises
+    ------
+    SapelliException
+        When it is not configured (properly).
+    """
+    try:
+        return Application.objects.get(client_id=settings.SAPELLI_CLIENT_ID)
+    except (AttributeError, Application.DoesNotExist), e:
+        raise SapelliException(
+            'geokey-sapelli is not properly configured as an application on the server: ' + str(e))
+
+
+def get_scope(requested_scope=None):
+    """
+    Return the scope of a token: the one requested (all scopes of which must
+    be known) or else the default one.
+    """
+    scopes = (requested_scope or '').split() or oauth2_settings._DEFAULT_SCOPES
+    unknown = [scope for scope in scopes if scope not in oauth2_settings._SCOPES]
+    if unknown:
+        raise SapelliLoginException('invalid_scope', 'Unknown scope: %s.' % ' '.join(unknown))
+    return ' '.join(scopes)
+
+
+def issue_password_token(username, password, requested_scope=None, request=None):
+    """
+    Issues an access token (and refresh token) to a user, given their
+    credentials (resource owner password credentials grant).
+
+    Parameters
+    ----------
+    username : str
+        The user's email address.
+    password : str
+        The user's password.
+    requested_scope : str
+        Space-separated scopes requested (optional, defaults to all scopes).
+    request : django.http.HttpRequest
+        The login request (optional, passed on to the authentication backends).
+
+    Returns
+    -------
+    dict
+        The 'access_token', 'token_type', 'expires_in', 'expires_at',
+        'refresh_token' and 'scope', as returned by the OAuth token endpoint
+        (plus 'expires_at').
+
+    Raises
+    ------
+    SapelliLoginException
+        When the request or the credentials are invalid.
+    SapelliException
+        When geokey-sapelli is not configured properly.
+    """
+    for name, value in (('username', username), ('password', password)):
+        if not value:
+            raise SapelliLoginException('invalid_request', 'Request is missing %s parameter.' % name)
+
+    application = get_sapelli_application()
+    if not application.allows_grant_type(Application.GRANT_PASSWORD):
+        raise SapelliLoginException('unauthorized_client', 'The client is not allowed to use the password grant.')
+    scope = get_scope(requested_scope)
+
+    user = authenticate(request, username=username, password=password)
+    if user is None or not user.is_active:
+        raise SapelliLoginException('invalid_grant', 'Invalid credentials given.')
+
+    expires_in = oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS
+    with transaction.atomic():
+        access_token = AccessToken.objects.create(
+            user=user,
+            application=application,
+            token=generate_token(),
+            expires=timezone.now() + timedelta(seconds=expires_in),
+            scope=scope)
+        refresh_token = RefreshToken.objects.create(
+            user=user,
+            application=application,
+            token=generate_token(),
+            access_token=access_token)
+
+    return {
+        'access_token': access_token.token,
+        'token_type': 'Bearer',
+        'expires_in': expires_in,
+        'expires_at': access_token.expires.isoformat(),
+        'refresh_token': refresh_token.token,
+        'scope': access_token.scope,
+    }
@@ -0,0 +1,256 @@
+"""
+Metrics of the Sapelli extension, exposed in the Prometheus text format.
+
+Every server process counts into its own in-memory registry, which is merged
+into a shared JSON file (the SAPELLI_METRICS_PATH setting, defaulting to
+`metrics.json` in the Sapelli working directory) every
+SAPELLI_METRICS_FLUSH_INTERVAL seconds, under an exclusive lock on the file.
+The metrics endpoint then reports the totals of all processes (of all nodes,
+if the file is on shared storage).
+
+Recording is a no-op unless SAPELLI_METRICS is enabled.
+"""
+
+import atexit
+import errno
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+METRICS = {
+    'sapelli_csv_rows_total': (COUNTER, 'Records in imported CSV files, by outcome.'),
+    'sapelli_csv_import_duration_seconds': (HISTOGRAM, 'Duration of CSV imports.'),
+    'sapelli_sap_load_duration_seconds': (HISTOGRAM, 'Duration of SAP file loads.'),
+    'sapelli_java_runs_total': (COUNTER, 'Java subprocess runs, by outcome.'),
+    'sapelli_log_uploads_total': (COUNTER, 'Log files uploaded.'),
+    'sapelli_log_upload_bytes_total': (COUNTER, 'Bytes of (uncompressed) log files uploaded.'),
+    'sapelli_qr_renders_total': (COUNTER, 'QR code images rendered.'),
+    'sapelli_cache_requests_total': (COUNTER, 'Cache lookups, by cache and result.'),
+}
+
+# Upper bounds (in seconds) of the histogram buckets:
+BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+DEFAULT_FLUSH_INTERVAL = 10  # seconds
+
+
+def metrics_enabled():
+    """Return `True` if metrics are recorded."""
+    return getattr(settings, 'SAPELLI_METRICS', False)
+
+
+def get_metrics_path():
+    """Return the path of the file the metrics of all processes are merged into."""
+    path = getattr(settings, 'SAPELLI_METRICS_PATH', None)
+    if path:
+        return path
+    from .sapelli_loader import get_sapelli_dir_path  # avoid circular import
+    return os.path.join(get_sapelli_dir_path(), 'metrics.json')
+
+
+def get_flush_interval():
+    """Return the time (in seconds) between merges into the shared file."""
+    return getattr(settings, 'SAPELLI_METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+
+
+def format_labels(labels):
+    """Return labels in the Prometheus format (e.g. `{outcome="updated"}`)."""
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in sorted(labels.items()))
+
+
+def _new_histogram():
+    return {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+
+
+def _merge(totals, deltas):
+    """Add the metrics of one registry (or file) to those of another."""
+    for name, series in deltas.items():
+        target = totals.setdefault(name, {})
+        for labels, value in series.items():
+            if isinstance(value, dict):
+                histogram = target.setdefault(labels, _new_histogram())
+                histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], value['buckets'])]
+                histogram['sum'] += value['sum']
+                histogram['count'] += value['count']
+            else:
+                target[labels] = target.get(labels, 0) + value
+
+
+class MetricsRegistry(object):
+    """
+    Thread-safe registry of the metrics recorded (but not yet merged into the
+    shared file) by a process.
+    """
+
+    def __init__(self):
+        self.pending = {}  # name -> labels (formatted) -> value or histogram
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """Add a value to a counter."""
+        if not value or not metrics_enabled():
+            return
+        key = format_labels(labels)
+        with self.lock:
+            series = self.pending.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+        self._flush_if_due()
+
+    def observe(self, name, seconds, **labels):
+        """Add a duration (in seconds) to a histogram."""
+        if not metrics_enabled():
+            return
+        key = format_labels(labels)
+        index = 0
+        while index < len(BUCKETS) and seconds > BUCKETS[index]:
+            index += 1
+        with self.lock:
+            histogram = self.pending.setdefault(name, {}).setdefault(key, _new_histogram())
+            histogram['buckets'][index] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+        self._flush_if_due()
+
+    @contextmanager
+    def timed(self, name, **labels):
+        """Add the duration of the block to a histogram, labelled with its outcome."""
+        start = time.time()
+        outcome = 'failed'
+        try:
+            yield
+            outcome = 'succeeded'
+        finally:
+            self.observe(name, time.time() - start, outcome=outcome, **labels)
+
+    def _flush_if_due(self):
+        if time.time() - self.last_flush >= get_flush_interval():
+            self.flush()
+
+    def flush(self):
+        """Merge the pending metrics into the shared file."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = time.time()
+        if not pending:
+            return
+        try:
+            with _open_metrics_file(exclusive=True) as metrics_file:
+                totals = _read_metrics_file(metrics_file)
+                _merge(totals, pending)
+                metrics_file.seek(0)
+                metrics_file.truncate()
+                json.dump(totals, metrics_file)
+        except (IOError, OSError), e:
+            logger.warning('Failed to write Sapelli metrics: %s', str(e))
+            with self.lock:  # keep them for the next attempt
+                _merge(self.pending, pending)
+
+    def get_totals(self):
+        """
+        Return the metrics of all processes (after merging those of this one).
+
+        Returns
+        -------
+        dict
+            Values (counters) or histograms, by metric name and labels.
+        """
+        self.flush()
+        try:
+            with _open_metrics_file(exclusive=False) as metrics_file:
+                return _read_metrics_file(metrics_file)
+        except (IOError, OSError), e:
+            logger.warning('Failed to read Sapelli metrics: %s', str(e))
+            return {}
+
+
+@contextmanager
+def _open_metrics_file(exclusive):
+    """Open the shared metrics file, locked (exclusively for writing)."""
+    path = get_metrics_path()
+    if exclusive:
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+    metrics_file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0644), 'r+')
+    try:
+        fcntl.flock(metrics_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield metrics_file
+    finally:
+        metrics_file.close()  # also releases the lock
+
+
+def _read_metrics_file(metrics_file):
+    metrics_file.seek(0)
+    data = metrics_file.read()
+    if not data:
+        return {}
+    try:
+        return json.loads(data)
+    except ValueError:
+        logger.warning('Discarding corrupt Sapelli metrics file %s', get_metrics_path())
+        return {}
+
+
+def render_metrics(totals):
+    """
+    Return metrics in the Prometheus text exposition format.
+
+    Parameters
+    ----------
+    totals : dict
+        As returned by MetricsRegistry.get_totals.
+
+    Returns
+    -------
+    str
+        The exposition (every known metric is listed, even if not recorded yet).
+    """
+    lines = []
+    for name in sorted(METRICS):
+        metric_type, description = METRICS[name]
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+        for labels, value in sorted(totals.get(name, {}).items()):
+            if metric_type == COUNTER:
+                lines.append('%s%s %s' % (name, labels, value))
+                continue
+            count = 0
+            for index, bucket_count in enumerate(value['buckets']):
+                count += bucket_count
+                le = '%g' % BUCKETS[index] if index < len(BUCKETS) else '+Inf'
+                bucket_labels = labels[:-1] + ',' if labels else '{'
+                lines.append('%s_bucket%sle="%s"} %s' % (name, bucket_labels, le, count))
+            lines.append('%s_sum%s %s' % (name, labels, repr(float(value['sum']))))
+            lines.append('%s_count%s %s' % (name, labels, value['count']))
+    return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        if metrics_enabled():
+            metrics.flush()
+    except BaseException:
+        pass
@@ -1,5 +1,7 @@
 import os
+import shutil
 
+from django.db import transaction
 from django.template.defaultfilters import slugify
 from django.core.files import File
 
@@ -8,9 +10,11 @@ from geokey.projects.base import EVERYONE_CONTRIBUTES
 from geokey.categories.models import Category, Field, LookupValue
 
 from ..models import (
-    SapelliProject, SapelliForm, SapelliField, SapelliItem, LocationField
+    SapelliProject, SapelliForm, SapelliField, SapelliItem, LocationField,
+    SapelliPreviousVersion, SapelliPreviousFormSchema
 )
 from .sapelli_exceptions import SapelliSAPException
+from .file_responses import file_sha256
 
 implicit_fields = [{
     'name': 'Device Id',
@@ -61,83 +65,237 @@ def create_project(sapelli_project_info, user, sap_file_path=None):
             sapelli_fingerprint=sapelli_project_info.get('sapelli_fingerprint'),
             sapelli_model_id=sapelli_project_info.get('sapelli_model_id'),
             dir_path=sapelli_project_info.get('installation_path'),
-            sap_path=sap_file_path
+            sap_path=sap_file_path,
+            sap_hash=file_sha256(sap_file_path) if sap_file_path else None
         )
 
         for form in sapelli_project_info.get('forms'):
-            category = Category.objects.create(
-                project=geokey_project,
-                creator=user,
-                name=form.get('sapelli_id'),
-                description='',
-                default_status='active'
-            )
-            sapelli_form = SapelliForm.objects.create(
-                category=category,
-                sapelli_project=sapelli_project,
-                sapelli_id=form.get('sapelli_id'),
-                sapelli_model_schema_number=form.get('sapelli_model_schema_number')
-            )
+            create_form(sapelli_project, form, user)
+    except BaseException, e:
+        try:  # delete geokey_project:
+            geokey_project.delete()
+        except BaseException:
+            pass
+        raise e
 
-            create_implicit_fields(category, stores_end_time=form.get('stores_end_time'))
+    return geokey_project
 
-            for location in form.get('locations'):
-                LocationField.objects.create(
-                    sapelli_form=sapelli_form,
-                    sapelli_id=location.get('sapelli_id'),
-                )
 
-            for field in form.get('fields'):
-                field_type = field.get('geokey_type')
+def create_form(sapelli_project, form, user):
+    category = Category.objects.create(
+        project=sapelli_project.geokey_project,
+        creator=user,
+        name=form.get('sapelli_id'),
+        description='',
+        default_status='active'
+    )
+    sapelli_form = SapelliForm.objects.create(
+        category=category,
+        sapelli_project=sapelli_project,
+        sapelli_id=form.get('sapelli_id'),
+        sapelli_model_schema_number=form.get('sapelli_model_schema_number')
+    )
+
+    create_implicit_fields(category, stores_end_time=form.get('stores_end_time'))
+
+    for location in form.get('locations'):
+        create_location_field(sapelli_form, location)
+
+    for field in form.get('fields'):
+        create_field(sapelli_form, field)
+
+    return sapelli_form
+
+
+def create_location_field(sapelli_form, location):
+    return LocationField.objects.create(
+        sapelli_form=sapelli_form,
+        sapelli_id=location.get('sapelli_id'),
+    )
+
+
+def create_field(sapelli_form, field):
+    field_type = field.get('geokey_type')
+
+    name = field.get('caption')
+    if not name:
+        name = field.get('sapelli_id')
+
+    geokey_field = Field.create(
+        name,
+        slugify(name),
+        field.get('description') if field.get('description') else '',
+        False,
+        sapelli_form.category,
+        field_type
+    )
+
+    sapelli_field = SapelliField.objects.create(
+        sapelli_form=sapelli_form,
+        sapelli_id=field.get('sapelli_id'),
+        field=geokey_field,
+        truefalse=field.get('truefalse')
+    )
 
-                name = field.get('caption')
-                if not name:
-                    name = field.get('sapelli_id')
+    if field_type == 'LookupField':
+        create_items(sapelli_field, geokey_field, field.get('items'))
 
-                geokey_field = Field.create(
-                    name,
-                    slugify(name),
-                    field.get('description') if field.get('description') else '',
+    return sapelli_field
+
+
+def create_items(sapelli_field, lookup_field, items, first_number=0):
+    sapelli_project = sapelli_field.sapelli_form.sapelli_project
+    # Loop over items:
+    for idx, item in enumerate(items, first_number):
+        # Image:
+        img_relative_path = item.get('img')
+        img_file = None
+        if img_relative_path and sapelli_project.dir_path:
+            try:
+                img_file = File(open(os.path.join(sapelli_project.dir_path, 'img/', img_relative_path), 'rb'))
+            except IOError:
+                pass
+        # Value:
+        value = LookupValue.objects.create(
+            name=item.get('value'),
+            field=lookup_field,
+            symbol=img_file
+        )
+        # Create SapelliItem:
+        SapelliItem.objects.create(
+            lookup_value=value,
+            sapelli_field=sapelli_field,
+            number=idx
+        )
+
+
+def record_previous_version(sapelli_project, sapelli_project_info):
+    """
+    Records the fingerprint and model ID of a project, and the model schema
+    numbers of its forms, before it is upgraded to a new version (unless the
+    new version has the same fingerprint and model ID).
+    """
+    if (sapelli_project.sapelli_fingerprint == sapelli_project_info.get('sapelli_fingerprint') and
+            sapelli_project.sapelli_model_id == sapelli_project_info.get('sapelli_model_id')):
+        return
+    SapelliPreviousVersion.objects.get_or_create(
+        sapelli_project=sapelli_project,
+        sapelli_fingerprint=sapelli_project.sapelli_fingerprint,
+        sapelli_model_id=sapelli_project.sapelli_model_id,
+        defaults={'version': sapelli_project.version})
+    for sapelli_form in sapelli_project.forms.all():
+        SapelliPreviousFormSchema.objects.get_or_create(
+            sapelli_form=sapelli_form,
+            sapelli_model_id=sapelli_project.sapelli_model_id,
+            sapelli_model_schema_number=sapelli_form.sapelli_model_schema_number)
+
+
+def upgrade_project(sapelli_project, sapelli_project_info, user, sap_file_path=None):
+    """
+    Upgrades an existing project in-place to a new version of the Sapelli
+    project, keeping its categories and observations.
+
+    Forms, location fields and fields are matched by sapelli_id and only
+    those which are new get created. Choice items are matched by their
+    position, so new items are expected to be added at the end. Forms and
+    fields which were removed from the Sapelli project are left in place, as
+    existing observations may refer to them.
+
+    The fingerprint and model ID of the previous version, and the model
+    schema numbers of its forms, are kept (see SapelliPreviousVersion), so
+    that devices still running it can find the project and upload their CSV
+    files.
+
+    Parameters
+    ----------
+    sapelli_project : geokey_sapelli.models.SapelliProject
+        Project to upgrade.
+    sapelli_project_info : dict
+        The "sapelli_project_info" dictionary describing the new version.
+    user : geokey.users.models.User
+        User who uploaded the new version.
+    sap_file_path : str
+        Path to the SAP file of the new version (optional).
+
+    Returns
+    -------
+    dict
+        The number of forms, location fields, fields and items which were added.
+    """
+    added = {'forms': 0, 'locations': 0, 'fields': 0, 'items': 0}
+    old_sap_path = sapelli_project.sap_path
+    old_dir_path = sapelli_project.dir_path
+
+    with transaction.atomic():
+        record_previous_version(sapelli_project, sapelli_project_info)
+
+        sapelli_project.name = sapelli_project_info.get('name')
+        sapelli_project.variant = sapelli_project_info.get('variant')
+        sapelli_project.version = sapelli_project_info.get('version')
+        sapelli_project.sapelli_fingerprint = sapelli_project_info.get('sapelli_fingerprint')
+        sapelli_project.sapelli_model_id = sapelli_project_info.get('sapelli_model_id')
+        sapelli_project.dir_path = sapelli_project_info.get('installation_path')
+        sapelli_project.sap_path = sap_file_path
+        sapelli_project.sap_hash = file_sha256(sap_file_path) if sap_file_path else None
+        sapelli_project.save()
+
+        geokey_project = sapelli_project.geokey_project
+        geokey_project.name = sapelli_project_info.get('display_name')
+        geokey_project.save()
+
+        sapelli_forms = dict((form.sapelli_id, form) for form in sapelli_project.forms.select_related('category'))
+        for form in sapelli_project_info.get('forms'):
+            sapelli_form = sapelli_forms.get(form.get('sapelli_id'))
+            if sapelli_form is None:
+                create_form(sapelli_project, form, user)
+                added['forms'] += 1
+                continue
+
+            if sapelli_form.sapelli_model_schema_number != form.get('sapelli_model_schema_number'):
+                sapelli_form.sapelli_model_schema_number = form.get('sapelli_model_schema_number')
+                sapelli_form.save()
+
+            if form.get('stores_end_time') and not sapelli_form.category.fields.filter(key='EndTime').exists():
+                end_time = [field for field in implicit_fields if field.get('key') == 'EndTime'][0]
+                Field.create(
+                    end_time.get('name'),
+                    end_time.get('key'),
+                    '',
                     False,
-                    category,
-                    field_type
+                    sapelli_form.category,
+                    end_time.get('type')
                 )
 
-                sapelli_field = SapelliField.objects.create(
-                    sapelli_form=sapelli_form,
-                    sapelli_id=field.get('sapelli_id'),
-                    field=geokey_field,
-                    truefalse=field.get('truefalse')
-                )
+            location_ids = set(sapelli_form.location_fields.values_list('sapelli_id', flat=True))
+            for location in form.get('locations'):
+                if location.get('sapelli_id') not in location_ids:
+                    create_location_field(sapelli_form, location)
+                    added['locations'] += 1
 
-                if field_type == 'LookupField':
-                    # Loop over items:
-                    for idx, item in enumerate(field.get('items')):
-                        # Image:
-                        img_relative_path = item.get('img')
-                        img_file = None
-                        if img_relative_path and sapelli_project.dir_path:
-                            try:
-                                img_file = File(open(os.path.join(sapelli_project.dir_path, 'img/', img_relative_path), 'rb'))
-                            except IOError:
-                                pass
-                        # Value:
-                        value = LookupValue.objects.create(
-                            name=item.get('value'),
-                            field=geokey_field,
-                            symbol=img_file
-                        )
-                        # Create SapelliItem:
-                        SapelliItem.objects.create(
-                            lookup_value=value,
-                            sapelli_field=sapelli_field,
-                            number=idx
-                        )
-    except BaseException, e:
-        try:  # delete geokey_project:
-            geokey_project.delete()
+            sapelli_fields = dict((field.sapelli_id, field) for field in sapelli_form.fields.all())
+            for field in form.get('fields'):
+                sapelli_field = sapelli_fields.get(field.get('sapelli_id'))
+                if sapelli_field is None:
+                    create_field(sapelli_form, field)
+                    added['fields'] += 1
+                elif field.get('geokey_type') == 'LookupField':
+                    item_count = sapelli_field.items.count()
+                    new_items = field.get('items')[item_count:]
+                    if new_items:
+                        create_items(
+                            sapelli_field,
+                            Field.objects.get_subclass(pk=sapelli_field.field_id),
+                            new_items,
+                            first_number=item_count)
+                        added['items'] += len(new_items)
+
+    # Remove files belonging to the previous version:
+    if old_sap_path and old_sap_path != sapelli_project.sap_path:
+        try:
+            os.remove(old_sap_path)
         except BaseException:
             pass
-        raise e
+    if old_dir_path and old_dir_path != sapelli_project.dir_path:
+        shutil.rmtree(os.path.dirname(old_dir_path), ignore_errors=True)
 
-    return geokey_project
+    return added
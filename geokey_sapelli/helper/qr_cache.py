@@ -0,0 +1,126 @@
+"""
+Rendering of QR code PNG images, with an in-process cache of recently rendered
+images bounded by their total size (in bytes) and evicting the least recently
+used images first.
+"""
+
+import calendar
+import hashlib
+import threading
+import time
+
+from collections import OrderedDict
+from StringIO import StringIO
+
+import qrcode
+
+from django.conf import settings
+
+from .metrics import metrics
+
+DEFAULT_QR_CACHE_SIZE = 4 * 1024 * 1024  # bytes
+
+
+def get_qr_cache_size():
+    """Return the maximum total size (in bytes) of the cached QR images."""
+    return getattr(settings, 'SAPELLI_QR_CACHE_SIZE', DEFAULT_QR_CACHE_SIZE)
+
+
+class QRImageCache(object):
+    """Thread-safe LRU cache of rendered images, bounded by their total size."""
+
+    def __init__(self):
+        self.images = OrderedDict()  # key -> (png, expires_at)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached (unexpired) image with the given key, or None."""
+        with self.lock:
+            entry = self.images.pop(key, None)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    self.size -= len(entry[0])
+                self.misses += 1
+                return None
+            self.images[key] = entry  # re-insert as most recently used
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, png, expires_at):
+        """Cache an image until the given (epoch) time, evicting old images as needed."""
+        max_size = get_qr_cache_size()
+        with self.lock:
+            previous = self.images.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            if len(png) > max_size:
+                return
+            self.images[key] = (png, expires_at)
+            self.size += len(png)
+            while self.size > max_size:
+                _, (evicted_png, _) = self.images.popitem(last=False)
+                self.size -= len(evicted_png)
+
+    def clear(self):
+        """Remove all images (and reset the statistics)."""
+        with self.lock:
+            self.images.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+
+qr_image_cache = QRImageCache()
+
+
+def get_qr_image_key(url, expires):
+    """
+    Return the key identifying the QR image of a URL which is valid until
+    the given time (also used as the image's ETag).
+    """
+    return hashlib.sha1(('%s|%s' % (url, expires.isoformat())).encode('utf-8')).hexdigest()
+
+
+def render_qr_png(url):
+    """Render a QR code encoding the given URL as PNG image."""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        box_size=5,
+        border=0)
+    qr.add_data(url)
+    qr.make(fit=True)
+    img_buffer = StringIO()
+    qr.make_image().save(img_buffer, "PNG")
+    return img_buffer.getvalue()
+
+
+def get_qr_png(url, expires):
+    """
+    Return the QR code PNG image encoding a URL, rendering it only if it is
+    not cached already.
+
+    Parameters
+    ----------
+    url : str
+        The URL to encode.
+    expires : datetime.datetime
+        Time (timezone-aware) until which the URL remains valid (and hence the
+        image may be cached).
+
+    Returns
+    -------
+    str
+        The PNG image data.
+    """
+    key = get_qr_image_key(url, expires)
+    png = qr_image_cache.get(key)
+    metrics.inc('sapelli_cache_requests_total', cache='qr_image', result='miss' if png is None else 'hit')
+    if png is None:
+        png = render_qr_png(url)
+        metrics.inc('sapelli_qr_renders_total')
+        qr_image_cache.set(key, png, calendar.timegm(expires.utctimetuple()))
+    return png
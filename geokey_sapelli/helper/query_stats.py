@@ -0,0 +1,66 @@
+"""
+Counting of the database queries (and their time) executed on a connection.
+
+Django's debug cursor logs every query into the connection's `queries_log`;
+while counting, that log is replaced by a QueryStats object which only keeps
+the number of queries and their total time, so counting long-running code
+(e.g. an import of 100k rows) does not hold on to the SQL of every query.
+"""
+
+from contextlib import contextmanager
+
+from django.db import connection as default_connection
+
+
+class QueryStats(object):
+    """Stand-in for a connection's queries log, counting the queries logged."""
+
+    def __init__(self, parent=None):
+        self.count = 0
+        self.time = 0.0  # seconds
+        self.parent = parent
+
+    def append(self, query):
+        self.count += 1
+        self.time += float(query.get('time') or 0)
+        if self.parent is not None:
+            self.parent.append(query)
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+    def __iter__(self):
+        return iter(())
+
+
+@contextmanager
+def count_queries(connection=None):
+    """
+    Counts the queries executed on a connection within the block.
+
+    Parameters
+    ----------
+    connection : django.db.backends.base.base.BaseDatabaseWrapper
+        The connection (optional, defaults to the default database).
+
+    Returns
+    -------
+    QueryStats
+        Holds the number of queries (`count`) and their total `time` (in
+        seconds), updated while the block runs.
+    """
+    connection = connection or default_connection
+    queries_log = connection.queries_log
+    force_debug_cursor = connection.force_debug_cursor
+    # Counts of enclosing blocks include those of this one:
+    stats = QueryStats(queries_log if isinstance(queries_log, QueryStats) else None)
+    connection.queries_log = stats
+    connection.force_debug_cursor = True
+    try:
+        yield stats
+    finally:
+        connection.queries_log = queries_log
+        connection.force_debug_cursor = force_debug_cursor
@@ -18,3 +18,11 @@ class SapelliDuplicateException(SapelliException):
 
 class SapelliCSVException(SapelliException):
     pass
+
+
+class SapelliLoginException(SapelliException):
+    def __init__(self, error, description, status_code=400):
+        super(SapelliLoginException, self).__init__(description)
+        self.error = error
+        self.description = description
+        self.status_code = status_code
@@ -1,4 +1,3 @@
-import commands
 import json
 import os
 
@@ -10,7 +9,9 @@ from django.conf import settings
 from django.template.defaultfilters import slugify
 
 from ..models import SapelliProject
-from .project_mapper import create_project
+from .project_mapper import create_project, upgrade_project
+from .java_runner import run_java
+from .metrics import metrics
 from .sapelli_exceptions import (
     SapelliException,
     SapelliSAPException,
@@ -51,7 +52,7 @@ def get_sapelli_dir_path(user=None):
     return sapelli_dir_path
 
 
-def load_from_sap(sap_file, user):
+def load_from_sap(sap_file, user, upgrade=False):
     """
     Loads & saves a SapelliProject from the given SAP file.
 
@@ -61,6 +62,9 @@ def load_from_sap(sap_file, user):
         Uploaded (suspected) SAP file.
     user : geokey.users.models.User
         User who uploaded the project.
+    upgrade : bool
+        Whether to upgrade an existing version of the project (administrated
+        by the user) in-place, rather than creating a new project.
 
     Returns
     -------
@@ -76,6 +80,30 @@ def load_from_sap(sap_file, user):
     SapelliDuplicateException:
         When the project has already been uploaded.
     """
+    return load_from_sap_path(store_sap_file(sap_file, user), user, upgrade=upgrade)
+
+
+def store_sap_file(sap_file, user):
+    """
+    Stores a copy of the uploaded SAP file in the user's Sapelli working directory.
+
+    Parameters
+    ----------
+    sap_file : django.core.files.File
+        Uploaded (suspected) SAP file.
+    user : geokey.users.models.User
+        User who uploaded the project.
+
+    Returns
+    -------
+    str:
+        Absolute path to the stored file.
+
+    Raises
+    ------
+    SapelliSAPException:
+        When no file was given or it could not be stored.
+    """
     # Check if we got a file at all:
     if sap_file is None:
         raise SapelliSAPException('No file provided.')
@@ -84,12 +112,51 @@ def load_from_sap(sap_file, user):
     try:
         filename, extension = os.path.splitext(os.path.basename(sap_file.name))
         relative_sap_file_path = default_storage.save(os.path.join(get_sapelli_dir_path(user), 'SAPs', '') + filename + extension, ContentFile(sap_file.read()))
-        sap_file_path = default_storage.path(relative_sap_file_path)
+        return default_storage.path(relative_sap_file_path)
     except BaseException, e:
         raise SapelliSAPException('Failed to store uploaded file: ' + str(e))
 
+
+def load_from_sap_path(sap_file_path, user, on_phase=None, upgrade=False):
+    """
+    Loads & saves a SapelliProject from a SAP file that was stored before.
+
+    Parameters
+    ----------
+    sap_file_path : str
+        Path to the stored (suspected) SAP file, will be removed if loading fails.
+    user : geokey.users.models.User
+        User who uploaded the project.
+    on_phase : callable
+        Called with the name of each processing phase ('extracting', 'mapping')
+        when it starts (optional).
+    upgrade : bool
+        Whether to upgrade an existing version of the project (administrated
+        by the user) in-place, rather than creating a new project.
+
+    Returns
+    -------
+    SapelliProject:
+        SapelliProject instance for the parsed project.
+
+    Raises
+    ------
+    SapelliException:
+        In case of a configuration problem.
+    SapelliSAPException:
+        When project loading fails.
+    SapelliDuplicateException:
+        When the project has already been uploaded.
+    """
+    with metrics.timed('sapelli_sap_load_duration_seconds'):
+        return _load_from_sap_path(sap_file_path, user, on_phase, upgrade)
+
+
+def _load_from_sap_path(sap_file_path, user, on_phase, upgrade):
     # The file will be deleted if an exception is raised in this block:
     try:
+        if on_phase:
+            on_phase('extracting')
         # Check if it is a valid SAP file:
         check_sap_file(sap_file_path)
         # Load Sapelli project (extract+parse) using SapColCmdLn Java program:
@@ -101,8 +168,23 @@ def load_from_sap(sap_file, user):
                 sapelli_project_info['sapelli_fingerprint']):
             raise SapelliDuplicateException
 
-        # Create GeoKey and SapelliProject:
+        # Find existing version to upgrade:
+        sapelli_project = None
+        if upgrade:
+            try:
+                sapelli_project = SapelliProject.objects.get_single_for_upgrade(
+                    user,
+                    sapelli_project_info['sapelli_id'])
+            except SapelliProject.DoesNotExist:
+                pass
+
+        if on_phase:
+            on_phase('mapping')
+        # Upgrade SapelliProject or create GeoKey and SapelliProject:
         try:
+            if sapelli_project is not None:
+                upgrade_project(sapelli_project, sapelli_project_info, user, sap_file_path)
+                return sapelli_project
             geokey_project = create_project(sapelli_project_info, user, sap_file_path)
         except BaseException, e:
             raise SapelliSAPException(str(e))
@@ -204,24 +286,23 @@ def get_sapelli_project_info(sap_file_path, user):
     SapelliException:
         When the Sapelli jar file cannot be found,
         the Sapelli working directory cannot be created,
-        or when the java command could not be run.
+        when the java command could not be run,
+        or when no Java slot became available in time.
     SapelliSAPException:
-        When an error occurs during running of SapColCmdLn, will contain java_stacktrace.
+        When an error occurs during running of SapColCmdLn (or it times out), will contain java_stacktrace.
     """
     # Run SapColCmdLn class from the Sapelli jar:
-    std_output = None
+    result = run_java([
+        '-cp', get_sapelli_jar_path(),
+        'uk.ac.ucl.excites.sapelli.collector.SapColCmdLn',
+        '-p', get_sapelli_dir_path(user),
+        '-load', sap_file_path,
+        '-geokey'])  # may raise SapelliException if we somehow can't run java at all
+    if result.timed_out:
+        raise SapelliSAPException(
+            'SapColCmdLn timed out after %.0f seconds' % result.wall_time,
+            java_stacktrace=result.stderr or None)
     try:
-        command = 'java -cp %s uk.ac.ucl.excites.sapelli.collector.SapColCmdLn -p %s -load "%s" -geokey' % (
-            get_sapelli_jar_path(),
-            get_sapelli_dir_path(user),
-            sap_file_path
-        )
-        std_output = commands.getstatusoutput(command)[1]  # may fail if we somehow can't run java at all(?)
-        return json.loads(std_output)  #fails if java/SapColCmdLn output is not valid JSON
-    except SapelliException, se:  # coming from get_sapelli_jar_path or get_sapelli_dir_path
-        raise se
-    except BaseException, e:
-        if std_output is not None:
-            raise SapelliSAPException('SapColCmdLn error', java_stacktrace=std_output)
-        else:
-            raise SapelliException('Command error: ' + str(e))
+        return json.loads(result.stdout)  # fails if java/SapColCmdLn output is not valid JSON
+    except ValueError:
+        raise SapelliSAPException('SapColCmdLn error', java_stacktrace=result.stderr or result.stdout)
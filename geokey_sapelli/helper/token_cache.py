@@ -0,0 +1,68 @@
+"""
+Short-lived cache of the access tokens devices authenticate with (see
+authentication.CachedOAuth2Authentication), so that the many requests of a
+sync session do not each look their token up in the database.
+
+Tokens are cached (by their hash) in Django's cache with the id of their
+user and application, their scope and their expiry, for at most
+SAPELLI_TOKEN_CACHE_TTL seconds (and never beyond their expiry). They are
+dropped from it as soon as they are deleted (see
+models.pre_delete_access_token) -- in all server processes only if the cache
+backend is shared; otherwise, a deleted token remains usable in the other
+processes until their cached copy expires. The cache is therefore disabled
+unless SAPELLI_TOKEN_CACHE_TTL is set.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+CACHE_KEY_PREFIX = 'geokey_sapelli.access_token.'
+DEFAULT_TOKEN_CACHE_TTL = 0  # seconds (disabled)
+
+
+def get_token_cache_ttl():
+    """Return the number of seconds tokens are cached for (0 disables the cache)."""
+    return getattr(settings, 'SAPELLI_TOKEN_CACHE_TTL', DEFAULT_TOKEN_CACHE_TTL)
+
+
+def get_token_cache_key(token):
+    """Return the cache key of a token (which does not reveal the token)."""
+    return CACHE_KEY_PREFIX + hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def get_cached_token(token):
+    """
+    Return the cached details of an (unexpired) token.
+
+    Returns
+    -------
+    dict
+        The 'id', 'user_id', 'application_id', 'scope' and 'expires' of the
+        token, or None if it is not cached (or has expired).
+    """
+    details = cache.get(get_token_cache_key(token))
+    if details is None or details['expires'] <= timezone.now():
+        return None
+    return details
+
+
+def cache_token(access_token):
+    """Cache the details of an access token (see get_cached_token)."""
+    ttl = min(get_token_cache_ttl(), int((access_token.expires - timezone.now()).total_seconds()))
+    if ttl <= 0:
+        return
+    cache.set(get_token_cache_key(access_token.token), {
+        'id': access_token.pk,
+        'user_id': access_token.user_id,
+        'application_id': access_token.application_id,
+        'scope': access_token.scope,
+        'expires': access_token.expires,
+    }, ttl)
+
+
+def invalidate_cached_token(token):
+    """Drop a token from the cache."""
+    cache.delete(get_token_cache_key(token))
@@ -0,0 +1,180 @@
+"""
+Queue of uploaded SAP files awaiting processing.
+
+Jobs are stored in the database (SapelliUploadJob). They are processed either
+immediately in the request which queued them (the default), or -- when
+SAPELLI_BACKGROUND_UPLOADS is enabled -- by a local worker process started
+with `python manage.py process_sapelli_uploads`.
+"""
+
+import logging
+import time
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import SapelliUploadJob
+from .sapelli_loader import store_sap_file, load_from_sap_path
+from .java_runner import get_max_run_duration
+from .sapelli_exceptions import (
+    SapelliException,
+    SapelliSAPException,
+    SapelliDuplicateException
+)
+
+logger = logging.getLogger(__name__)
+
+
+def background_uploads_enabled():
+    """Return `True` if uploaded SAP files are processed by a worker process."""
+    return getattr(settings, 'SAPELLI_BACKGROUND_UPLOADS', False)
+
+
+def queue_sap_upload(sap_file, user, upgrade=False):
+    """
+    Stores the uploaded SAP file and queues it for processing.
+
+    When background uploads are disabled the job is processed right away, in
+    which case any exception raised while processing is passed on.
+
+    Parameters
+    ----------
+    sap_file : django.core.files.File
+        Uploaded (suspected) SAP file.
+    user : geokey.users.models.User
+        User who uploaded the project.
+    upgrade : bool
+        Whether to upgrade an existing version of the project in-place.
+
+    Returns
+    -------
+    SapelliUploadJob:
+        The (possibly already processed) job.
+
+    Raises
+    ------
+    SapelliException:
+        In case of a configuration problem.
+    SapelliSAPException:
+        When storing the file (or loading the project) fails.
+    SapelliDuplicateException:
+        When the project has already been uploaded.
+    """
+    job = SapelliUploadJob.objects.create(
+        creator=user,
+        sap_path=store_sap_file(sap_file, user),
+        upgrade=upgrade)
+    if not background_uploads_enabled():
+        job.started_at = timezone.now()
+        job.save()
+        process_upload_job(job)
+    return job
+
+
+def process_upload_job(job):
+    """
+    Extracts the job's SAP file and maps it into a GeoKey project, recording
+    the phase and timing of each step on the job.
+
+    Parameters
+    ----------
+    job : SapelliUploadJob
+        The job to process.
+
+    Raises
+    ------
+    SapelliException:
+        Whatever load_from_sap_path raised, after it has been recorded on the job.
+    """
+    phase_started = {}
+
+    def on_phase(phase):
+        phase_started[phase] = time.time()
+        if phase == SapelliUploadJob.MAPPING:
+            job.extract_duration = phase_started[phase] - phase_started[SapelliUploadJob.EXTRACTING]
+        job.set_phase(phase)
+
+    try:
+        job.sapelli_project = load_from_sap_path(
+            job.sap_path,
+            job.creator,
+            on_phase=on_phase,
+            upgrade=job.upgrade)
+    except BaseException, e:
+        if isinstance(e, SapelliDuplicateException):
+            job.error = 'This Sapelli project has already been uploaded.'
+        else:
+            job.error = str(e) or e.__class__.__name__
+        if isinstance(e, SapelliSAPException):
+            job.java_stacktrace = e.java_stacktrace
+        if SapelliUploadJob.MAPPING in phase_started:
+            job.mapping_duration = time.time() - phase_started[SapelliUploadJob.MAPPING]
+        elif SapelliUploadJob.EXTRACTING in phase_started:
+            job.extract_duration = time.time() - phase_started[SapelliUploadJob.EXTRACTING]
+        job.set_phase(SapelliUploadJob.FAILED)
+        raise
+    else:
+        job.mapping_duration = time.time() - phase_started[SapelliUploadJob.MAPPING]
+        job.set_phase(SapelliUploadJob.DONE)
+
+
+def claim_next_upload_job():
+    """
+    Claims the oldest queued job, skipping jobs claimed by other workers.
+
+    Returns
+    -------
+    SapelliUploadJob:
+        The claimed job, or None if the queue is empty.
+    """
+    with transaction.atomic():
+        job = SapelliUploadJob.objects.select_for_update(skip_locked=True).filter(
+            phase=SapelliUploadJob.STORED,
+            started_at__isnull=True).order_by('created_at', 'id').first()
+        if job is not None:
+            job.started_at = timezone.now()
+            job.save()
+    return job
+
+
+def fail_stale_upload_jobs():
+    """
+    Marks jobs which have been in progress for longer than a Java run may
+    take (e.g. because their worker was killed) as failed. This includes
+    jobs which were claimed but never got to their first phase.
+
+    Returns
+    -------
+    int
+        The number of jobs marked as failed.
+    """
+    return SapelliUploadJob.objects.filter(
+        # Queued jobs are STORED too, but only claimed ones have a started_at:
+        phase__in=[SapelliUploadJob.STORED, SapelliUploadJob.EXTRACTING, SapelliUploadJob.MAPPING],
+        started_at__isnull=False,
+        started_at__lt=timezone.now() - timedelta(seconds=get_max_run_duration() + 300)
+    ).update(
+        phase=SapelliUploadJob.FAILED,
+        finished_at=timezone.now(),
+        error='Processing was interrupted.')
+
+
+def process_next_upload_job():
+    """
+    Claims and processes the oldest queued job, if any.
+
+    Returns
+    -------
+    SapelliUploadJob:
+        The processed job, or None if the queue was empty.
+    """
+    job = claim_next_upload_job()
+    if job is not None:
+        try:
+            process_upload_job(job)
+        except (SapelliException, Exception):
+            logger.warning('Sapelli upload job %s failed: %s', job.id, job.error)
+    return job
@@ -0,0 +1,277 @@
+"""
+Resumable, chunked uploads of log and CSV files.
+
+A device opens an upload session (declaring the file's name and size), PUTs
+byte ranges of the file in any order -- resending only the ranges which did
+not arrive after a connection was lost -- and finalises the session once all
+bytes have been received. The chunks are written straight into their place in
+a file in the Sapelli working directory, which is not allocated up front but
+only grows as chunks arrive. The number of sessions a user may have open for a
+project, and their total declared size, are limited (with separate, larger
+limits for anonymous uploads of logs, which all share one user).
+"""
+
+import errno
+import json
+import os
+import re
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .sapelli_exceptions import SapelliException
+
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024  # bytes
+DEFAULT_SESSION_TTL = 7 * 24 * 60 * 60  # seconds
+DEFAULT_MAX_OPEN_SESSIONS = 10
+DEFAULT_MAX_OPEN_SIZE = 200 * 1024 * 1024  # bytes
+DEFAULT_MAX_ANONYMOUS_OPEN_SESSIONS = 100
+DEFAULT_MAX_ANONYMOUS_OPEN_SIZE = 1024 * 1024 * 1024  # bytes
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+def get_upload_max_size():
+    """Return the maximum size (in bytes) of a file uploaded in chunks."""
+    return getattr(settings, 'SAPELLI_UPLOAD_MAX_SIZE', DEFAULT_MAX_SIZE)
+
+
+def get_upload_max_open_sessions(anonymous=False):
+    """
+    Return the maximum number of upload sessions a user (or all anonymous
+    users together) may have open for a project.
+    """
+    if anonymous:
+        return getattr(settings, 'SAPELLI_UPLOAD_MAX_ANONYMOUS_OPEN_SESSIONS', DEFAULT_MAX_ANONYMOUS_OPEN_SESSIONS)
+    return getattr(settings, 'SAPELLI_UPLOAD_MAX_OPEN_SESSIONS', DEFAULT_MAX_OPEN_SESSIONS)
+
+
+def get_upload_max_open_size(anonymous=False):
+    """
+    Return the maximum total size (in bytes) of the upload sessions a user (or
+    all anonymous users together) may have open for a project.
+    """
+    if anonymous:
+        return getattr(settings, 'SAPELLI_UPLOAD_MAX_ANONYMOUS_OPEN_SIZE', DEFAULT_MAX_ANONYMOUS_OPEN_SIZE)
+    return getattr(settings, 'SAPELLI_UPLOAD_MAX_OPEN_SIZE', DEFAULT_MAX_OPEN_SIZE)
+
+
+def get_upload_session_ttl():
+    """Return the time (in seconds) after which an idle upload session is discarded."""
+    return getattr(settings, 'SAPELLI_UPLOAD_SESSION_TTL', DEFAULT_SESSION_TTL)
+
+
+def get_upload_dir_path():
+    """
+    Return (and create if needed) the directory holding partially uploaded files.
+
+    Raises
+    ------
+    SapelliException:
+        When the directory could not be created.
+    """
+    from .sapelli_loader import get_sapelli_dir_path  # avoid circular import
+    upload_dir_path = os.path.join(get_sapelli_dir_path(), 'uploads', '')
+    if not os.path.exists(upload_dir_path):
+        try:
+            os.makedirs(upload_dir_path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise SapelliException('Failed to create upload directory (%s): %s' % (upload_dir_path, str(e)))
+    return upload_dir_path
+
+
+def parse_content_range(header):
+    """
+    Parse the Content-Range header of a chunk.
+
+    Returns
+    -------
+    tuple
+        The first and last (inclusive) byte positions and the total size, or
+        None if the header is missing or malformed.
+    """
+    match = CONTENT_RANGE_RE.match((header or '').strip())
+    if match is None:
+        return None
+    return tuple(int(value) for value in match.groups())
+
+
+def add_range(ranges, start, end):
+    """
+    Add a (half-open) range of bytes to a sorted list of disjoint ranges,
+    merging overlapping and adjacent ranges.
+
+    Parameters
+    ----------
+    ranges : list
+        Sorted [start, end) pairs.
+    start : int
+        First byte of the range.
+    end : int
+        Byte after the last one of the range.
+
+    Returns
+    -------
+    list
+        The merged, sorted ranges.
+    """
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def get_missing_ranges(ranges, size):
+    """Return the [first, last] (inclusive) byte ranges not covered by the given ranges."""
+    missing = []
+    position = 0
+    for range_start, range_end in ranges:
+        if range_start > position:
+            missing.append([position, range_start - 1])
+        position = max(position, range_end)
+    if position < size:
+        missing.append([position, size - 1])
+    return missing
+
+
+def open_upload_session(kind, name, size, creator, sapelli_project, anonymous=False):
+    """
+    Opens a new upload session, creating the (empty) file to receive the chunks.
+
+    Parameters
+    ----------
+    kind : str
+        SapelliUploadSession.LOG or SapelliUploadSession.CSV.
+    name : str
+        Name of the uploaded file.
+    size : int
+        Size (in bytes) of the uploaded file.
+    creator : geokey.users.models.User
+        User uploading the file.
+    sapelli_project : SapelliProject
+        Project the file is uploaded to.
+    anonymous : bool
+        Whether the file is uploaded anonymously (optional, see
+        get_upload_max_open_sessions).
+
+    Returns
+    -------
+    SapelliUploadSession
+        The new session.
+
+    Raises
+    ------
+    SapelliException:
+        When the file is too large, the creator has too many (or too large)
+        sessions open for the project, or the file could not be created.
+    """
+    from ..models import SapelliProject, SapelliUploadSession  # avoid circular import
+    if size > get_upload_max_size():
+        raise SapelliException('File is too large (max. %s bytes).' % get_upload_max_size())
+    delete_stale_upload_sessions()
+
+    max_open_sessions = get_upload_max_open_sessions(anonymous)
+    max_open_size = get_upload_max_open_size(anonymous)
+    with transaction.atomic():
+        # Sessions are opened one at a time per project, so that concurrent
+        # requests cannot exceed the limits:
+        SapelliProject.objects.select_for_update().filter(pk=sapelli_project.pk).exists()
+        open_sessions = SapelliUploadSession.objects.filter(
+            creator=creator, sapelli_project=sapelli_project).aggregate(count=Count('pk'), size=Sum('size'))
+        if open_sessions['count'] >= max_open_sessions:
+            raise SapelliException(
+                'Too many uploads open (max. %s), finish or abort some first.' % max_open_sessions)
+        if (open_sessions['size'] or 0) + size > max_open_size:
+            raise SapelliException(
+                'Open uploads are too large (max. %s bytes in total), finish or abort some first.' %
+                max_open_size)
+
+        session = SapelliUploadSession(
+            kind=kind,
+            name=os.path.basename(name),
+            size=size,
+            creator=creator,
+            sapelli_project=sapelli_project)
+        session.path = os.path.join(get_upload_dir_path(), session.key + '.part')
+        try:
+            # The file grows as chunks are written into it (see write_chunk):
+            open(session.path, 'wb').close()
+        except IOError, e:
+            raise SapelliException('Failed to create upload: %s' % str(e))
+        session.save()
+    return session
+
+
+def claim_upload_session(session):
+    """
+    Claims an (open) upload session for finalising it, so that it is only
+    processed once even if it is finalised by concurrent requests.
+
+    Returns
+    -------
+    bool
+        `True` if the session was claimed, `False` if it is being finalised
+        already.
+    """
+    from ..models import SapelliUploadSession  # avoid circular import
+    claimed = SapelliUploadSession.objects.filter(
+        pk=session.pk,
+        status=SapelliUploadSession.OPEN).update(status=SapelliUploadSession.FINALISING)
+    if claimed == 1:
+        session.status = SapelliUploadSession.FINALISING
+    return claimed == 1
+
+
+def release_upload_session(session):
+    """Releases a claimed upload session (when finalising it failed), so it can be finalised again."""
+    from ..models import SapelliUploadSession  # avoid circular import
+    SapelliUploadSession.objects.filter(pk=session.pk).update(status=SapelliUploadSession.OPEN)
+    session.status = SapelliUploadSession.OPEN
+
+
+def write_chunk(session, start, data):
+    """
+    Writes a chunk into the file of an upload session, and records it as received.
+
+    Parameters
+    ----------
+    session : SapelliUploadSession
+        The session.
+    start : int
+        Position of the chunk's first byte in the file.
+    data : str
+        The chunk.
+
+    Returns
+    -------
+    SapelliUploadSession
+        The updated session.
+    """
+    from ..models import SapelliUploadSession  # avoid circular import
+    with open(session.path, 'r+b') as part_file:
+        part_file.seek(start)
+        part_file.write(data)
+        part_file.flush()
+        os.fsync(part_file.fileno())
+
+    with transaction.atomic():
+        session = SapelliUploadSession.objects.select_for_update().get(pk=session.pk)
+        session.received = json.dumps(add_range(session.get_received_ranges(), start, start + len(data)))
+        session.save()
+    return session
+
+
+def delete_stale_upload_sessions():
+    """Delete upload sessions (and their files) which have been idle for too long."""
+    from ..models import SapelliUploadSession  # avoid circular import
+    stale = SapelliUploadSession.objects.filter(
+        updated_at__lt=timezone.now() - timedelta(seconds=get_upload_session_ttl()))
+    for session in stale:
+        session.delete()
@@ -0,0 +1,160 @@
+"""
+Generates ZIP archives as a stream of chunks, without ever seeking back in
+the output, so archives can be sent to the client while they are being built.
+
+Each entry is written with a trailing data descriptor (general purpose flag
+bit 3), which is how ZIP allows the CRC and sizes to follow the data. The
+ZIP64 extensions are not supported, so archives are limited to 4 GiB and
+65535 entries.
+"""
+
+import struct
+import zlib
+
+from zipfile import ZIP_DEFLATED, ZIP_STORED
+
+LOCAL_FILE_HEADER = struct.Struct('<4s2B4HL2L2H')
+DATA_DESCRIPTOR = struct.Struct('<4sLLL')
+CENTRAL_DIRECTORY_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+END_OF_CENTRAL_DIRECTORY = struct.Struct('<4s4H2LH')
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+VERSION = 20  # 2.0: deflate & data descriptors
+CREATE_SYSTEM_UNIX = 3
+EXTERNAL_ATTR = 0100644 << 16  # regular file, rw-r--r--
+MAX_SIZE = 0xFFFFFFFF
+MAX_ENTRIES = 0xFFFF
+CHUNK_SIZE = 64 * 1024
+
+
+def dos_date_time(date_time):
+    """Return the (time, date) pair in MS-DOS format for the given datetime."""
+    year = max(date_time.year, 1980)
+    return (
+        (date_time.hour << 11) | (date_time.minute << 5) | (date_time.second // 2),
+        ((year - 1980) << 9) | (date_time.month << 5) | date_time.day)
+
+
+class ZipStream(object):
+    """
+    Builds a ZIP archive entry by entry. Each method returns a generator
+    which yields the bytes to append to the output.
+    """
+
+    def __init__(self, compress_level=6):
+        self.compress_level = compress_level
+        self.offset = 0
+        self.central_directory = []
+
+    def _emit(self, data):
+        self.offset += len(data)
+        if self.offset > MAX_SIZE:
+            raise ValueError('ZIP archive exceeds 4 GiB, which is not supported.')
+        return data
+
+    def _local_header(self, arcname, date_time, compress_type):
+        if len(self.central_directory) >= MAX_ENTRIES:
+            raise ValueError('ZIP archive exceeds %s entries, which is not supported.' % MAX_ENTRIES)
+        if isinstance(arcname, unicode):
+            filename = arcname.encode('utf-8')
+            flags = FLAG_DATA_DESCRIPTOR | FLAG_UTF8
+        else:
+            filename = arcname
+            flags = FLAG_DATA_DESCRIPTOR
+        dos_time, dos_date = dos_date_time(date_time)
+        entry = {
+            'filename': filename,
+            'flags': flags,
+            'compress_type': compress_type,
+            'dos_time': dos_time,
+            'dos_date': dos_date,
+            'header_offset': self.offset,
+        }
+        header = LOCAL_FILE_HEADER.pack(
+            b'PK\x03\x04', VERSION, 0, flags, compress_type, dos_time, dos_date,
+            0, 0, 0, len(filename), 0)
+        return entry, header + filename
+
+    def _data_descriptor(self, entry, crc, compress_size, file_size):
+        entry.update({'crc': crc, 'compress_size': compress_size, 'file_size': file_size})
+        self.central_directory.append(entry)
+        return DATA_DESCRIPTOR.pack(b'PK\x07\x08', crc, compress_size, file_size)
+
+    def add_file(self, arcname, fileobj, date_time):
+        """
+        Adds an entry holding the (deflated) contents of the given file.
+
+        Parameters
+        ----------
+        arcname : str or unicode
+            Name of the entry in the archive.
+        fileobj : file
+            Open file (or file-like object) to read the contents from.
+        date_time : datetime.datetime
+            Modification time of the entry.
+        """
+        entry, header = self._local_header(arcname, date_time, ZIP_DEFLATED)
+        yield self._emit(header)
+
+        compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, -15)
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        for data in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+            crc = zlib.crc32(data, crc)
+            file_size += len(data)
+            compressed = compressor.compress(data)
+            if compressed:
+                compress_size += len(compressed)
+                yield self._emit(compressed)
+        compressed = compressor.flush()
+        compress_size += len(compressed)
+        yield self._emit(compressed)
+
+        yield self._emit(self._data_descriptor(entry, crc & 0xFFFFFFFF, compress_size, file_size))
+
+    def add_raw(self, arcname, date_time, compress_type, crc, compress_size, file_size, chunks):
+        """
+        Adds an entry from data which is already compressed (e.g. copied from
+        another ZIP archive or a gzip file), without compressing it again.
+
+        Parameters
+        ----------
+        arcname : str or unicode
+            Name of the entry in the archive.
+        date_time : datetime.datetime
+            Modification time of the entry.
+        compress_type : int
+            zipfile.ZIP_DEFLATED (raw deflate stream) or zipfile.ZIP_STORED.
+        crc : int
+            CRC-32 of the uncompressed data.
+        compress_size : int
+            Size of the compressed data.
+        file_size : int
+            Size of the uncompressed data.
+        chunks : iterable
+            The compressed data.
+        """
+        if compress_type not in (ZIP_DEFLATED, ZIP_STORED):
+            raise ValueError('Unsupported compression type: %s' % compress_type)
+        entry, header = self._local_header(arcname, date_time, compress_type)
+        yield self._emit(header)
+        for data in chunks:
+            yield self._emit(data)
+        yield self._emit(self._data_descriptor(entry, crc & 0xFFFFFFFF, compress_size, file_size))
+
+    def close(self):
+        """Ends the archive by writing the central directory."""
+        central_directory_offset = self.offset
+        for entry in self.central_directory:
+            yield self._emit(CENTRAL_DIRECTORY_HEADER.pack(
+                b'PK\x01\x02', VERSION, CREATE_SYSTEM_UNIX, VERSION, 0,
+                entry['flags'], entry['compress_type'], entry['dos_time'], entry['dos_date'],
+                entry['crc'], entry['compress_size'], entry['file_size'],
+                len(entry['filename']), 0, 0, 0, 0,
+                EXTERNAL_ATTR, entry['header_offset']) + entry['filename'])
+        yield self._emit(END_OF_CENTRAL_DIRECTORY.pack(
+            b'PK\x05\x06', 0, 0,
+            len(self.central_directory), len(self.central_directory),
+            self.offset - central_directory_offset, central_directory_offset, 0))
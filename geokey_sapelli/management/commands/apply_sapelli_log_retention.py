@@ -0,0 +1,64 @@
+"""Applies the log retention periods of Sapelli projects."""
+
+from django.core.management.base import BaseCommand
+
+from geokey_sapelli.models import SapelliProject
+from geokey_sapelli.helper.log_retention import (
+    DEFAULT_BATCH_SIZE,
+    get_log_retention_days,
+    get_log_archive_retention_days,
+    apply_log_retention
+)
+
+
+class Command(BaseCommand):
+    """
+    Compacts log files past their project's retention period into monthly
+    archives, and deletes archives past their retention period. Meant to be
+    run periodically (e.g. daily, from cron); runs which are interrupted are
+    completed by the next one.
+    """
+
+    help = 'Compacts and deletes Sapelli log files past their retention period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project',
+            type=int,
+            help='Only apply the retention period of this (GeoKey) project.')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Number of logs to archive or delete at once.')
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Seconds to pause after each batch, to limit the I/O load.')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            default=False,
+            help='Only report what would be compacted and deleted.')
+
+    def handle(self, *args, **options):
+        sapelli_projects = SapelliProject.objects.order_by('pk')
+        if options['project']:
+            sapelli_projects = sapelli_projects.filter(pk=options['project'])
+
+        for sapelli_project in sapelli_projects:
+            if (get_log_retention_days(sapelli_project) is None and
+                    get_log_archive_retention_days(sapelli_project) is None):
+                continue
+            result = apply_log_retention(
+                sapelli_project,
+                batch_size=options['batch_size'],
+                sleep=options['sleep'],
+                dry_run=options['dry_run'])
+            self.stdout.write('%s project %s: %s log file(s) compacted into %s monthly archive(s), %s archive(s) deleted.' % (
+                'Would apply to' if options['dry_run'] else 'Applied to',
+                sapelli_project.pk,
+                result['compacted'],
+                result['archives'],
+                result['deleted_archives']))
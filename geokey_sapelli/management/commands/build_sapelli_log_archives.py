@@ -0,0 +1,45 @@
+"""Adds existing Sapelli log files to the daily log archives."""
+
+from django.core.management.base import BaseCommand
+
+from geokey_sapelli.models import SapelliLogFile
+from geokey_sapelli.helper.log_archives import append_to_daily_archives
+
+
+class Command(BaseCommand):
+    """
+    Adds log files stored before the daily archives were enabled (or which
+    failed to be added at the time) to the daily archives. Logs which are
+    already archived are skipped, so the command can safely be run again.
+    """
+
+    help = 'Adds existing Sapelli log files to the daily log archives.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project',
+            type=int,
+            help='Only archive the logs of this (GeoKey) project.')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of logs to add at once.')
+
+    def handle(self, *args, **options):
+        logs = SapelliLogFile.objects.order_by('sapelli_project', 'created_at', 'id')
+        if options['project']:
+            logs = logs.filter(sapelli_project_id=options['project'])
+
+        batch = []
+        count = 0
+        for log in logs.iterator():
+            batch.append(log)
+            if len(batch) >= options['batch_size']:
+                append_to_daily_archives(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            append_to_daily_archives(batch)
+            count += len(batch)
+        self.stdout.write('Checked %s log file(s).' % count)
@@ -0,0 +1,31 @@
+"""Computes the content hashes of existing Sapelli log files."""
+
+from django.core.management.base import BaseCommand
+
+from geokey_sapelli.models import SapelliLogFile
+
+
+class Command(BaseCommand):
+    """
+    Computes the content hashes of log files stored before they were recorded,
+    so that devices do not upload them again (and duplicates are detected).
+    """
+
+    help = 'Computes the content hashes of existing Sapelli log files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project',
+            type=int,
+            help='Only hash the logs of this (GeoKey) project.')
+
+    def handle(self, *args, **options):
+        logs = SapelliLogFile.objects.filter(content_hash__isnull=True).order_by('id')
+        if options['project']:
+            logs = logs.filter(sapelli_project_id=options['project'])
+
+        count = 0
+        for log in logs.iterator():
+            if log.get_content_hash():
+                count += 1
+        self.stdout.write('Hashed %s log file(s).' % count)
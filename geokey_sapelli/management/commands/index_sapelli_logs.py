@@ -0,0 +1,41 @@
+"""Indexes the contents of existing Sapelli log files, for searching them."""
+
+from django.core.management.base import BaseCommand
+
+from geokey_sapelli.models import SapelliLogFile
+from geokey_sapelli.helper.log_index import index_log_file
+
+
+class Command(BaseCommand):
+    """
+    Indexes log files stored before the log index was enabled (or which failed
+    to be indexed at the time). Logs which are already indexed are skipped
+    (unless --reindex is given), so the command can safely be run again.
+    """
+
+    help = 'Indexes the contents of existing Sapelli log files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--project',
+            type=int,
+            help='Only index the logs of this (GeoKey) project.')
+        parser.add_argument(
+            '--reindex',
+            action='store_true',
+            default=False,
+            help='Index logs again, even if they have been indexed already.')
+
+    def handle(self, *args, **options):
+        logs = SapelliLogFile.objects.order_by('sapelli_project', 'created_at', 'id')
+        if options['project']:
+            logs = logs.filter(sapelli_project_id=options['project'])
+        if not options['reindex']:
+            logs = logs.filter(entries__isnull=True)
+
+        count = 0
+        entry_count = 0
+        for log in logs.iterator():
+            entry_count += index_log_file(log)
+            count += 1
+        self.stdout.write('Indexed %s line(s) of %s log file(s).' % (entry_count, count))
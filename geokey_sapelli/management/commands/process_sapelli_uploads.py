@@ -0,0 +1,48 @@
+"""Worker processing queued Sapelli project (SAP) uploads."""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from geokey_sapelli.helper.upload_queue import (
+    process_next_upload_job,
+    fail_stale_upload_jobs
+)
+
+
+class Command(BaseCommand):
+    """
+    Processes queued SAP uploads, one at a time, until interrupted.
+
+    Run several instances to process uploads in parallel (the number of Java
+    processes running at once remains capped by SAPELLI_JAVA_MAX_CONCURRENT).
+    """
+
+    help = 'Processes queued Sapelli project (SAP) uploads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            default=False,
+            help='Process all queued uploads, then exit.')
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait before polling an empty queue again.')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            failed = fail_stale_upload_jobs()
+            if failed:
+                self.stderr.write('Marked %s interrupted upload(s) as failed.' % failed)
+            job = process_next_upload_job()
+            if job is not None:
+                self.stdout.write('Upload %s: %s' % (job.id, job.phase))
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
@@ -85,13 +85,66 @@ class SapelliProjectManager(Manager):
         -------
         geokey_sapelli.SapelliProject
         """
-        for sapelli_project in self.get_queryset():
-            if sapelli_project.sapelli_id == int(sapelli_project_id) and sapelli_project.sapelli_fingerprint == int(sapelli_project_fingerprint):
-                if not user or sapelli_project.geokey_project.can_contribute(user):
-                    return sapelli_project
-                else:
-                    raise PermissionDenied('User cannot contribute to project')
-        raise self.model.DoesNotExist
+        sapelli_project = self.get_by_sapelli_info(sapelli_project_id, sapelli_project_fingerprint)
+        if not user or sapelli_project.geokey_project.can_contribute(user):
+            return sapelli_project
+        else:
+            raise PermissionDenied('User cannot contribute to project')
+
+    def get_by_sapelli_info(self, sapelli_project_id, sapelli_project_fingerprint):
+        """
+        Return the Sapelli project identified by the given sapelli_project_id
+        and sapelli_project_fingerprint, which is either that of its current
+        version or that of a version it was upgraded from.
+
+        Parameters
+        ----------
+        sapelli_project_id : int
+            Identifies the Sapelli project.
+        sapelli_project_fingerprint : int
+            Identifies the version of the Sapelli project.
+
+        Returns
+        -------
+        geokey_sapelli.SapelliProject
+
+        Raises
+        ------
+        SapelliProject.DoesNotExist
+            When there is no such project.
+        """
+        projects = self.get_queryset().filter(sapelli_id=int(sapelli_project_id))
+        sapelli_project = (
+            projects.filter(sapelli_fingerprint=int(sapelli_project_fingerprint)).first() or
+            projects.filter(
+                previous_versions__sapelli_fingerprint=int(sapelli_project_fingerprint)
+            ).order_by('-geokey_project__created_at').first())
+        if sapelli_project is None:
+            raise self.model.DoesNotExist
+        return sapelli_project
+
+    def get_single_for_upgrade(self, user, sapelli_project_id):
+        """
+        Return the most recently created Sapelli project, identified by the
+        given sapelli_project_id, that the user can administrate.
+
+        Parameters
+        ----------
+        user : geokey.users.models.User
+            User projects are filtered for.
+        sapelli_project_id : int
+            Identifies the Sapelli project (regardless of its version/fingerprint).
+
+        Returns
+        -------
+        geokey_sapelli.SapelliProject
+        """
+        sapelli_project = self.get_list_for_administration(user).filter(
+            sapelli_id=sapelli_project_id,
+            geokey_project__status='active').order_by('-geokey_project__created_at').first()
+        if sapelli_project is None:
+            raise self.model.DoesNotExist
+        return sapelli_project
 
     def get_single_for_administration(self, user, project_id):
         """
@@ -130,3 +183,43 @@ class SapelliProjectManager(Manager):
             if sapelli_project.geokey_project.id == int(project_id):
                 return sapelli_project
         raise self.model.DoesNotExist
+
+
+class SapelliUploadJobManager(Manager):
+    """Custom manager for geokey_sapelli.SapelliUploadJob."""
+
+    def get_list_for_user(self, user):
+        """
+        Return all upload jobs the user can follow.
+
+        Parameters
+        ----------
+        user : geokey.users.models.User
+            User jobs are filtered for.
+
+        Returns
+        -------
+        django.db.models.query.QuerySet
+            List of upload jobs queued by the user (all jobs for superusers).
+        """
+        if user.is_superuser:
+            return self.get_queryset()
+
+        return self.get_queryset().filter(creator=user)
+
+    def get_single_for_user(self, user, job_id):
+        """
+        Return a single upload job the user can follow.
+
+        Parameters
+        ----------
+        user : geokey.users.models.User
+            User jobs are filtered for.
+        job_id : int
+            Identifies the upload job in the database.
+
+        Returns
+        -------
+        geokey_sapelli.SapelliUploadJob
+        """
+        return self.get_list_for_user(user).get(pk=job_id)
@@ -0,0 +1,83 @@
+"""
+Optional middleware timing requests to the Sapelli API.
+
+Add it to the middleware of the GeoKey settings, and enable it:
+
+    MIDDLEWARE_CLASSES += ('geokey_sapelli.middleware.SapelliTimingMiddleware',)
+    SAPELLI_REQUEST_TIMING = True
+
+For every request to `/api/sapelli/` the number and time of the database
+queries, the time spent waiting for and running Java and the total time of the
+view are then returned as `Server-Timing` headers and logged (as JSON) to the
+`geokey_sapelli.timing` logger.
+"""
+
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.deprecation import MiddlewareMixin
+
+from .helper.java_runner import track_java_runs
+from .helper.query_stats import count_queries
+
+logger = logging.getLogger('geokey_sapelli.timing')
+
+API_PATH = '/api/sapelli/'
+
+
+def get_server_timing(timing):
+    """Return the value of the Server-Timing header for a request's timing."""
+    return ', '.join([
+        'db;dur=%.1f;desc="%s queries"' % (timing['db_ms'], timing['queries']),
+        'java-wait;dur=%.1f' % timing['java_wait_ms'],
+        'java;dur=%.1f;desc="%s runs"' % (timing['java_ms'], timing['java_runs']),
+        'total;dur=%.1f' % timing['total_ms'],
+    ])
+
+
+class SapelliTimingMiddleware(MiddlewareMixin):
+    """
+    Counts the database queries and times the views (and the Java runs) of
+    requests to the Sapelli API.
+    """
+
+    def __init__(self, get_response=None):
+        if not getattr(settings, 'SAPELLI_REQUEST_TIMING', False):
+            raise MiddlewareNotUsed()
+        super(SapelliTimingMiddleware, self).__init__(get_response)
+
+    def process_request(self, request):
+        if not request.path_info.startswith(API_PATH):
+            return
+        queries = count_queries()
+        java_runs = track_java_runs()
+        request._sapelli_timing = (time.time(), queries, queries.__enter__(), java_runs, java_runs.__enter__())
+
+    def process_response(self, request, response):
+        state = getattr(request, '_sapelli_timing', None)
+        if state is None:
+            return response
+        del request._sapelli_timing
+        start, queries, query_stats, java_runs, java_usage = state
+        java_runs.__exit__(None, None, None)
+        queries.__exit__(None, None, None)
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        timing = {
+            'method': request.method,
+            'path': request.path_info,
+            'view': resolver_match.url_name if resolver_match else None,
+            'status': response.status_code,
+            'queries': query_stats.count,
+            'db_ms': query_stats.time * 1000,
+            'java_runs': java_usage['runs'],
+            'java_wait_ms': java_usage['wait'] * 1000,
+            'java_ms': java_usage['time'] * 1000,
+            'total_ms': (time.time() - start) * 1000,
+        }
+        response['Server-Timing'] = get_server_timing(timing)
+        logger.info(json.dumps(timing, sort_keys=True))
+        return response
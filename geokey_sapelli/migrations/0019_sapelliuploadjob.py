@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.conf import settings
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('geokey_sapelli', '0018_sapellilogfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SapelliUploadJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('sap_path', models.CharField(max_length=511)),
+                ('phase', models.CharField(default=b'stored', max_length=15, choices=[(b'stored', b'Stored'), (b'extracting', b'Extracting'), (b'mapping', b'Mapping'), (b'done', b'Done'), (b'failed', b'Failed')])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('extract_duration', models.FloatField(null=True)),
+                ('mapping_duration', models.FloatField(null=True)),
+                ('error', models.TextField(null=True)),
+                ('java_stacktrace', models.TextField(null=True)),
+                ('creator', models.ForeignKey(to=settings.AUTH_USER_MODEL)),
+                ('sapelli_project', models.ForeignKey(related_name='upload_jobs', on_delete=django.db.models.deletion.SET_NULL, to='geokey_sapelli.SapelliProject', null=True)),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+            },
+        ),
+    ]
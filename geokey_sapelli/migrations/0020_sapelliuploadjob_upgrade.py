@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geokey_sapelli', '0019_sapelliuploadjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sapelliuploadjob',
+            name='upgrade',
+            field=models.BooleanField(default=False),
+        ),
+    ]
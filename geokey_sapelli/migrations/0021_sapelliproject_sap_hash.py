@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geokey_sapelli', '0020_sapelliuploadjob_upgrade'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sapelliproject',
+            name='sap_hash',
+            field=models.CharField(max_length=64, null=True),
+        ),
+    ]
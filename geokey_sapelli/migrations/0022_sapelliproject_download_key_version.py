@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geokey_sapelli', '0021_sapelliproject_sap_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sapelliproject',
+            name='download_key_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geokey_sapelli', '0022_sapelliproject_download_key_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sapellilogfile',
+            name='compression',
+            field=models.CharField(choices=[('gzip', 'gzip'), ('zstd', 'Zstandard')], max_length=15, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.conf import settings
+import geokey_sapelli.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('geokey_sapelli', '0023_sapellilogfile_compression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SapelliUploadSession',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('key', models.CharField(default=geokey_sapelli.models.generate_upload_session_key, unique=True, max_length=32)),
+                ('kind', models.CharField(max_length=3, choices=[(b'log', b'Log file'), (b'csv', b'CSV records')])),
+                ('name', models.CharField(max_length=100)),
+                ('size', models.BigIntegerField()),
+                ('path', models.CharField(max_length=511)),
+                ('received', models.TextField(default=b'[]')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('creator', models.ForeignKey(to=settings.AUTH_USER_MODEL)),
+                ('sapelli_project', models.ForeignKey(related_name='upload_sessions', to='geokey_sapelli.SapelliProject')),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geokey_sapelli', '0024_sapelliuploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SapelliLogEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('line_number', models.IntegerField()),
+                ('timestamp', models.DateTimeField()),
+                ('device_id', models.BigIntegerField(null=True)),
+                ('level', models.CharField(max_length=10, choices=[(b'debug', b'Debug'), (b'info', b'Info'), (b'warning', b'Warning'), (b'error', b'Error')])),
+                ('event_type', models.CharField(max_length=100, blank=True)),
+                ('message', models.TextField(blank=True)),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+                ('log_file', models.ForeignKey(related_name='entries', to='geokey_sapelli.SapelliLogFile')),
+                ('sapelli_project', models.ForeignKey(related_name='log_entries', to='geokey_sapelli.SapelliProject')),
+            ],
+            options={
+                'ordering': ['-timestamp', '-id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='sapellilogentry',
+            index=models.Index(fields=['sapelli_project', '-timestamp', '-id'], name='sapelli_log_entry_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sapellilogentry',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='sapelli_log_entry_search_idx'),
+        ),
+    ]
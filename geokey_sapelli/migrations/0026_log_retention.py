@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geokey_sapelli', '0025_sapellilogentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sapelliproject',
+            name='log_retention_days',
+            field=models.PositiveIntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='sapelliproject',
+            name='log_archive_retention_days',
+            field=models.PositiveIntegerField(null=True, blank=True),
+        ),
+        migrations.CreateModel(
+            name='SapelliLogArchive',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('month', models.DateField()),
+                ('log_count', models.IntegerField(default=0)),
+                ('size', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('sapelli_project', models.ForeignKey(related_name='log_archives', to='geokey_sapelli.SapelliProject')),
+            ],
+            options={
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='sapellilogarchive',
+            unique_together=set([('sapelli_project', 'month')]),
+        ),
+    ]
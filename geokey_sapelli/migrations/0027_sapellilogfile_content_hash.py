@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geokey_sapelli', '0026_log_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sapellilogfile',
+            name='content_hash',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='sapellilogfile',
+            index=models.Index(fields=['sapelli_project', 'content_hash'], name='sapelli_log_file_hash_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('geokey_sapelli', '0027_sapellilogfile_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SapelliDownloadKey',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('sapelli_project', models.ForeignKey(related_name='download_keys', to='geokey_sapelli.SapelliProject')),
+                ('user', models.ForeignKey(to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='sapellidownloadkey',
+            unique_together=set([('sapelli_project', 'user')]),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geokey_sapelli', '0028_sapellidownloadkey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SapelliPreviousVersion',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', models.CharField(default='0', max_length=63)),
+                ('sapelli_fingerprint', models.IntegerField()),
+                ('sapelli_model_id', models.BigIntegerField()),
+                ('sapelli_project', models.ForeignKey(related_name='previous_versions', to='geokey_sapelli.SapelliProject')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SapelliPreviousFormSchema',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('sapelli_model_id', models.BigIntegerField()),
+                ('sapelli_model_schema_number', models.IntegerField()),
+                ('sapelli_form', models.ForeignKey(related_name='previous_schemas', to='geokey_sapelli.SapelliForm')),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geokey_sapelli', '0029_sapellipreviousversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sapellilogfile',
+            name='compression',
+            field=models.CharField(choices=[(b'gzip', b'gzip'), (b'zstd', b'Zstandard')], max_length=15, null=True),
+        ),
+        migrations.AddField(
+            model_name='sapelliuploadsession',
+            name='status',
+            field=models.CharField(default=b'open', max_length=15, choices=[(b'open', b'Open'), (b'finalising', b'Finalising')]),
+        ),
+    ]
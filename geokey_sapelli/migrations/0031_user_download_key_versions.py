@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+from django.db import migrations, models
+
+
+def copy_user_download_key_versions(apps, schema_editor):
+    SapelliProject = apps.get_model('geokey_sapelli', 'SapelliProject')
+    SapelliDownloadKey = apps.get_model('geokey_sapelli', 'SapelliDownloadKey')
+    for sapelli_project in SapelliProject.objects.filter(download_keys__isnull=False).distinct():
+        user_versions = dict(
+            (str(user_id), version)
+            for user_id, version in SapelliDownloadKey.objects.filter(
+                sapelli_project=sapelli_project).values_list('user_id', 'version'))
+        SapelliProject.objects.filter(pk=sapelli_project.pk).update(
+            user_download_key_versions=json.dumps(user_versions))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geokey_sapelli', '0030_sapelliuploadsession_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sapelliproject',
+            name='user_download_key_versions',
+            field=models.TextField(default=b'{}'),
+        ),
+        migrations.RunPython(copy_user_download_key_versions, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='SapelliDownloadKey',
+        ),
+    ]
@@ -1,15 +1,21 @@
+import hashlib
 import json
 import re
 import os
 import shutil
+import uuid
 
 from datetime import timedelta, datetime
 from pytz import utc
 
-from django.db import models
+from django.db import models, transaction
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.dispatch import receiver
 from django.conf import settings
 from django.utils import timezone
+from django.core.urlresolvers import reverse
+from django.utils.http import urlencode
 
 from geokey.projects.models import Project
 from geokey.contributions.models import Observation
@@ -18,12 +24,42 @@ from geokey.applications.models import Application
 from oauth2_provider.models import AccessToken
 from oauthlib.common import generate_token
 
-from .manager import SapelliProjectManager
+from .manager import SapelliProjectManager, SapelliUploadJobManager
 
 from .helper.sapelli_exceptions import SapelliException, SapelliCSVException
 
 from .helper.csv_helpers import UnicodeDictReader
-
+from .helper.metrics import metrics
+from .helper.import_timing import (
+    HEADER,
+    FORM,
+    MAPPING,
+    LOOKUP,
+    COMPARISON,
+    VALIDATION,
+    SAVE,
+    NullTimer,
+    run_profiled
+)
+from .helper.import_memory import MemoryBudget, get_memory_budget_kb
+from .helper.token_cache import invalidate_cached_token
+from .helper.background import run_in_background
+from .helper.log_archives import (
+    daily_archives_enabled,
+    append_to_daily_archives,
+    get_project_archives_path,
+    get_monthly_archive_path
+)
+from .helper.file_responses import file_sha256
+from .helper.log_compression import (
+    COMPRESSIONS,
+    get_log_compression,
+    compress_log_file,
+    open_log_file
+)
+from .helper.upload_sessions import get_missing_ranges
+from .helper.download_links import sign_log_file
+from .helper.log_index import log_index_enabled, index_log_file
 
 class SapelliProject(models.Model):
     """
@@ -42,22 +78,93 @@ class SapelliProject(models.Model):
     sapelli_model_id = models.BigIntegerField(default=-1)
     dir_path = models.CharField(max_length=511, null=True)
     sap_path = models.CharField(max_length=511, null=True)
+    sap_hash = models.CharField(max_length=64, null=True)
+    download_key_version = models.PositiveIntegerField(default=0)
+    user_download_key_versions = models.TextField(default='{}')  # JSON dict of user id to key version
+    log_retention_days = models.PositiveIntegerField(null=True, blank=True)
+    log_archive_retention_days = models.PositiveIntegerField(null=True, blank=True)
 
     objects = SapelliProjectManager()
 
-    def delete(self):
+    def delete(self, background_cleanup=False):
+        """
+        Deletes the project and its files.
+
+        Parameter
+        ---------
+        background_cleanup : bool
+            If True, the files are removed in a background thread once the
+            current transaction is committed, rather than right away.
+        """
+        paths = (self.sap_path, self.dir_path and os.path.dirname(self.dir_path), get_project_archives_path(self.pk))
+        # Call super delete method:
+        super(SapelliProject, self).delete()
+        if background_cleanup:
+            transaction.on_commit(lambda: run_in_background(SapelliProject.remove_files, *paths))
+        else:
+            SapelliProject.remove_files(*paths)
+
+    @staticmethod
+    def remove_files(sap_path, project_dir_path, archives_path):
+        """
+        Removes the files of a (deleted) project: its SAP file, its project
+        folder and its daily log archives.
+        """
         # Remove SAP file:
         try:
-            os.remove(self.sap_path)
+            os.remove(sap_path)
         except BaseException:
             pass
         # Remove project folder:
         try:
-            shutil.rmtree(os.path.dirname(self.dir_path), ignore_errors=True)
+            shutil.rmtree(project_dir_path, ignore_errors=True)
         except BaseException:
             pass
-        # Call super delete method:
-        super(SapelliProject, self).delete()
+        # Remove daily log archives:
+        shutil.rmtree(archives_path, ignore_errors=True)
+
+    def get_download_key_version(self, user_id):
+        """
+        Returns the version of the key signing the SAP download links issued
+        to a user (see helper.download_links), which changes when the links of
+        the project or those of the user are revoked. Both are stored on the
+        project, so no further query is needed.
+        """
+        user_version = json.loads(self.user_download_key_versions).get(str(user_id), 0)
+        return '%s.%s' % (self.download_key_version, user_version)
+
+    def revoke_download_links(self, user=None):
+        """
+        Revokes the signed SAP download links of the project.
+
+        Parameter
+        ---------
+        user : geokey.users.models.User
+            If given, only the links issued to this user are revoked (optional).
+        """
+        if user is None:
+            SapelliProject.objects.filter(pk=self.pk).update(download_key_version=models.F('download_key_version') + 1)
+            return
+        with transaction.atomic():
+            sapelli_project = SapelliProject.objects.select_for_update().get(pk=self.pk)
+            user_versions = json.loads(sapelli_project.user_download_key_versions)
+            user_versions[str(user.id)] = user_versions.get(str(user.id), 0) + 1
+            SapelliProject.objects.filter(pk=self.pk).update(user_download_key_versions=json.dumps(user_versions))
+
+    def get_sap_hash(self):
+        """
+        Returns the SHA-256 hash of the SAP file, computing (and storing) it if
+        it is not known yet (e.g. for projects uploaded before it was recorded).
+
+        Returns
+        -------
+        str
+            The (hex) hash, or None if there is no (readable) SAP file.
+        """
+        if not self.sap_hash and self.sap_path:
+            self.sap_hash = file_sha256(self.sap_path)
+            SapelliProject.objects.filter(pk=self.pk).update(sap_hash=self.sap_hash)
+        return self.sap_hash
 
     def get_description(self):
         """
@@ -94,7 +201,7 @@ class SapelliProject(models.Model):
                 'geokey_category_id': form.category.id})
         return description
 
-    def import_from_csv(self, user, csv_file, form_category_id=None):
+    def import_from_csv(self, user, csv_file, form_category_id=None, timer=None, profile_path=None):
         """
         Reads an uploaded CSV file and creates the contributions and returns
         the number of contributions created, updated and ignored.
@@ -111,6 +218,10 @@ class SapelliProject(models.Model):
             which generated the data in the CSV file. This is only really used
             if the CSV file header does not contain Form identification info
             (i.e. modelID & modelSchemaNumber).
+        timer : geokey_sapelli.helper.import_timing.ImportTimer
+            optionally collects the time spent in each stage of the import.
+        profile_path : str
+            optionally the path to save a cProfile profile of the import to.
 
         Returns
         -------
@@ -129,8 +240,26 @@ class SapelliProject(models.Model):
         ------
         SapelliCSVException
             When no Sapelli Project/Form (known on this server, and accessible by this user) can be found
-            which matches the one used to generate the data in the CSV file.
+            which matches the one used to generate the data in the CSV file,
+            or when the import goes over its memory budget
+            (SAPELLI_IMPORT_MEMORY_BUDGET).
         """
+        if profile_path is not None:
+            if timer is not None:
+                timer.profile_path = profile_path
+            return run_profiled(profile_path, self.import_from_csv, user, csv_file, form_category_id, timer=timer)
+        timer = timer or NullTimer()
+        try:
+            with metrics.timed('sapelli_csv_import_duration_seconds'):
+                result = self._import_from_csv(user, csv_file, form_category_id, timer)
+        finally:
+            timer.stop()
+        outcomes = ('imported', 'imported_joined_locations', 'imported_no_location', 'updated', 'ignored_duplicate')
+        for outcome, count in zip(outcomes, result):
+            metrics.inc('sapelli_csv_rows_total', count, outcome=outcome)
+        return result
+
+    def _import_from_csv(self, user, csv_file, form_category_id, timer):
         # Make sure form_category_id is an int (or None):
         if form_category_id is None or form_category_id == '':
             form_category_id = None
@@ -141,54 +270,27 @@ class SapelliProject(models.Model):
         if csv_file is None:
             raise SapelliCSVException('No file provided')
 
-        # Sapelli Collector produces CSV files in 'utf-8-sig' encoding (= UTF8 with BOM):
-        reader = UnicodeDictReader(csv_file, encoding='utf-8-sig')
+        with timer.span(HEADER):
+            # Sapelli Collector produces CSV files in 'utf-8-sig' encoding (= UTF8 with BOM):
+            reader = UnicodeDictReader(csv_file, encoding='utf-8-sig')
 
-        # Parse modelID & modelSchemaNumber from header row:
-        model_id = None
-        model_schema_number = None
-        try:
-            model_id = int(re.match(
-                r"modelID=(?P<model_id_str>[0-9]+)",
-                [fn for fn in reader.fieldnames if fn.startswith('modelID=')][0])
-                           .group('model_id_str'))
-            model_schema_number = int(re.match(
-                r"modelSchemaNumber=(?P<model_schema_number_str>[0-9]+)",
-                [fn for fn in reader.fieldnames if fn.startswith('modelSchemaNumber=')][0])
-                                      .group('model_schema_number_str'))
-        except BaseException:
-            pass
-
-        # Get form and perform checks:
-        if (model_id is not None) and (model_schema_number is not None):
-            # Form identification found in CSV header row...
-            # Check if this is the right project (with matching model_id):
-            if model_id != self.sapelli_model_id:
-                raise SapelliCSVException(
-                    'modelID mismatch (CSV: %s; project "%s": %s), '
-                    'data in CSV file was probably generated using '
-                    'another Sapelli project (version).' %
-                    (model_id, self.geokey_project.name, self.sapelli_model_id))
-            # Get form using model_schema_number:
+            # Parse modelID & modelSchemaNumber from header row:
+            model_id = None
+            model_schema_number = None
             try:
-                form = self.forms.get(sapelli_model_schema_number=model_schema_number)
-            except SapelliForm.DoesNotExist:
-                raise SapelliCSVException('No Form with modelSchemaNumber %s found in Project "%s".' % (
-                model_schema_number, self.geokey_project.name))
-            # Check if form matches form_category_id given in request:
-            if (form_category_id is not None) and form_category_id != form.category.id:
-                raise SapelliCSVException(
-                    'The data in the CSV file was not created using selected form "%s".' % form.sapelli_id)
-        elif (form_category_id is not None):
-            # No Form identification found in CSV header row, use form_category_id given in request...
-            try:
-                form = self.forms.get(pk=form_category_id)
-            except SapelliForm.DoesNotExist:
-                raise SapelliCSVException(
-                    'No Form with category_id %s found in Project "%s".' % (form_category_id, self.geokey_project.name))
-        else:
-            # No Form identification found in CSV header row, nor in request...
-            raise SapelliCSVException('No Form identification found in CSV header row, please select appropriate form.')
+                model_id = int(re.match(
+                    r"modelID=(?P<model_id_str>[0-9]+)",
+                    [fn for fn in reader.fieldnames if fn.startswith('modelID=')][0])
+                               .group('model_id_str'))
+                model_schema_number = int(re.match(
+                    r"modelSchemaNumber=(?P<model_schema_number_str>[0-9]+)",
+                    [fn for fn in reader.fieldnames if fn.startswith('modelSchemaNumber=')][0])
+                                          .group('model_schema_number_str'))
+            except BaseException:
+                pass
+
+        with timer.span(FORM):
+            form = self._get_csv_form(model_id, model_schema_number, form_category_id)
 
         imported = 0
         imported_joined_locations = 0
@@ -196,104 +298,134 @@ class SapelliProject(models.Model):
         updated = 0
         ignored_duplicate = 0
 
+        from geokey.contributions.serializers import ContributionSerializer
+
+        # Fields of the form and the lookup values of their items, cached for
+        # the import (and dropped whenever its memory budget is hit):
+        location_fields = list(form.location_fields.all())
+        fields = list(form.fields.all())
+        fields_with_items = set(form.fields.filter(items__isnull=False).values_list('pk', flat=True))
+        lookup_values = {}
+
+        def shrink():
+            lookup_values.clear()
+            # Fetch the fields again, without the related objects cached on them:
+            location_fields[:] = form.location_fields.all()
+            fields[:] = form.fields.all()
+
+        budget = MemoryBudget(get_memory_budget_kb(), shrink=shrink)
+
         for row in reader:
-            joined_locations = False
-            dummy_location = False
-
-            coordinates = []
-            for sapelli_location_field in form.location_fields.all():
-                sapelli_id = sapelli_location_field.sapelli_id
-                longitute = row['%s.Longitude' % sapelli_id]
-                latitute = row['%s.Latitude' % sapelli_id]
-                if longitute and latitute:
-                    coordinates.append('[%s, %s]' % (
-                        float(longitute),
-                        float(latitute)))
-
-            if len(coordinates) > 1:
-                coordinates = ', '.join(coordinates)
-                geometry = '{ "type": "MultiPoint", "coordinates": [ %s ] }' % coordinates
-                joined_locations = True
-            else:
-                if len(coordinates) == 1:
-                    coordinates = coordinates[0]
+            with timer.span(MAPPING):
+                joined_locations = False
+                dummy_location = False
+
+                coordinates = []
+                for sapelli_location_field in location_fields:
+                    sapelli_id = sapelli_location_field.sapelli_id
+                    longitute = row['%s.Longitude' % sapelli_id]
+                    latitute = row['%s.Latitude' % sapelli_id]
+                    if longitute and latitute:
+                        coordinates.append('[%s, %s]' % (
+                            float(longitute),
+                            float(latitute)))
+
+                if len(coordinates) > 1:
+                    coordinates = ', '.join(coordinates)
+                    geometry = '{ "type": "MultiPoint", "coordinates": [ %s ] }' % coordinates
+                    joined_locations = True
                 else:
-                    coordinates = '[0.0, 0.0]'
-                    dummy_location = True
-
-                geometry = '{ "type": "Point", "coordinates": %s }' % coordinates
-
-            feature = {
-                "location": {
-                    "geometry": geometry
-                },
-                "properties": {
-                    "DeviceId": row['DeviceID'],
-                    "StartTime": row['StartTime']
-                },
-                "meta": {
-                    "category": form.category.id
+                    if len(coordinates) == 1:
+                        coordinates = coordinates[0]
+                    else:
+                        coordinates = '[0.0, 0.0]'
+                        dummy_location = True
+
+                    geometry = '{ "type": "Point", "coordinates": %s }' % coordinates
+
+                feature = {
+                    "location": {
+                        "geometry": geometry
+                    },
+                    "properties": {
+                        "DeviceId": row['DeviceID'],
+                        "StartTime": row['StartTime']
+                    },
+                    "meta": {
+                        "category": form.category.id
+                    }
                 }
-            }
-
-            for sapelli_field in form.fields.all():
-                key = sapelli_field.field.key
-
-                value = row[sapelli_field.sapelli_id]
 
-                if sapelli_field.truefalse:
-                    value = 0 if value == 'false' else 1
+                for sapelli_field in fields:
+                    key = sapelli_field.field.key
 
-                if value:
-                    if sapelli_field.items.count() > 0:
-                        leaf = sapelli_field.items.get(number=value)
-                        value = leaf.lookup_value.id
+                    value = row[sapelli_field.sapelli_id]
 
-                    feature['properties'][key] = value
+                    if sapelli_field.truefalse:
+                        value = 0 if value == 'false' else 1
 
-            from geokey.contributions.serializers import ContributionSerializer
+                    if value:
+                        if sapelli_field.pk in fields_with_items:
+                            leaf_key = (sapelli_field.pk, value)
+                            if leaf_key not in lookup_values:
+                                lookup_values[leaf_key] = sapelli_field.items.values_list(
+                                    'lookup_value_id', flat=True).get(number=value)
+                            value = lookup_values[leaf_key]
 
-            try:
-                observation = self.geokey_project.observations.get(
-                    category_id=form.category.id,
-                    properties__StartTime=row['StartTime'],
-                    properties__DeviceId=row['DeviceID']
-                )
+                        feature['properties'][key] = value
 
-                equal = True
+            with timer.span(LOOKUP):
+                try:
+                    observation = self.geokey_project.observations.get(
+                        category_id=form.category.id,
+                        properties__StartTime=row['StartTime'],
+                        properties__DeviceId=row['DeviceID']
+                    )
+                except Observation.DoesNotExist:
+                    observation = None
 
-                if json.loads(feature['location']['geometry']) != json.loads(observation.location.geometry.json):
-                    equal = False
+            if observation is not None:
+                with timer.span(COMPARISON):
+                    equal = True
 
-                if len(feature['properties']) != len(observation.properties):
-                    equal = False
+                    if json.loads(feature['location']['geometry']) != json.loads(observation.location.geometry.json):
+                        equal = False
 
-                for key in feature['properties']:
-                    if feature['properties'][key] != observation.properties[key]:
+                    if len(feature['properties']) != len(observation.properties):
                         equal = False
 
+                    for key in feature['properties']:
+                        if feature['properties'][key] != observation.properties[key]:
+                            equal = False
+
                 if not equal:
+                    with timer.span(VALIDATION):
+                        serializer = ContributionSerializer(
+                            observation,
+                            data=feature,
+                            context={'user': user, 'project': self.geokey_project}
+                        )
+                        valid = serializer.is_valid(raise_exception=True)
+
+                    if valid:
+                        with timer.span(SAVE):
+                            serializer.save()
+
+                    updated += 1
+                else:
+                    ignored_duplicate += 1
+            else:
+                with timer.span(VALIDATION):
                     serializer = ContributionSerializer(
-                        observation,
                         data=feature,
                         context={'user': user, 'project': self.geokey_project}
                     )
+                    valid = serializer.is_valid(raise_exception=True)
 
-                    if serializer.is_valid(raise_exception=True):
+                if valid:
+                    with timer.span(SAVE):
                         serializer.save()
 
-                    updated += 1
-                else:
-                    ignored_duplicate += 1
-            except Observation.DoesNotExist:
-                serializer = ContributionSerializer(
-                    data=feature,
-                    context={'user': user, 'project': self.geokey_project}
-                )
-
-                if serializer.is_valid(raise_exception=True):
-                    serializer.save()
-
                 if joined_locations:
                     imported_joined_locations += 1
                 elif dummy_location:
@@ -301,20 +433,81 @@ class SapelliProject(models.Model):
                 else:
                     imported += 1
 
+            budget.row_done()
+
         return imported, imported_joined_locations, imported_no_location, updated, ignored_duplicate
 
+    def _get_csv_form(self, model_id, model_schema_number, form_category_id):
+        """
+        Return the form which generated the data in a CSV file, identified by
+        the header row of the file or else by the form_category_id given.
+        """
+        if (model_id is not None) and (model_schema_number is not None):
+            # Form identification found in CSV header row...
+            # Check if this is the right project (with matching model_id, of
+            # the current version or of one it was upgraded from):
+            if model_id == self.sapelli_model_id:
+                forms = self.forms.filter(sapelli_model_schema_number=model_schema_number)
+            elif self.previous_versions.filter(sapelli_model_id=model_id).exists():
+                forms = self.forms.filter(
+                    previous_schemas__sapelli_model_id=model_id,
+                    previous_schemas__sapelli_model_schema_number=model_schema_number)
+            else:
+                raise SapelliCSVException(
+                    'modelID mismatch (CSV: %s; project "%s": %s), '
+                    'data in CSV file was probably generated using '
+                    'another Sapelli project (version).' %
+                    (model_id, self.geokey_project.name, self.sapelli_model_id))
+            # Get form using model_schema_number:
+            try:
+                form = forms.get()
+            except SapelliForm.DoesNotExist:
+                raise SapelliCSVException('No Form with modelSchemaNumber %s found in Project "%s".' % (
+                model_schema_number, self.geokey_project.name))
+            # Check if form matches form_category_id given in request:
+            if (form_category_id is not None) and form_category_id != form.category.id:
+                raise SapelliCSVException(
+                    'The data in the CSV file was not created using selected form "%s".' % form.sapelli_id)
+        elif (form_category_id is not None):
+            # No Form identification found in CSV header row, use form_category_id given in request...
+            try:
+                form = self.forms.get(pk=form_category_id)
+            except SapelliForm.DoesNotExist:
+                raise SapelliCSVException(
+                    'No Form with category_id %s found in Project "%s".' % (form_category_id, self.geokey_project.name))
+        else:
+            # No Form identification found in CSV header row, nor in request...
+            raise SapelliCSVException('No Form identification found in CSV header row, please select appropriate form.')
+
+        return form
+
+
+@receiver(models.signals.post_init, sender=Project)
+def post_init_project(sender, instance, **kwargs):
+    """
+    Receiver that is called after a project is instantiated. Remembers its
+    status, so that post_save_project can tell whether it has changed.
+    """
+    # Read from __dict__, so that a deferred status is not loaded:
+    instance._sapelli_saved_status = instance.__dict__.get('status')
+
 
 @receiver(models.signals.post_save, sender=Project)
 def post_save_project(sender, instance, **kwargs):
     """
     Receiver that is called after a project is saved. Deletes related Sapelli
-    project, when original project is marked as deleted.
+    project, when original project is marked as deleted (i.e. its status has
+    changed to deleted), removing its files in the background.
     """
-    if instance.status == 'deleted':
-        try:
-            SapelliProject.objects.get(geokey_project=instance).delete()
-        except BaseException:
-            pass
+    # Read from __dict__, so that a deferred status is not loaded:
+    status = instance.__dict__.get('status')
+    previous_status = getattr(instance, '_sapelli_saved_status', None)
+    instance._sapelli_saved_status = status
+    if status != 'deleted' or previous_status == 'deleted':
+        return
+    sapelli_project = SapelliProject.objects.filter(geokey_project=instance).first()
+    if sapelli_project is not None:
+        sapelli_project.delete(background_cleanup=True)
 
 
 @receiver(models.signals.pre_delete, sender=Project)
@@ -347,6 +540,33 @@ class SapelliForm(models.Model):
     sapelli_model_schema_number = models.IntegerField(default=-1)
 
 
+class SapelliPreviousVersion(models.Model):
+    """
+    Represents a version a SapelliProject was upgraded from, so that devices
+    still running it can find the project and upload their data.
+    """
+    sapelli_project = models.ForeignKey(
+        'SapelliProject',
+        related_name='previous_versions'
+    )
+    version = models.CharField(max_length=63, default='0')
+    sapelli_fingerprint = models.IntegerField()
+    sapelli_model_id = models.BigIntegerField()
+
+
+class SapelliPreviousFormSchema(models.Model):
+    """
+    Represents the model schema number a SapelliForm had in a version its
+    project was upgraded from (see SapelliPreviousVersion).
+    """
+    sapelli_form = models.ForeignKey(
+        'SapelliForm',
+        related_name='previous_schemas'
+    )
+    sapelli_model_id = models.BigIntegerField()
+    sapelli_model_schema_number = models.IntegerField()
+
+
 class LocationField(models.Model):
     """
     Represents a Location field.
@@ -392,6 +612,19 @@ class SapelliItem(models.Model):
     )
 
 
+def get_log_created_at(name):
+    """
+    Return the (UTC) time a log file was created at, as given by its name
+    (`Collector_<%Y-%m-%dT%H.%M.%S>.log`), or the current time.
+    """
+    try:
+        date_string = re.search('Collector_(.+).log', name).group(1)
+        created_at = datetime.strptime(date_string, '%Y-%m-%dT%H.%M.%S')
+    except:
+        created_at = datetime.utcnow()
+    return created_at.replace(tzinfo=utc)
+
+
 class SapelliLogFile(models.Model):
     """Represents a Sapelli log file."""
 
@@ -400,6 +633,8 @@ class SapelliLogFile(models.Model):
     created_at = models.DateTimeField(auto_now_add=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     file = models.FileField(upload_to='sapelli/logs/%Y/%m/%d/')
+    compression = models.CharField(max_length=15, choices=COMPRESSIONS, null=True)
+    content_hash = models.CharField(max_length=64, null=True)  # SHA-256 of the (uncompressed) contents
     sapelli_project = models.ForeignKey(
         'SapelliProject',
         related_name='logs')
@@ -408,6 +643,11 @@ class SapelliLogFile(models.Model):
         """Class meta information."""
 
         ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(
+                fields=['sapelli_project', 'content_hash'],
+                name='sapelli_log_file_hash_idx'),
+        ]
 
     @property
     def type_name(self):
@@ -415,30 +655,418 @@ class SapelliLogFile(models.Model):
         return 'SapelliLogFile'
 
     @classmethod
-    def create(cls, name, creator, sapelli_project, file):
-        """Create Sapelli log file."""
+    def build(cls, name, creator, sapelli_project, file):
+        """
+        Build (but do not save) a Sapelli log file, compressing the file and
+        hashing its contents.
+        """
+        created_at = get_log_created_at(file.name)
+        name = name or file.name
         try:
-            date_string = re.search('Collector_(.+).log', file.name).group(1)
-            created_at = datetime.strptime(date_string, '%Y-%m-%dT%H.%M.%S')
-        except:
-            created_at = datetime.utcnow()
+            size = file.size
+        except (AttributeError, IOError, OSError):  # e.g. unseekable streams
+            size = None
+        metrics.inc('sapelli_log_uploads_total')
+        metrics.inc('sapelli_log_upload_bytes_total', size or 0)
+        compression = get_log_compression()
+        digest = hashlib.sha256()
+        if compression:
+            file = compress_log_file(file, compression, digest)
+        else:
+            for chunk in file.chunks():
+                digest.update(chunk)
 
-        instance = cls(
-            name=name or file.name,
+        return cls(
+            name=name,
             creator=creator,
-            created_at=created_at.replace(tzinfo=utc),
+            created_at=created_at,
             file=file,
+            compression=compression,
+            content_hash=digest.hexdigest(),
             sapelli_project=sapelli_project)
-        instance.save()
 
+    @classmethod
+    def create(cls, name, creator, sapelli_project, file):
+        """
+        Create Sapelli log file, unless the project has a log with the same
+        contents already (which is returned instead).
+        """
+        instance = cls.build(name, creator, sapelli_project, file)
+        saved, duplicates = cls.save_many([instance])
+        if duplicates:
+            return cls.objects.filter(
+                sapelli_project=sapelli_project,
+                content_hash=instance.content_hash).order_by('id')[0]
         return instance
 
+    @classmethod
+    def save_many(cls, instances):
+        """
+        Save Sapelli log files (built with `build`) with a single INSERT,
+        skipping logs whose contents their project has already. Uploads to
+        the same project are serialised (by locking its row), so that logs
+        uploaded concurrently are not both saved.
+
+        Parameters
+        ----------
+        instances : list
+            The unsaved SapelliLogFile instances.
+
+        Returns
+        -------
+        tuple
+            The saved instances and those skipped as duplicates.
+        """
+        project_ids = set(instance.sapelli_project_id for instance in instances)
+        with transaction.atomic():
+            # Locked in a consistent order, so that uploads cannot deadlock:
+            list(SapelliProject.objects.select_for_update().filter(
+                pk__in=project_ids).order_by('pk').values_list('pk', flat=True))
+            existing = set(cls.objects.filter(
+                sapelli_project__in=project_ids,
+                content_hash__in=set(instance.content_hash for instance in instances),
+            ).values_list('sapelli_project', 'content_hash'))
+
+            saved = []
+            duplicates = []
+            for instance in instances:
+                key = (instance.sapelli_project_id, instance.content_hash)
+                if key in existing:
+                    duplicates.append(instance)
+                else:
+                    existing.add(key)
+                    saved.append(instance)
+
+            if saved:
+                cls.objects.bulk_create(saved)
+
+        if saved:
+            cls.add_to_archives_and_index(saved)
+        return saved, duplicates
+
+    @classmethod
+    def add_to_archives_and_index(cls, instances):
+        """Add (saved) log files to the daily archives and the log index."""
+        if daily_archives_enabled():
+            append_to_daily_archives(instances)
+        if log_index_enabled():
+            for instance in instances:
+                index_log_file(instance)
+
+    def get_url(self):
+        """
+        Return the URL to access this file: its media URL or, when stored
+        compressed, a signed link which (like the media URL) works for anyone
+        who has it and decompresses the file on the fly.
+        """
+        if self.compression:
+            return '%s?%s' % (
+                reverse('geokey_sapelli:log_file_api', kwargs={
+                    'project_id': self.sapelli_project_id,
+                    'log_id': self.pk}),
+                urlencode({'signature': sign_log_file(self.sapelli_project_id, self.pk)}))
+        return self.file.url
+
+    def open_decompressed(self):
+        """Open the file attached for reading its (decompressed) contents."""
+        return open_log_file(self.file.path, self.compression)
+
+    def get_content_hash(self):
+        """
+        Returns the SHA-256 hash of the (uncompressed) contents, computing (and
+        storing) it if it is not known yet (e.g. for logs uploaded before it
+        was recorded).
+
+        Returns
+        -------
+        str
+            The (hex) hash, or None if the file could not be read.
+        """
+        if not self.content_hash:
+            digest = hashlib.sha256()
+            try:
+                with self.open_decompressed() as log_file:
+                    for data in iter(lambda: log_file.read(64 * 1024), b''):
+                        digest.update(data)
+            except (IOError, SapelliException):
+                return None
+            self.content_hash = digest.hexdigest()
+            SapelliLogFile.objects.filter(pk=self.pk).update(content_hash=self.content_hash)
+        return self.content_hash
+
     def delete(self):
         """Delete Sapelli log file with the actual file attached."""
         self.file.delete()
         super(SapelliLogFile, self).delete()
 
 
+class SapelliLogEntry(models.Model):
+    """
+    Represents a line of a Sapelli log file, indexed (with full-text search)
+    to search the logs of a project.
+    """
+
+    DEBUG = 'debug'
+    INFO = 'info'
+    WARNING = 'warning'
+    ERROR = 'error'
+    LEVELS = (
+        (DEBUG, 'Debug'),
+        (INFO, 'Info'),
+        (WARNING, 'Warning'),
+        (ERROR, 'Error'),
+    )
+
+    log_file = models.ForeignKey(
+        'SapelliLogFile',
+        related_name='entries')
+    sapelli_project = models.ForeignKey(
+        'SapelliProject',
+        related_name='log_entries')
+    line_number = models.IntegerField()
+    timestamp = models.DateTimeField()
+    device_id = models.BigIntegerField(null=True)
+    level = models.CharField(max_length=10, choices=LEVELS)
+    event_type = models.CharField(max_length=100, blank=True)
+    message = models.TextField(blank=True)
+    search_vector = SearchVectorField(null=True)
+
+    class Meta:
+        """Class meta information."""
+
+        ordering = ['-timestamp', '-id']
+        indexes = [
+            models.Index(
+                fields=['sapelli_project', '-timestamp', '-id'],
+                name='sapelli_log_entry_time_idx'),
+            GinIndex(fields=['search_vector'], name='sapelli_log_entry_search_idx'),
+        ]
+
+    def to_dict(self):
+        """Return a dictionary describing the entry."""
+        return {
+            'id': self.id,
+            'log_file': self.log_file_id,
+            'line_number': self.line_number,
+            'timestamp': self.timestamp.isoformat(),
+            'device_id': self.device_id,
+            'level': self.level,
+            'event_type': self.event_type,
+            'message': self.message,
+        }
+
+
+class SapelliLogArchive(models.Model):
+    """
+    Represents the archive of the log files of a month which were compacted
+    after the project's log retention period.
+    """
+
+    sapelli_project = models.ForeignKey(
+        'SapelliProject',
+        related_name='log_archives')
+    month = models.DateField()
+    log_count = models.IntegerField(default=0)
+    size = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        """Class meta information."""
+
+        ordering = ['-month']
+        unique_together = ('sapelli_project', 'month')
+
+    @property
+    def name(self):
+        """Return the file name of the archive."""
+        return 'Logs_%s.zip' % self.month.strftime('%Y-%m')
+
+    def get_path(self):
+        """Return the absolute path of the archive file."""
+        return get_monthly_archive_path(self.sapelli_project_id, self.month)
+
+    def delete(self):
+        """Delete the archive with the actual file."""
+        try:
+            os.remove(self.get_path())
+        except OSError:
+            pass
+        super(SapelliLogArchive, self).delete()
+
+
+class SapelliUploadJob(models.Model):
+    """
+    Represents the (background) processing of an uploaded SAP file: it is
+    stored, extracted by the Sapelli Collector CmdLn client and mapped into a
+    GeoKey project.
+    """
+
+    STORED = 'stored'
+    EXTRACTING = 'extracting'
+    MAPPING = 'mapping'
+    DONE = 'done'
+    FAILED = 'failed'
+    PHASES = (
+        (STORED, 'Stored'),
+        (EXTRACTING, 'Extracting'),
+        (MAPPING, 'Mapping'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    creator = models.ForeignKey(settings.AUTH_USER_MODEL)
+    sap_path = models.CharField(max_length=511)
+    upgrade = models.BooleanField(default=False)
+    phase = models.CharField(max_length=15, choices=PHASES, default=STORED)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    extract_duration = models.FloatField(null=True)
+    mapping_duration = models.FloatField(null=True)
+    error = models.TextField(null=True)
+    java_stacktrace = models.TextField(null=True)
+    sapelli_project = models.ForeignKey(
+        'SapelliProject',
+        null=True,
+        on_delete=models.SET_NULL,
+        related_name='upload_jobs')
+
+    objects = SapelliUploadJobManager()
+
+    class Meta:
+        """Class meta information."""
+
+        ordering = ['created_at', 'id']
+
+    @property
+    def is_finished(self):
+        """Return `True` if processing has completed (successfully or not)."""
+        return self.phase in (self.DONE, self.FAILED)
+
+    @property
+    def upgraded(self):
+        """Return `True` if the job upgraded a previously created project."""
+        return (
+            self.sapelli_project is not None and
+            self.sapelli_project.geokey_project.created_at < self.created_at)
+
+    def set_phase(self, phase):
+        """Move the job to the given phase and save it."""
+        self.phase = phase
+        if self.is_finished:
+            self.finished_at = timezone.now()
+        self.save()
+
+    def get_status(self):
+        """
+        Generates a dictionary describing the state of the job.
+
+        Returns
+        -------
+        dict
+            Dictionary with the phase, timing and outcome of the job
+        """
+        status = {
+            'id': self.id,
+            'phase': self.phase,
+            'upgrade': self.upgrade,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'timings': {
+                'queued': ((self.started_at or timezone.now()) - self.created_at).total_seconds(),
+                'extracting': self.extract_duration,
+                'mapping': self.mapping_duration,
+            },
+        }
+        if self.phase == self.FAILED:
+            status['error'] = self.error
+            if self.java_stacktrace is not None:
+                status['java_stacktrace'] = self.java_stacktrace
+        if self.phase == self.DONE and self.sapelli_project is not None:
+            status['project'] = self.sapelli_project.get_description()
+        return status
+
+
+def generate_upload_session_key():
+    """Return a new (random) key identifying an upload session."""
+    return uuid.uuid4().hex
+
+
+class SapelliUploadSession(models.Model):
+    """
+    Represents a resumable upload of a log or CSV file, which is sent in
+    chunks (byte ranges) and processed once all of them have been received.
+    """
+
+    LOG = 'log'
+    CSV = 'csv'
+    KINDS = (
+        (LOG, 'Log file'),
+        (CSV, 'CSV records'),
+    )
+
+    OPEN = 'open'
+    FINALISING = 'finalising'
+    STATUSES = (
+        (OPEN, 'Open'),
+        (FINALISING, 'Finalising'),
+    )
+
+    key = models.CharField(max_length=32, unique=True, default=generate_upload_session_key)
+    kind = models.CharField(max_length=3, choices=KINDS)
+    status = models.CharField(max_length=15, choices=STATUSES, default=OPEN)
+    name = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    path = models.CharField(max_length=511)
+    received = models.TextField(default='[]')  # JSON list of [start, end) byte ranges
+    creator = models.ForeignKey(settings.AUTH_USER_MODEL)
+    sapelli_project = models.ForeignKey(
+        'SapelliProject',
+        related_name='upload_sessions')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def get_received_ranges(self):
+        """Return the sorted, disjoint [start, end) byte ranges received so far."""
+        return json.loads(self.received)
+
+    @property
+    def is_complete(self):
+        """Return `True` if all bytes of the file have been received."""
+        return not get_missing_ranges(self.get_received_ranges(), self.size)
+
+    def get_status(self):
+        """
+        Generates a dictionary describing the state of the upload.
+
+        Returns
+        -------
+        dict
+            Dictionary with the number of bytes received and the (inclusive)
+            byte ranges still missing
+        """
+        received_ranges = self.get_received_ranges()
+        return {
+            'id': self.key,
+            'kind': self.kind,
+            'name': self.name,
+            'size': self.size,
+            'received': sum(end - start for start, end in received_ranges),
+            'missing': get_missing_ranges(received_ranges, self.size),
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat(),
+        }
+
+    def delete(self):
+        """Delete the upload session with the (partially) received file."""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        super(SapelliUploadSession, self).delete()
+
+
 class SAPDownloadQRLink(models.Model):
     """
     Represents a temporary link (embedded in a QR image) that
@@ -491,8 +1119,10 @@ class SAPDownloadQRLink(models.Model):
 @receiver(models.signals.pre_delete, sender=AccessToken)
 def pre_delete_access_token(sender, instance, **kwargs):
     """
-    Receiver that is called after an AccessToken is deleted. Deletes related SAPDownloadQRLink.
+    Receiver that is called after an AccessToken is deleted. Deletes related SAPDownloadQRLink
+    and drops the token from the token cache.
     """
+    invalidate_cached_token(instance.token)
     try:
         SAPDownloadQRLink.objects.get(access_token=instance).delete()
     except BaseException:
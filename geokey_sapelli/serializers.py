@@ -73,4 +73,4 @@ class SapelliLogFileSerializer(serializers.ModelSerializer):
         str
             The URL to access the file on client side.
         """
-        return obj.file.url
+        return obj.get_url()
@@ -0,0 +1,9 @@
+"""
+Benchmarks (not run as part of the tests).
+
+Run them with e.g.:
+
+    SAPELLI_BENCHMARK_ROWS=1000,10000 python manage.py test geokey_sapelli.tests.benchmarks.bench_csv_import
+    SAPELLI_FAKE_JAVA_DELAY=2 python manage.py test geokey_sapelli.tests.benchmarks.bench_sap_loading
+    SAPELLI_LOAD_DEVICES=50 python travis_ci/manage.py test geokey_sapelli.tests.benchmarks.load_test
+"""
@@ -0,0 +1,86 @@
+"""
+Benchmark of SapelliProject.import_from_csv.
+
+Each case imports synthetic CSV files of 1k, 10k and 100k rows (or the sizes
+given, comma-separated, by the SAPELLI_BENCHMARK_ROWS environment variable),
+into a new project each time:
+
+- all-new: every record is new;
+- all-duplicate: every record was imported before;
+- half-updated: half of the records were imported before with other values;
+- multi-location: every (new) record has two locations.
+
+The rows/s, queries per row and peak memory of each import are printed, and
+saved as JSON (see utils.save_results), for comparison across commits (see
+the compare module).
+"""
+
+import sys
+
+from django.test import TestCase
+
+from geokey.users.tests.model_factories import UserFactory
+
+from ..model_factories import create_horniman_sapelli_project, create_2locations_sapelli_project
+from .csv_generator import generate_csv
+from .utils import measure, save_results, get_benchmark_rows
+
+
+class CSVImportBenchmark(TestCase):
+
+    results = []
+
+    @classmethod
+    def tearDownClass(cls):
+        super(CSVImportBenchmark, cls).tearDownClass()
+        if cls.results:
+            path = save_results('csv_import', cls.results)
+            sys.stderr.write('\nSaved CSV import benchmark results to %s\n' % path)
+
+    def run_case(self, case, create_project, rows, variant=0, updated_every=1, import_first=False):
+        user = UserFactory.create()
+        sapelli_project = create_project(user)
+        form = sapelli_project.forms.all()[0]
+
+        if import_first:
+            csv_file = generate_csv(form, rows)
+            sapelli_project.import_from_csv(user, csv_file)
+            csv_file.close()
+
+        csv_file = generate_csv(form, rows, variant=variant, updated_every=updated_every)
+        with measure(rows) as result:
+            counts = sapelli_project.import_from_csv(user, csv_file)
+        csv_file.close()
+
+        result['case'] = case
+        result['imported'], result['imported_joined_locations'], result['imported_no_location'], \
+            result['updated'], result['ignored_duplicate'] = counts
+        self.results.append(result)
+        sys.stderr.write(
+            '\n%(case)s, %(rows)s rows: %(rows_per_second)s rows/s, '
+            '%(queries_per_row)s queries/row, peak memory %(peak_memory_kb)s KiB' % dict(
+                {'peak_memory_kb': None}, **result))
+        return counts
+
+    def test_all_new(self):
+        for rows in get_benchmark_rows():
+            counts = self.run_case('all-new', create_horniman_sapelli_project, rows)
+            self.assertEqual(counts[0], rows)
+
+    def test_all_duplicate(self):
+        for rows in get_benchmark_rows():
+            counts = self.run_case('all-duplicate', create_horniman_sapelli_project, rows, import_first=True)
+            self.assertEqual(counts[4], rows)
+
+    def test_half_updated(self):
+        for rows in get_benchmark_rows():
+            counts = self.run_case(
+                'half-updated', create_horniman_sapelli_project, rows,
+                variant=1, updated_every=2, import_first=True)
+            self.assertEqual(counts[3], (rows + 1) // 2)
+            self.assertEqual(counts[4], rows // 2)
+
+    def test_multi_location(self):
+        for rows in get_benchmark_rows():
+            counts = self.run_case('multi-location', create_2locations_sapelli_project, rows)
+            self.assertEqual(counts[1], rows)
@@ -0,0 +1,100 @@
+"""
+Benchmark of loading SAP files (sapelli_loader.load_from_sap), with the
+SapColCmdLn client replaced by the fake_java stand-in.
+
+Synthetic projects of (forms x fields x items) 1x5x10, 5x20x20 and 20x50x50
+(or those given, comma-separated, by the SAPELLI_BENCHMARK_SAP_SIZES
+environment variable) are each loaded SAPELLI_BENCHMARK_REPEAT times (default
+3), reporting the median of the times spent storing the file, parsing it (the
+Java run, which takes SAPELLI_FAKE_JAVA_DELAY seconds) and creating the
+project. The results are saved as JSON (see utils.save_results).
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from django.core.files import File
+from django.test import TestCase, override_settings
+
+from geokey.users.tests.model_factories import UserFactory
+
+from ...helper.sapelli_loader import store_sap_file, load_from_sap_path
+from .sap_builder import build_project_info, build_sap
+from .utils import measure, save_results
+
+FAKE_JAVA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_java.py')
+
+
+def get_sap_sizes(default='1x5x10,5x20x20,20x50x50'):
+    """Return the (forms, fields, items) sizes of the projects to load."""
+    return [
+        tuple(int(number) for number in size.split('x'))
+        for size in os.environ.get('SAPELLI_BENCHMARK_SAP_SIZES', default).split(',') if size.strip()]
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+@override_settings(
+    SAPELLI_JAVA_COMMAND=[sys.executable, FAKE_JAVA],
+    SAPELLI_JAR=FAKE_JAVA)  # never run, but must exist
+class SAPLoadingBenchmark(TestCase):
+
+    def setUp(self):
+        self.sap_dir = tempfile.mkdtemp()
+        self.repeat = int(os.environ.get('SAPELLI_BENCHMARK_REPEAT') or 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.sap_dir)
+
+    def load(self, user, sap_path):
+        """Load a SAP file the way load_from_sap does, timing each phase."""
+        phases = {}
+
+        def on_phase(phase):
+            phases[phase] = time.time()
+
+        with measure() as result:
+            start = time.time()
+            with open(sap_path, 'rb') as sap_file:
+                stored_path = store_sap_file(File(sap_file), user)
+            stored = time.time()
+            load_from_sap_path(stored_path, user, on_phase=on_phase)
+            end = time.time()
+
+        result['storage_seconds'] = stored - start
+        result['parse_seconds'] = phases['mapping'] - phases['extracting']
+        result['create_project_seconds'] = end - phases['mapping']
+        return result
+
+    def test_load_from_sap(self):
+        results = []
+        for forms, fields, items in get_sap_sizes():
+            user = UserFactory.create()
+            runs = []
+            for run in range(self.repeat):
+                sap_path = os.path.join(self.sap_dir, 'Benchmark_%s.sap' % run)
+                build_sap(sap_path, build_project_info(forms, fields, items))
+                runs.append(self.load(user, sap_path))
+
+            result = dict((key, median([run[key] for run in runs])) for key in runs[0])
+            result.update({
+                'case': 'sap-%sx%sx%s' % (forms, fields, items),
+                'forms': forms,
+                'fields': fields,
+                'items': items,
+                'runs': self.repeat,
+                'java_delay': float(os.environ.get('SAPELLI_FAKE_JAVA_DELAY') or 0),
+            })
+            results.append(result)
+            sys.stderr.write(
+                '\n%(case)s: %(seconds).3fs (storage %(storage_seconds).3fs, parse %(parse_seconds).3fs, '
+                'create project %(create_project_seconds).3fs), %(queries)s queries' % result)
+
+        path = save_results('sap_loading', results)
+        sys.stderr.write('\nSaved SAP loading benchmark results to %s\n' % path)
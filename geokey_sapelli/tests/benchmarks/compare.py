@@ -0,0 +1,53 @@
+"""
+Compares the results of two benchmark runs (as saved by utils.save_results):
+
+    python -m geokey_sapelli.tests.benchmarks.compare before.json after.json
+"""
+
+import json
+import sys
+
+METRICS = (
+    'seconds',
+    'rows_per_second',
+    'queries_per_row',
+    'storage_seconds',
+    'parse_seconds',
+    'create_project_seconds',
+    'queries',
+    'peak_memory_kb',
+    'requests_per_second',
+    'p50_ms',
+    'p95_ms',
+    'p99_ms',
+    'errors',
+)
+
+
+def load_results(path):
+    """Return the results of a saved run, by case and number of rows."""
+    with open(path) as results_file:
+        run = json.load(results_file)
+    return run, dict(((result['case'], result.get('rows')), result) for result in run['results'])
+
+
+def compare(before_path, after_path, output=sys.stdout):
+    """Write a table of the metrics of both runs (and their ratio) for each case."""
+    before_run, before = load_results(before_path)
+    after_run, after = load_results(after_path)
+    output.write('%s (%s) -> %s (%s)\n' % (
+        before_path, before_run.get('commit'), after_path, after_run.get('commit')))
+    for key in sorted(set(before) & set(after)):
+        output.write('%s, %s rows:\n' % key if key[1] is not None else '%s:\n' % key[0])
+        for metric in METRICS:
+            old, new = before[key].get(metric), after[key].get(metric)
+            if old is None and new is None:
+                continue
+            ratio = ' (x%.2f)' % (float(new) / old) if old and new is not None else ''
+            output.write('  %-16s %12s -> %12s%s\n' % (metric, old, new, ratio))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    compare(sys.argv[1], sys.argv[2])
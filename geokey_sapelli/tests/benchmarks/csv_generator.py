@@ -0,0 +1,94 @@
+"""
+Generation of synthetic Sapelli CSV exports, for any SapelliForm.
+"""
+
+import csv
+import tempfile
+
+from datetime import datetime, timedelta
+
+from django.core.files import File
+
+DEVICE_IDS = (4136949986, 1752196661, 2094712305, 3177104542)
+START = datetime(2015, 1, 1)
+
+
+def _get_value(sapelli_field, numbers, row_index, variant):
+    """Return the CSV value of a field in a row (differing per variant)."""
+    if numbers:
+        return str(numbers[(row_index + variant) % len(numbers)])
+    if sapelli_field.truefalse:
+        return 'true' if (row_index + variant) % 2 == 0 else 'false'
+    return 'Value %s-%s' % (row_index, variant)
+
+
+def generate_csv(form, rows, variant=0, updated_every=1, location_fields=None):
+    """
+    Generates a CSV file as exported by Sapelli Collector for a form, with a
+    record per row (identified by its StartTime and DeviceID).
+
+    Parameters
+    ----------
+    form : SapelliForm
+        Form the records were collected with.
+    rows : int
+        Number of records.
+    variant : int
+        Generating the same rows with another variant changes the values of
+        the records (optional).
+    updated_every : int
+        Only change the values of every n-th record in another variant, so
+        e.g. 2 changes half of the records (optional).
+    location_fields : int
+        Number of the form's location fields to fill in (optional, defaults
+        to all of them).
+
+    Returns
+    -------
+    django.core.files.File
+        The CSV file (a temporary file, deleted when closed).
+    """
+    sapelli_location_ids = [lf.sapelli_id for lf in form.location_fields.all()]
+    if location_fields is not None:
+        filled_location_ids = sapelli_location_ids[:location_fields]
+    else:
+        filled_location_ids = sapelli_location_ids
+    sapelli_fields = [
+        (sapelli_field, sorted(sapelli_field.items.values_list('number', flat=True)))
+        for sapelli_field in form.fields.all()
+    ]
+
+    header = ['StartTime', 'DeviceID']
+    for sapelli_id in sapelli_location_ids:
+        header.extend(['%s.Latitude' % sapelli_id, '%s.Longitude' % sapelli_id])
+    header.extend(sapelli_field.sapelli_id for sapelli_field, numbers in sapelli_fields)
+    header.extend([
+        'modelID=%s' % form.sapelli_project.sapelli_model_id,
+        'modelSchemaNumber=%s' % form.sapelli_model_schema_number])
+
+    csv_file = tempfile.TemporaryFile()
+    csv_file.write('\xef\xbb\xbf')  # Sapelli Collector writes UTF-8 with BOM
+    writer = csv.writer(csv_file)
+    writer.writerow([column.encode('utf-8') for column in header])
+    for row_index in xrange(rows):
+        row_variant = variant if row_index % updated_every == 0 else 0
+        start_time = START + timedelta(seconds=row_index)
+        row = [
+            start_time.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            DEVICE_IDS[row_index % len(DEVICE_IDS)]]
+        for sapelli_id in sapelli_location_ids:
+            if sapelli_id in filled_location_ids:
+                offset = sapelli_location_ids.index(sapelli_id) * 0.001
+                row.extend([
+                    '%.8f' % (51.44 + offset + (row_index % 1000) * 0.00001),
+                    '%.8f' % (-0.06 - offset - (row_index % 1000) * 0.00001)])
+            else:
+                row.extend(['', ''])
+        row.extend(
+            _get_value(sapelli_field, numbers, row_index, row_variant)
+            for sapelli_field, numbers in sapelli_fields)
+        row.extend(['', ''])
+        writer.writerow(row)
+
+    csv_file.seek(0)
+    return File(csv_file, name='%s.csv' % form.sapelli_id)
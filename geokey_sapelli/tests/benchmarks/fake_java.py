@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""
+Stand-in for `java` running the SapColCmdLn client, for benchmarks:
+
+    SAPELLI_JAVA_COMMAND = [sys.executable, '/path/to/fake_java.py']
+
+`-version` reports a Java version. Loading a SAP file (`-load <path>`) prints
+the "sapelli_project_info" recorded in the file (see sap_builder), after a
+delay of SAPELLI_FAKE_JAVA_DELAY seconds (environment variable, default 0)
+simulating the JVM.
+"""
+
+import json
+import os
+import sys
+import time
+
+from zipfile import ZipFile
+
+INFO_ENTRY = 'sapelli_project_info.json'  # see sap_builder
+
+
+def main(args):
+    if '-version' in args:
+        sys.stderr.write('java version "1.8.0_0"\nFake Java for geokey-sapelli benchmarks\n')
+        return 0
+    if '-load' not in args or args.index('-load') + 1 >= len(args):
+        sys.stderr.write('Usage: fake_java.py [-cp <jar> <class>] -p <dir> -load <sap file> -geokey\n')
+        return 1
+
+    time.sleep(float(os.environ.get('SAPELLI_FAKE_JAVA_DELAY') or 0))
+    sap_path = args[args.index('-load') + 1]
+    try:
+        with ZipFile(sap_path) as sap:
+            project_info = json.loads(sap.read(INFO_ENTRY))
+    except BaseException, e:
+        sys.stderr.write('Exception in thread "main" java.lang.Exception: %s\n' % str(e))
+        return 1
+    sys.stdout.write(json.dumps(project_info))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,224 @@
+"""
+Load test of the API endpoints used by Sapelli Collector, against a live
+server (use settings with a real PostGIS database, e.g. travis_ci):
+
+    SAPELLI_LOAD_DEVICES=50 python travis_ci/manage.py test geokey_sapelli.tests.benchmarks.load_test
+
+Every simulated device (SAPELLI_LOAD_DEVICES, default 20, each in its own
+thread) logs in and then, SAPELLI_LOAD_ITERATIONS times (default 5), fetches
+the project description and SAP file, looks up an observation, uploads the
+CSV records and a log file and asks which logs are missing. Devices share
+SAPELLI_LOAD_USERS accounts (default 5), as teams in the field do, so
+contention between requests of the same user (e.g. on their Sapelli working
+directory) shows up.
+
+The p50/p95/p99 latency, throughput and errors of each endpoint are printed
+and saved as JSON (see utils.save_results).
+"""
+
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+import urllib
+import urllib2
+import uuid
+
+from os.path import dirname, normpath, abspath, join
+
+from django.test import LiveServerTestCase
+
+from geokey.projects.models import Admins
+from geokey.users.tests.model_factories import UserFactory
+
+from ..model_factories import create_horniman_sapelli_project, GeoKeySapelliApplicationFactory
+from .utils import save_results
+
+FILES_DIR = normpath(join(dirname(dirname(abspath(__file__))), 'files'))
+PASSWORD = 'l04d-t3st'
+
+
+def percentile(sorted_values, percent):
+    """Return the (nearest-rank) percentile of sorted values."""
+    if not sorted_values:
+        return None
+    index = max(0, int(math.ceil(percent / 100.0 * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+def encode_multipart(fields, files):
+    """
+    Encode form fields and files as multipart/form-data.
+
+    Returns
+    -------
+    tuple
+        The content type and the body.
+    """
+    boundary = uuid.uuid4().hex
+    lines = []
+    for name, value in fields.items():
+        lines.extend([
+            '--' + boundary,
+            'Content-Disposition: form-data; name="%s"' % name,
+            '',
+            str(value)])
+    for name, (file_name, data) in files.items():
+        lines.extend([
+            '--' + boundary,
+            'Content-Disposition: form-data; name="%s"; filename="%s"' % (name, file_name),
+            'Content-Type: application/octet-stream',
+            '',
+            data])
+    lines.extend(['--' + boundary + '--', ''])
+    return 'multipart/form-data; boundary=%s' % boundary, '\r\n'.join(lines)
+
+
+class LoadStats(object):
+    """Thread-safe collection of the latencies and errors of each endpoint."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def add(self, endpoint, seconds, error=None):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if error is not None:
+                self.errors.setdefault(endpoint, []).append(error)
+
+    def get_results(self, wall_time):
+        """Return the statistics of each endpoint."""
+        results = []
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            errors = self.errors.get(endpoint, [])
+            results.append({
+                'case': endpoint,
+                'requests': len(latencies),
+                'errors': len(errors),
+                'error_samples': sorted(set(errors))[:5],
+                'requests_per_second': round(len(latencies) / wall_time, 2),
+                'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+                'max_ms': round(latencies[-1] * 1000, 1),
+            })
+        return results
+
+
+class Device(threading.Thread):
+    """A simulated Sapelli Collector device."""
+
+    def __init__(self, test, number, user, stats, iterations):
+        super(Device, self).__init__(name='device-%s' % number)
+        self.test = test
+        self.number = number
+        self.user = user
+        self.stats = stats
+        self.iterations = iterations
+        self.access_token = None
+
+    def request(self, endpoint, path, fields=None, files=None, expected=(200, 201)):
+        """Make a request (POST if there are fields or files), timing it."""
+        headers = {}
+        data = None
+        if files:
+            content_type, data = encode_multipart(fields or {}, files)
+            headers['Content-Type'] = content_type
+        elif fields is not None:
+            data = urllib.urlencode(fields)
+        if self.access_token:
+            headers['Authorization'] = 'Bearer %s' % self.access_token
+
+        start = time.time()
+        error = None
+        body = None
+        try:
+            response = urllib2.urlopen(urllib2.Request(self.test.live_server_url + path, data, headers))
+            body = response.read()
+            if response.getcode() not in expected:
+                error = 'HTTP %s' % response.getcode()
+        except urllib2.HTTPError, e:
+            error = 'HTTP %s: %s' % (e.code, e.read()[:200])
+        except (urllib2.URLError, IOError), e:
+            error = str(e)
+        self.stats.add(endpoint, time.time() - start, error)
+        return body if error is None else None
+
+    def run(self):
+        project = self.test.sapelli_project
+        body = self.request('login_api', '/api/sapelli/login/', {
+            'username': self.user.email,
+            'password': PASSWORD})
+        if body is None:
+            return
+        self.access_token = json.loads(body).get('access_token')
+
+        for iteration in range(self.iterations):
+            self.request('project_description_api', '/api/sapelli/projects/description/%s/%s/' % (
+                project.sapelli_id, project.sapelli_fingerprint))
+            self.request('sap_download_api', '/api/sapelli/projects/%s/sap/' % project.pk)
+            self.request('find_observation_api', '/api/sapelli/projects/%s/find_observation/%s/' % (
+                project.pk, self.test.category_id), {
+                'sap_rec_StartTime': '2014-11-08T13:37:40.693Z',
+                'sap_rec_DeviceID': '4136949986'}, expected=(200, 404))
+            self.request('data_csv_upload_api', '/api/sapelli/projects/%s/csv_upload/' % project.pk, files={
+                'csv_file': ('Horniman.csv', self.test.csv_data)})
+            log_name = 'Collector_2015-01-20T18.02.%02d.log' % (iteration % 60)
+            log_data = '%s;Device %s, iteration %s\n' % (self.test.log_data, self.number, iteration)
+            self.request('project_logs_api_via_gk_info', '/api/sapelli/projects/%s/logs/' % project.pk, {
+                'name': log_name}, files={'file': (log_name, log_data)})
+            self.request('project_logs_missing_api', '/api/sapelli/projects/%s/logs/missing/' % project.pk, {
+                'hashes': hashlib.sha256(log_data).hexdigest()})
+
+
+class CollectorLoadTest(LiveServerTestCase):
+
+    def setUp(self):
+        self.devices = int(os.environ.get('SAPELLI_LOAD_DEVICES') or 20)
+        self.iterations = int(os.environ.get('SAPELLI_LOAD_ITERATIONS') or 5)
+        users = int(os.environ.get('SAPELLI_LOAD_USERS') or 5)
+
+        GeoKeySapelliApplicationFactory.create()
+        owner = UserFactory.create()
+        self.sapelli_project = create_horniman_sapelli_project(owner)
+        self.category_id = self.sapelli_project.forms.all()[0].category_id
+        self.users = []
+        for index in range(users):
+            user = UserFactory.create()
+            user.set_password(PASSWORD)
+            user.save()
+            Admins.objects.create(project=self.sapelli_project.geokey_project, user=user)
+            self.users.append(user)
+
+        with open(join(FILES_DIR, 'Horniman.csv'), 'rb') as csv_file:
+            self.csv_data = csv_file.read()
+        with open(join(FILES_DIR, 'Collector_2015-01-20T18.02.12.log'), 'rb') as log_file:
+            self.log_data = log_file.read()
+
+    def test_load(self):
+        stats = LoadStats()
+        devices = [
+            Device(self, number, self.users[number % len(self.users)], stats, self.iterations)
+            for number in range(self.devices)]
+        start = time.time()
+        for device in devices:
+            device.start()
+        for device in devices:
+            device.join()
+        wall_time = time.time() - start
+
+        results = stats.get_results(wall_time)
+        for result in results:
+            sys.stderr.write(
+                '\n%(case)-32s %(requests)5s requests %(requests_per_second)8s/s  p50 %(p50_ms)8sms  '
+                'p95 %(p95_ms)8sms  p99 %(p99_ms)8sms  errors %(errors)s' % result)
+            for error in result['error_samples']:
+                sys.stderr.write('\n    %s' % error)
+        path = save_results('load_test', results)
+        sys.stderr.write('\nSaved load test results to %s\n' % path)
@@ -0,0 +1,95 @@
+"""
+Building of synthetic Sapelli projects (SAP files), which carry the
+"sapelli_project_info" that SapColCmdLn would report for them, to be replayed
+by the fake_java stand-in.
+"""
+
+import json
+import random
+
+from zipfile import ZipFile, ZIP_DEFLATED
+
+INFO_ENTRY = 'sapelli_project_info.json'
+
+
+def build_project_info(forms, fields, items, sapelli_id=None):
+    """
+    Builds the "sapelli_project_info" of a project.
+
+    Parameters
+    ----------
+    forms : int
+        Number of forms (each with a location).
+    fields : int
+        Number of fields per form, alternately choices and texts.
+    items : int
+        Number of items per choice field.
+    sapelli_id : int
+        Sapelli id of the project (optional, random by default so that
+        projects are never duplicates of each other).
+
+    Returns
+    -------
+    dict
+        The "sapelli_project_info" dictionary.
+    """
+    sapelli_id = sapelli_id or random.randint(1, 2 ** 31 - 1)
+    name = 'Benchmark %sx%sx%s' % (forms, fields, items)
+    return {
+        'name': name,
+        'variant': None,
+        'version': '1.0',
+        'sapelli_id': sapelli_id,
+        'display_name': '%s (v1.0)' % name,
+        'sapelli_fingerprint': random.randint(-2 ** 31, 2 ** 31 - 1),
+        'sapelli_model_id': random.randint(1, 2 ** 62),
+        'installation_path': None,
+        'forms': [{
+            'sapelli_id': 'Form_%s' % form_index,
+            'sapelli_model_schema_number': form_index,
+            'stores_end_time': False,
+            'locations': [{
+                'sapelli_id': 'Position',
+                'required': False,
+                'truefalse': False,
+                'caption': None,
+                'description': None,
+                'geokey_type': None
+            }],
+            'fields': [_build_field(field_index, items) for field_index in range(fields)],
+        } for form_index in range(forms)],
+    }
+
+
+def _build_field(field_index, items):
+    field = {
+        'sapelli_id': 'Field_%s' % field_index,
+        'description': None,
+        'caption': None,
+        'truefalse': False,
+        'required': False,
+    }
+    if field_index % 2 == 0:
+        field['geokey_type'] = 'LookupField'
+        field['items'] = [{'value': 'Item %s' % item_index, 'img': None} for item_index in range(items)]
+    else:
+        field['geokey_type'] = 'TextField'
+    return field
+
+
+def build_sap(path, project_info):
+    """
+    Writes a SAP file (a ZIP archive with a PROJECT.xml) for a project, with
+    the project's info recorded in it.
+
+    Parameters
+    ----------
+    path : str
+        Path to write the SAP file to.
+    project_info : dict
+        The "sapelli_project_info" of the project.
+    """
+    with ZipFile(path, 'w', ZIP_DEFLATED) as sap:
+        sap.writestr('PROJECT.xml', '<SapelliCollectorProject name="%s" id="%s" />' % (
+            project_info['name'], project_info['sapelli_id']))
+        sap.writestr(INFO_ENTRY, json.dumps(project_info))
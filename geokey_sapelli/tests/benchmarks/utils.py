@@ -0,0 +1,109 @@
+"""
+Measuring of benchmark runs and saving of their results.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import time
+
+from contextlib import contextmanager
+
+from django.utils import timezone
+
+from ...helper.query_stats import count_queries
+from ...helper.import_memory import get_peak_rss_kb as get_peak_rss, tracemalloc
+
+
+@contextmanager
+def measure(rows=None):
+    """
+    Measures the time, number of queries and peak memory of a block (processing
+    a number of rows).
+
+    The peak memory is traced where possible (tracemalloc). Otherwise it is
+    the growth of the process's peak resident set size, which only reflects
+    the block when it needs more memory than anything run before it.
+
+    Parameters
+    ----------
+    rows : int
+        Number of rows processed within the block (optional).
+
+    Returns
+    -------
+    dict
+        Filled with the results once the block has run.
+    """
+    result = {'rows': rows} if rows is not None else {}
+    if tracemalloc is not None:
+        tracemalloc.start()
+    peak_rss = get_peak_rss()
+    start = time.time()
+    with count_queries() as queries:
+        yield result
+    seconds = time.time() - start
+
+    result['seconds'] = round(seconds, 3)
+    result['rows_per_second'] = round(rows / seconds, 1) if rows and seconds else None
+    result['queries'] = queries.count
+    result['queries_per_row'] = round(float(queries.count) / rows, 2) if rows else None
+    result['query_seconds'] = round(queries.time, 3)
+    if tracemalloc is not None:
+        result['peak_memory_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        result['peak_memory_source'] = 'tracemalloc'
+        tracemalloc.stop()
+    elif peak_rss is not None:
+        result['peak_memory_kb'] = get_peak_rss() - peak_rss
+        result['peak_memory_source'] = 'rss'
+
+
+def get_git_commit():
+    """Return the git commit the package is checked out at, or None."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(benchmark, results, path=None):
+    """
+    Saves the results of a benchmark as JSON.
+
+    Parameters
+    ----------
+    benchmark : str
+        Name of the benchmark.
+    results : list
+        The results (dicts) of its runs.
+    path : str
+        File to save the results to (optional, defaults to the
+        SAPELLI_BENCHMARK_OUTPUT environment variable or, if it is not set,
+        `<benchmark>-<commit>.json` in the current directory).
+
+    Returns
+    -------
+    str
+        Path of the file.
+    """
+    commit = get_git_commit()
+    path = path or os.environ.get('SAPELLI_BENCHMARK_OUTPUT') or '%s-%s.json' % (
+        benchmark, commit[:12] if commit else 'unknown')
+    with open(path, 'w') as output_file:
+        json.dump({
+            'benchmark': benchmark,
+            'commit': commit,
+            'python': platform.python_version(),
+            'created_at': timezone.now().isoformat(),
+            'results': results,
+        }, output_file, indent=2, sort_keys=True)
+    return path
+
+
+def get_benchmark_rows(default='1000,10000,100000'):
+    """Return the sizes (in rows) to run benchmarks at (SAPELLI_BENCHMARK_ROWS)."""
+    return [int(rows) for rows in os.environ.get('SAPELLI_BENCHMARK_ROWS', default).split(',') if rows.strip()]
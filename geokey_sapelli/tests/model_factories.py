@@ -28,6 +28,7 @@ from ..models import (
     SapelliLogFile,
     LocationField,
     SAPDownloadQRLink,
+    SapelliUploadJob,
 )
 
 
@@ -388,6 +389,18 @@ class SapelliLogFileFactory(factory.django.DjangoModelFactory):
         model = SapelliLogFile
 
 
+class SapelliUploadJobFactory(factory.django.DjangoModelFactory):
+    """An instance factory for SapelliUploadJob model."""
+
+    creator = factory.SubFactory(UserFactory)
+    sap_path = normpath(join(dirname(abspath(__file__)), 'files/Horniman.sap'))
+
+    class Meta:
+        """Class meta information."""
+
+        model = SapelliUploadJob
+
+
 class SAPDownloadQRLinkFactory(factory.django.DjangoModelFactory):
     class Meta:
         model = SAPDownloadQRLink
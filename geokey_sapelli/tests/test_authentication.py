@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory, override_settings
+from django.utils import timezone
+
+from rest_framework.request import Request
+
+from geokey.users.tests.model_factories import UserFactory
+
+from oauth2_provider.models import AccessToken
+from oauthlib.common import generate_token
+
+from ..authentication import CachedOAuth2Authentication, get_api_authentication_classes
+from ..models import pre_delete_access_token
+from ..helper.query_stats import count_queries
+from ..helper.token_cache import get_cached_token, get_token_cache_ttl
+from .model_factories import GeoKeySapelliApplicationFactory
+
+
+@override_settings(SAPELLI_TOKEN_CACHE_TTL=60)
+class CachedOAuth2AuthenticationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory.create()
+        self.access_token = AccessToken.objects.create(
+            user=self.user,
+            application=GeoKeySapelliApplicationFactory.create(),
+            expires=timezone.now() + timedelta(hours=1),
+            token=generate_token(),
+            scope='read write')
+        self.authentication = CachedOAuth2Authentication()
+
+    def tearDown(self):
+        cache.clear()
+
+    def authenticate(self, token=None):
+        request = RequestFactory().get(
+            '/api/sapelli/projects/1/sap/',
+            HTTP_AUTHORIZATION='Bearer %s' % (token or self.access_token.token))
+        return self.authentication.authenticate(Request(request))
+
+    def test_authenticate(self):
+        with count_queries() as first:
+            user, access_token = self.authenticate()
+        self.assertEqual(user, self.user)
+        self.assertEqual(access_token, self.access_token)
+        self.assertIsNotNone(get_cached_token(self.access_token.token))
+
+        with count_queries() as second:
+            user, access_token = self.authenticate()
+        self.assertEqual(user, self.user)
+        self.assertEqual(access_token.pk, self.access_token.pk)
+        self.assertEqual(access_token.scope, 'read write')
+        self.assertTrue(access_token.is_valid())
+        self.assertLess(second.count, first.count)
+
+    def test_authenticate_with_unknown_token(self):
+        self.assertIsNone(self.authenticate(generate_token()))
+
+    def test_deleted_token(self):
+        self.authenticate()
+        self.assertIsNotNone(get_cached_token(self.access_token.token))
+
+        self.access_token.delete()
+
+        self.assertIsNone(get_cached_token(self.access_token.token))
+        self.assertIsNone(self.authenticate())
+
+    def test_token_deleted_with_queryset(self):
+        self.authenticate()
+
+        # Sends pre_delete (handled by pre_delete_access_token) for each token:
+        AccessToken.objects.filter(user=self.user).delete()
+
+        self.assertIsNone(get_cached_token(self.access_token.token))
+        self.assertIsNone(self.authenticate())
+
+    def test_pre_delete_access_token(self):
+        self.authenticate()
+
+        pre_delete_access_token(AccessToken, instance=self.access_token)
+
+        self.assertIsNone(get_cached_token(self.access_token.token))
+
+    @override_settings(SAPELLI_TOKEN_CACHE_TTL=0)
+    def test_disabled(self):
+        user, access_token = self.authenticate()
+        self.assertEqual(user, self.user)
+        self.assertIsNone(get_cached_token(self.access_token.token))
+
+    def test_disabled_by_default(self):
+        with override_settings():
+            del settings.SAPELLI_TOKEN_CACHE_TTL
+            self.assertEqual(get_token_cache_ttl(), 0)
+            self.authenticate()
+        self.assertIsNone(get_cached_token(self.access_token.token))
+
+    def test_get_api_authentication_classes(self):
+        self.assertIn(CachedOAuth2Authentication, get_api_authentication_classes())
@@ -1,21 +1,39 @@
+import copy
 import shutil
+import sys
+import tempfile
 import time
+import zipfile
+from datetime import datetime
+from pytz import utc
+from StringIO import StringIO
 from os.path import dirname, normpath, abspath, join, exists, isfile
 from unittest import TestCase
 
 from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import override_settings
 from django.core.files import File
 from django.core.files.base import ContentFile
 from django.template.defaultfilters import slugify
 
+from geokey.users.models import User
 from geokey.users.tests.model_factories import UserFactory
 from geokey.categories.tests.model_factories import CategoryFactory
 from geokey.categories.models import Category, NumericField, DateTimeField
 
 from ..helper.sapelli_loader import get_sapelli_dir_path, get_sapelli_jar_path, load_from_sap, check_sap_file, get_sapelli_project_info
 from ..models import SapelliProject
-from ..helper.project_mapper import create_project, create_implicit_fields
-from ..helper.sapelli_exceptions import SapelliSAPException, SapelliXMLException, SapelliDuplicateException
+from ..helper.project_mapper import create_project, create_implicit_fields, upgrade_project
+from ..helper.java_runner import run_java, JavaSlot, track_java_runs
+from ..helper.zip_stream import ZipStream
+from ..helper.upload_sessions import add_range, get_missing_ranges, parse_content_range
+from ..helper.log_index import parse_log_lines, parse_timestamp
+from ..helper.query_stats import count_queries
+from ..helper.metrics import MetricsRegistry, render_metrics
+from ..helper.import_memory import MemoryBudget, get_memory_budget_kb
+from ..helper.import_timing import get_profile_path, run_profiled
+from ..helper.sapelli_exceptions import SapelliException, SapelliSAPException, SapelliXMLException, SapelliDuplicateException, SapelliCSVException
 
 """
 Output of get_sapelli_project_info() for Horniman.sap,
@@ -245,6 +263,253 @@ class TestSapelliLoader(TestCase):
         self.assertEqual(form.location_fields.count(), 2)
 
 
+class TestJavaRunner(TestCase):
+    def test_run_java_version(self):
+        result = run_java(['-version'])
+        self.assertTrue(result.succeeded)
+        self.assertIn('version', result.stderr)
+        self.assertEqual(result.stdout, '')
+        self.assertTrue(result.wall_time > 0)
+        self.assertTrue(result.max_rss > 0)
+
+    def test_track_java_runs(self):
+        with track_java_runs() as outer:
+            with track_java_runs() as inner:
+                run_java(['-version'])
+            run_java(['-version'], bounded=False)
+        run_java(['-version'])
+
+        self.assertEqual(inner['runs'], 1)
+        self.assertEqual(outer['runs'], 2)
+        self.assertTrue(outer['time'] > inner['time'] > 0)
+
+    def test_java_command(self):
+        fake_java = join(dirname(abspath(__file__)), 'benchmarks', 'fake_java.py')
+        with override_settings(SAPELLI_JAVA_COMMAND=[sys.executable, fake_java]):
+            result = run_java(['-version'])
+        self.assertTrue(result.succeeded)
+        self.assertIn('Fake Java', result.stderr)
+        self.assertEqual(result.args[:2], [sys.executable, fake_java])
+
+    def test_run_java_failure(self):
+        result = run_java(['-cp', get_sapelli_jar_path(), 'no.such.MainClass'])
+        self.assertFalse(result.succeeded)
+        self.assertFalse(result.timed_out)
+        self.assertNotEqual(result.stderr, '')
+
+    def test_java_slot_limit(self):
+        with override_settings(SAPELLI_JAVA_MAX_CONCURRENT=1):
+            with JavaSlot():
+                self.assertRaises(SapelliException, JavaSlot(wait=0).__enter__)
+            # Slot is free again:
+            with JavaSlot(wait=0):
+                pass
+
+
+class TestZipStream(TestCase):
+    def test_stream_archive(self):
+        contents = 'Sapelli log line\n' * 10000
+        archive = ZipStream()
+        chunks = []
+        chunks.extend(archive.add_file('first.log', StringIO(contents), datetime(2015, 1, 20, 18, 2, 12)))
+        chunks.extend(archive.add_file(u'empty \xe9.log', StringIO(''), datetime(2015, 1, 21)))
+        chunks.extend(archive.close())
+
+        zip_file = zipfile.ZipFile(StringIO(''.join(chunks)))
+        self.assertIsNone(zip_file.testzip())
+        self.assertEqual(zip_file.namelist(), ['first.log', u'empty \xe9.log'])
+        self.assertEqual(zip_file.read('first.log'), contents)
+        self.assertEqual(zip_file.read(u'empty \xe9.log'), '')
+        self.assertEqual(zip_file.getinfo('first.log').date_time, (2015, 1, 20, 18, 2, 12))
+
+
+class TestUploadSessions(TestCase):
+    def test_add_range(self):
+        ranges = add_range([], 10, 20)
+        self.assertEqual(ranges, [[10, 20]])
+        ranges = add_range(ranges, 30, 40)
+        self.assertEqual(ranges, [[10, 20], [30, 40]])
+        ranges = add_range(ranges, 20, 30)  # adjacent ranges are merged
+        self.assertEqual(ranges, [[10, 40]])
+        ranges = add_range(ranges, 0, 15)  # overlapping ranges are merged
+        self.assertEqual(ranges, [[0, 40]])
+
+    def test_get_missing_ranges(self):
+        self.assertEqual(get_missing_ranges([], 100), [[0, 99]])
+        self.assertEqual(get_missing_ranges([[10, 20], [30, 100]], 100), [[0, 9], [20, 29]])
+        self.assertEqual(get_missing_ranges([[0, 100]], 100), [])
+        self.assertEqual(get_missing_ranges([], 0), [])
+
+    def test_parse_content_range(self):
+        self.assertEqual(parse_content_range('bytes 0-99/1000'), (0, 99, 1000))
+        self.assertIsNone(parse_content_range('bytes */1000'))
+        self.assertIsNone(parse_content_range(None))
+
+
+class TestLogIndex(TestCase):
+    def test_parse_timestamp(self):
+        self.assertEqual(
+            parse_timestamp('2015-01-20T18:02:12.345+01:00'),
+            datetime(2015, 1, 20, 17, 2, 12, 345000, tzinfo=utc))
+        self.assertEqual(
+            parse_timestamp('2015-01-20T18.02.12'),
+            datetime(2015, 1, 20, 18, 2, 12, tzinfo=utc))
+        self.assertIsNone(parse_timestamp('2015-13-40T18:02:12'))
+        self.assertIsNone(parse_timestamp('Form started'))
+
+    def test_parse_log_lines(self):
+        default_timestamp = datetime(2015, 1, 1, tzinfo=utc)
+        entries = list(parse_log_lines([
+            'Collector started; DeviceID: 1234\n',
+            '\n',
+            '2015-01-20T18:02:12Z;Form started;Horniman\n',
+            '2015-01-20T18:03:00Z;ERROR;Media;Failed to save photo\n',
+            'java.lang.NullPointerException\n',
+        ], default_timestamp))
+
+        self.assertEqual(len(entries), 4)
+        self.assertEqual(entries[0]['timestamp'], default_timestamp)
+        self.assertEqual(entries[0]['event_type'], 'Collector started')
+        self.assertEqual(entries[0]['device_id'], 1234)
+        self.assertEqual(entries[1]['line_number'], 3)
+        self.assertEqual(entries[1]['event_type'], 'Form started')
+        self.assertEqual(entries[1]['message'], 'Horniman')
+        self.assertEqual(entries[1]['level'], 'info')
+        self.assertEqual(entries[1]['device_id'], 1234)
+        self.assertEqual(entries[2]['level'], 'error')
+        self.assertEqual(entries[2]['event_type'], 'Media')
+        self.assertEqual(entries[3]['timestamp'], entries[2]['timestamp'])
+        self.assertEqual(entries[3]['level'], 'error')
+        self.assertEqual(entries[3]['event_type'], '')
+        self.assertEqual(entries[3]['message'], 'java.lang.NullPointerException')
+
+
+class TestQueryStats(TestCase):
+    def test_count_queries(self):
+        queries_log = connection.queries_log
+        with count_queries() as outer:
+            User.objects.count()
+            with count_queries() as inner:
+                User.objects.count()
+                User.objects.exists()
+
+        self.assertEqual(inner.count, 2)
+        self.assertEqual(outer.count, 3)
+        self.assertGreaterEqual(outer.time, inner.time)
+        self.assertIs(connection.queries_log, queries_log)
+        self.assertFalse(connection.force_debug_cursor)
+
+
+class TestMetrics(TestCase):
+    def test_totals_of_processes(self):
+        metrics_dir = tempfile.mkdtemp()
+        with override_settings(SAPELLI_METRICS=True, SAPELLI_METRICS_PATH=join(metrics_dir, 'metrics.json')):
+            # Registries of two server processes:
+            registry, other_registry = MetricsRegistry(), MetricsRegistry()
+            registry.inc('sapelli_csv_rows_total', 5, outcome='updated')
+            registry.observe('sapelli_csv_import_duration_seconds', 0.2, outcome='succeeded')
+            other_registry.inc('sapelli_csv_rows_total', 2, outcome='updated')
+            other_registry.inc('sapelli_csv_rows_total', 1, outcome='imported')
+            other_registry.flush()
+            with other_registry.timed('sapelli_csv_import_duration_seconds'):
+                pass
+            other_registry.flush()
+
+            text = render_metrics(registry.get_totals())
+        shutil.rmtree(metrics_dir)
+
+        self.assertIn('sapelli_csv_rows_total{outcome="updated"} 7\n', text)
+        self.assertIn('sapelli_csv_rows_total{outcome="imported"} 1\n', text)
+        self.assertIn('sapelli_csv_import_duration_seconds_bucket{outcome="succeeded",le="0.1"} 1\n', text)
+        self.assertIn('sapelli_csv_import_duration_seconds_bucket{outcome="succeeded",le="0.5"} 2\n', text)
+        self.assertIn('sapelli_csv_import_duration_seconds_bucket{outcome="succeeded",le="+Inf"} 2\n', text)
+        self.assertIn('sapelli_csv_import_duration_seconds_count{outcome="succeeded"} 2\n', text)
+        self.assertIn('# TYPE sapelli_java_runs_total counter\n', text)
+
+    def test_disabled(self):
+        registry = MetricsRegistry()
+        registry.inc('sapelli_qr_renders_total')
+        self.assertEqual(registry.pending, {})
+
+
+class SimulatedMemoryBudget(MemoryBudget):
+    """MemoryBudget of a simulated import, whose memory is 1 KiB per item held."""
+
+    def __init__(self, limit_kb, check_every):
+        self.cache = {}
+        self.leaked = []
+        super(SimulatedMemoryBudget, self).__init__(limit_kb, shrink=self.cache.clear, check_every=check_every)
+
+    def get_used_kb(self):
+        return len(self.cache) + len(self.leaked)
+
+
+class TestMemoryBudget(TestCase):
+    def test_within_budget(self):
+        shrinks = []
+        budget = MemoryBudget(1024 * 1024, shrink=lambda: shrinks.append(True), check_every=1)
+        for row in range(10):
+            budget.row_done()
+        self.assertEqual(budget.rows, 10)
+        self.assertEqual(shrinks, [])
+
+    def test_over_budget(self):
+        # Growing over the budget in spite of shrinking:
+        budget = SimulatedMemoryBudget(50, check_every=10)
+        for row in range(69):
+            budget.leaked.append(row)
+            budget.row_done()
+        self.assertEqual(budget.shrinks, 1)
+        budget.leaked.append(69)
+        with self.assertRaises(SapelliCSVException):
+            budget.row_done()
+        self.assertEqual(budget.shrinks, 2)
+
+    def test_shrinking_recovers(self):
+        budget = SimulatedMemoryBudget(50, check_every=10)
+        for row in range(200):
+            budget.cache[row] = row
+            budget.row_done()
+        self.assertEqual(budget.rows, 200)
+        self.assertEqual(budget.shrinks, 3)
+
+    def test_over_budget_without_growing(self):
+        # Memory freed by shrinking, but not returned to the system:
+        budget = SimulatedMemoryBudget(50, check_every=10)
+        budget.leaked.extend(range(60))
+        for row in range(100):
+            budget.row_done()
+        self.assertEqual(budget.rows, 100)
+        self.assertEqual(budget.shrinks, 10)
+
+    def test_get_memory_budget_kb(self):
+        with override_settings(SAPELLI_IMPORT_MEMORY_BUDGET=None):
+            self.assertIsNone(get_memory_budget_kb())
+        with override_settings(SAPELLI_IMPORT_MEMORY_BUDGET=256):
+            self.assertEqual(get_memory_budget_kb(), 256 * 1024)
+
+
+class TestImportProfiling(TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+
+    def test_get_profile_path(self):
+        profile_dir = join(self.profile_dir, 'profiles')
+        with override_settings(SAPELLI_IMPORT_PROFILE_DIR=profile_dir):
+            sapelli_project = SapelliProject(geokey_project_id=1)
+            profile_path = get_profile_path(sapelli_project)
+        self.assertEqual(dirname(profile_path), profile_dir)
+        self.assertTrue(exists(profile_dir))
+
+    def test_run_profiled_when_profile_cannot_be_saved(self):
+        profile_path = join(self.profile_dir, 'missing', 'import.prof')
+        self.assertEqual(run_profiled(profile_path, sum, [1, 2]), 3)
+        self.assertRaises(ZeroDivisionError, run_profiled, profile_path, lambda: 1 / 0)
+
+
 class TestProjectMapper(TestCase):
     def test_create_implicit_fields(self):
         category = CategoryFactory.create()
@@ -291,6 +556,72 @@ class TestProjectMapper(TestCase):
         field = category.fields.get(key='garden_feature')
         self.assertEqual(field.lookupvalues.count(), 14)
 
+    def test_upgrade_project(self):
+        user = UserFactory.create()
+        geokey_project = create_project(horniman_sapelli_project_info, user)
+        category = geokey_project.categories.get()
+
+        upgraded_info = copy.deepcopy(horniman_sapelli_project_info)
+        upgraded_info['version'] = '1.2'
+        upgraded_info['display_name'] = 'Mapping Cultures (v1.2)'
+        upgraded_info['sapelli_fingerprint'] = 123456789
+        upgraded_info['sapelli_model_id'] = 1234567890123
+        upgraded_info['forms'][0]['sapelli_model_schema_number'] = 2
+        upgraded_info['forms'][0]['fields'][0]['items'].append({'value': 'Pond', 'img': None})
+        upgraded_info['forms'][0]['fields'].append({
+            'sapelli_id': 'Notes',
+            'description': None,
+            'caption': 'Notes',
+            'truefalse': False,
+            'required': False,
+            'geokey_type': 'TextField'
+        })
+        upgraded_info['forms'].append({
+            'sapelli_id': 'Trees',
+            'sapelli_model_schema_number': 3,
+            'stores_end_time': True,
+            'locations': [],
+            'fields': []
+        })
+
+        added = upgrade_project(geokey_project.sapelli_project, upgraded_info, user)
+        self.assertEqual(added, {'forms': 1, 'locations': 0, 'fields': 1, 'items': 1})
+
+        sapelli_project = SapelliProject.objects.get(pk=geokey_project.sapelli_project.pk)
+        self.assertEqual(sapelli_project.version, '1.2')
+        self.assertEqual(sapelli_project.sapelli_fingerprint, 123456789)
+        self.assertEqual(sapelli_project.sapelli_model_id, 1234567890123)
+        self.assertEqual(sapelli_project.geokey_project.name, 'Mapping Cultures (v1.2)')
+        self.assertEqual(sapelli_project.geokey_project.categories.count(), 2)
+
+        # Existing category is kept:
+        form = sapelli_project.forms.get(sapelli_id='Horniman Gardens')
+        self.assertEqual(form.category, category)
+        self.assertEqual(form.sapelli_model_schema_number, 2)
+        self.assertEqual(form.fields.count(), 2)
+        sapelli_field = form.fields.get(sapelli_id='Garden_Feature')
+        self.assertEqual(sapelli_field.items.count(), 15)
+        self.assertEqual(sapelli_field.items.get(number=14).lookup_value.name, 'Pond')
+
+        # Devices running the previous version still find the project and its form:
+        self.assertEqual(
+            SapelliProject.objects.get_by_sapelli_info(
+                horniman_sapelli_project_info['sapelli_id'],
+                horniman_sapelli_project_info['sapelli_fingerprint']),
+            sapelli_project)
+        self.assertEqual(
+            sapelli_project._get_csv_form(
+                horniman_sapelli_project_info['sapelli_model_id'],
+                horniman_sapelli_project_info['forms'][0]['sapelli_model_schema_number'],
+                None),
+            form)
+        self.assertEqual(sapelli_project._get_csv_form(1234567890123, 2, None), form)
+
+        # Upgrading again with the same info adds nothing:
+        added = upgrade_project(sapelli_project, upgraded_info, user)
+        self.assertEqual(added, {'forms': 0, 'locations': 0, 'fields': 0, 'items': 0})
+        self.assertEqual(sapelli_project.previous_versions.count(), 1)
+
 
 def get_test_file(file_name):
     log_file = File(open(
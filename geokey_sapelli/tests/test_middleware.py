@@ -0,0 +1,67 @@
+import json
+import logging
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+
+from geokey.users.models import User
+
+from ..middleware import SapelliTimingMiddleware, logger
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def view(request):
+    User.objects.count()
+    User.objects.exists()
+    return HttpResponse('OK')
+
+
+@override_settings(SAPELLI_REQUEST_TIMING=True)
+class SapelliTimingMiddlewareTest(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = SapelliTimingMiddleware(view)
+        self.handler = RecordingHandler()
+        self.level = logger.level
+        logger.addHandler(self.handler)
+        logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        logger.removeHandler(self.handler)
+        logger.setLevel(self.level)
+
+    @override_settings(SAPELLI_REQUEST_TIMING=False)
+    def test_disabled(self):
+        self.assertRaises(MiddlewareNotUsed, SapelliTimingMiddleware, view)
+
+    def test_api_request(self):
+        response = self.middleware(self.factory.get('/api/sapelli/health/'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+        self.assertIn('java;dur=0.0;desc="0 runs"', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+        timing = json.loads(self.handler.messages[-1])
+        self.assertEqual(timing['path'], '/api/sapelli/health/')
+        self.assertEqual(timing['status'], 200)
+        self.assertEqual(timing['queries'], 2)
+        self.assertFalse(connection.force_debug_cursor)
+
+    def test_other_request(self):
+        response = self.middleware(self.factory.get('/admin/sapelli/'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(self.handler.messages, [])
@@ -1,7 +1,17 @@
-from os.path import dirname, normpath, abspath, join
+import hashlib
+import shutil
+import tempfile
+import zipfile
+from os.path import dirname, normpath, abspath, join, exists
+from datetime import datetime, timedelta
+from pytz import utc
 
 from django.core.files import File
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from geokey.users.tests.model_factories import UserFactory
 from geokey.projects.models import Project
@@ -12,16 +22,34 @@ from ..models import (
     post_save_project,
     pre_delete_project,
     SAPDownloadQRLink,
+    SapelliLogFile,
+    SapelliLogArchive,
+    SapelliUploadJob,
 )
 from .model_factories import (
     SapelliProjectFactory,
+    SapelliUploadJobFactory,
     create_horniman_sapelli_project,
     create_2locations_sapelli_project,
     create_textunicode_sapelli_project,
     GeoKeySapelliApplicationFactory,
 )
 
+from ..helper import log_archives
 from ..helper.sapelli_exceptions import SapelliCSVException
+from ..helper.log_archives import (
+    get_segment_path,
+    get_project_archives_path,
+    get_monthly_archive_path,
+    get_monthly_entry_name,
+    append_to_monthly_archive
+)
+from ..helper.log_retention import apply_log_retention
+from ..helper.import_timing import ImportTimer
+from ..helper.query_stats import count_queries
+from ..helper.upload_queue import fail_stale_upload_jobs
+from ..helper.download_links import sign_log_file
+from .test_helpers import get_test_file
 
 
 class SapelliProjectTest(TestCase):
@@ -77,6 +105,53 @@ class SapelliProjectTest(TestCase):
         self.assertEqual(ignored_dup, 0)
         self.assertEqual(sapelli_project.geokey_project.observations.count(), 7)
 
+    def test_import_from_csv_timing(self):
+        user = UserFactory.create()
+        sapelli_project = create_horniman_sapelli_project(user)
+        timer = ImportTimer()
+        profile_dir = tempfile.mkdtemp()
+        profile_path = join(profile_dir, 'import.prof')
+
+        path = normpath(join(dirname(abspath(__file__)), 'files/Horniman.csv'))
+        file = File(open(path, 'rb'))
+        imported, imported_joined_locs, imported_no_loc, updated, ignored_dup = sapelli_project.import_from_csv(
+            user,
+            file,
+            timer=timer,
+            profile_path=profile_path
+        )
+        self.assertEqual(imported, 4)
+        self.assertEqual(imported_no_loc, 1)
+
+        timing = timer.to_dict()
+        self.assertEqual(timing['stages']['header']['count'], 1)
+        self.assertEqual(timing['stages']['form']['count'], 1)
+        self.assertEqual(timing['stages']['mapping']['count'], 5)
+        self.assertEqual(timing['stages']['lookup']['count'], 5)
+        self.assertEqual(timing['stages']['comparison']['count'], 0)
+        self.assertEqual(timing['stages']['save']['count'], 5)
+        self.assertEqual(sum(timing['stages']['save']['histogram'].values()), 5)
+        self.assertTrue(timing['total_ms'] >= timing['stages']['save']['total_ms'])
+        self.assertEqual(timing['profile'], profile_path)
+        self.assertTrue(exists(profile_path))
+        shutil.rmtree(profile_dir)
+
+    def test_import_from_csv_memory_budget(self):
+        user = UserFactory.create()
+        sapelli_project = create_horniman_sapelli_project(user)
+        timer = ImportTimer(trace_memory=True)
+
+        path = normpath(join(dirname(abspath(__file__)), 'files/Horniman.csv'))
+        with override_settings(SAPELLI_IMPORT_MEMORY_BUDGET=1024):
+            imported, imported_joined_locs, imported_no_loc, updated, ignored_dup = sapelli_project.import_from_csv(
+                user,
+                File(open(path, 'rb')),
+                timer=timer
+            )
+        self.assertEqual(imported, 4)
+        self.assertEqual(imported_no_loc, 1)
+        self.assertIn('peak_rss_kb', timer.to_dict()['memory'])
+
     def test_import_from_csv_horniman_corrupt(self):
         user = UserFactory.create()
         sapelli_project = create_horniman_sapelli_project(user)
@@ -148,6 +223,23 @@ class SapelliProjectTest(TestCase):
         self.assertEqual(sapelli_project.geokey_project.observations.count(), 4)
 
 
+class UploadJobQueueTest(TestCase):
+    def test_fail_stale_upload_jobs(self):
+        long_ago = timezone.now() - timedelta(days=1)
+        queued_job = SapelliUploadJobFactory.create()
+        claimed_job = SapelliUploadJobFactory.create(started_at=long_ago)
+        mapping_job = SapelliUploadJobFactory.create(phase=SapelliUploadJob.MAPPING, started_at=long_ago)
+        recent_job = SapelliUploadJobFactory.create(phase=SapelliUploadJob.EXTRACTING, started_at=timezone.now())
+
+        self.assertEqual(fail_stale_upload_jobs(), 2)
+
+        phases = dict(SapelliUploadJob.objects.values_list('pk', 'phase'))
+        self.assertEqual(phases[queued_job.pk], SapelliUploadJob.STORED)
+        self.assertEqual(phases[claimed_job.pk], SapelliUploadJob.FAILED)
+        self.assertEqual(phases[mapping_job.pk], SapelliUploadJob.FAILED)
+        self.assertEqual(phases[recent_job.pk], SapelliUploadJob.EXTRACTING)
+
+
 class ProjectSaveTest(TestCase):
     def test_post_save_when_project_made_deleted(self):
         geokey_project = ProjectFactory.create(status='active')
@@ -160,6 +252,43 @@ class ProjectSaveTest(TestCase):
 
         self.assertFalse(SapelliProject.objects.filter(pk=sapelli_project.pk).exists())
 
+    def test_post_save_when_deleted_project_saved_again(self):
+        geokey_project = ProjectFactory.create(status='deleted')
+        sapelli_project = SapelliProjectFactory.create(geokey_project=geokey_project)
+
+        post_save_project(Project, instance=geokey_project)
+
+        self.assertTrue(SapelliProject.objects.filter(pk=sapelli_project.pk).exists())
+
+    def test_post_save_when_other_project_made_deleted(self):
+        geokey_project = ProjectFactory.create(status='active')
+
+        geokey_project.status = 'deleted'
+        with count_queries() as queries:
+            post_save_project(Project, instance=geokey_project)
+
+        self.assertEqual(queries.count, 1)
+
+    def test_post_save_when_status_unchanged(self):
+        geokey_project = ProjectFactory.create(status='active')
+        sapelli_project = SapelliProjectFactory.create(geokey_project=geokey_project)
+
+        with count_queries() as queries:
+            post_save_project(Project, instance=geokey_project)
+
+        self.assertEqual(queries.count, 0)
+        self.assertTrue(SapelliProject.objects.filter(pk=sapelli_project.pk).exists())
+
+    def test_post_save_with_deferred_status(self):
+        geokey_project = ProjectFactory.create(status='active')
+        SapelliProjectFactory.create(geokey_project=geokey_project)
+        geokey_project = Project.objects.only('id').get(pk=geokey_project.pk)
+
+        with count_queries() as queries:
+            post_save_project(Project, instance=geokey_project)
+
+        self.assertEqual(queries.count, 0)
+
 
 class ProjectDeleteTest(TestCase):
     def test_pre_delete_project(self):
@@ -193,3 +322,170 @@ class SAPDownloadQRLinkTest(TestCase):
         self.assertEqual(self.sap_download_qr_link.access_token.user, self.user)
         self.assertEqual(self.sap_download_qr_link.access_token.application, self.app)
         self.assertEqual(self.sap_download_qr_link.sapelli_project, sapelli_project)
+
+
+class SapelliLogFileTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.sapelli_project = SapelliProjectFactory.create()
+        self.file_name = 'Collector_2015-01-20T18.02.12.log'
+        with get_test_file(self.file_name) as test_file:
+            self.contents = test_file.read()
+
+    def tearDown(self):
+        for sapelli_log_file in SapelliLogFile.objects.all():
+            sapelli_log_file.delete()
+
+    def test_create_compressed(self):
+        log = SapelliLogFile.create(None, self.user, self.sapelli_project, get_test_file(self.file_name))
+
+        self.assertEqual(log.compression, 'gzip')
+        self.assertTrue(log.file.name.endswith('.log.gz'))
+        self.assertTrue(log.file.size < len(self.contents))
+        self.assertEqual(
+            log.get_url(),
+            '/api/sapelli/projects/%s/logs/%s/file/?signature=%s' % (
+                self.sapelli_project.pk, log.pk, sign_log_file(self.sapelli_project.pk, log.pk)))
+        with log.open_decompressed() as log_file:
+            self.assertEqual(log_file.read(), self.contents)
+
+    @override_settings(SAPELLI_LOG_COMPRESSION=None)
+    def test_create_uncompressed(self):
+        log = SapelliLogFile.create(None, self.user, self.sapelli_project, get_test_file(self.file_name))
+
+        self.assertIsNone(log.compression)
+        self.assertEqual(log.get_url(), log.file.url)
+        with log.open_decompressed() as log_file:
+            self.assertEqual(log_file.read(), self.contents)
+
+    def test_create_large(self):
+        # Treat entries of more than 64 bytes as needing ZIP64, as those of 2 GiB do:
+        limits = zipfile.ZIP64_LIMIT, log_archives.ZIP64_LIMIT
+        zipfile.ZIP64_LIMIT = log_archives.ZIP64_LIMIT = 64
+        try:
+            log = SapelliLogFile.create(None, self.user, self.sapelli_project, get_test_file(self.file_name))
+        finally:
+            zipfile.ZIP64_LIMIT, log_archives.ZIP64_LIMIT = limits
+        self.addCleanup(shutil.rmtree, get_project_archives_path(self.sapelli_project.pk), True)
+
+        segment_path = get_segment_path(self.sapelli_project.pk, log_archives.get_log_day(log.created_at))
+        with zipfile.ZipFile(segment_path) as segment:
+            self.assertEqual(len(segment.namelist()), 1)
+            self.assertEqual(segment.read(segment.namelist()[0]), self.contents)
+
+    def test_create_duplicate(self):
+        log = SapelliLogFile.create(None, self.user, self.sapelli_project, get_test_file(self.file_name))
+        self.assertEqual(log.content_hash, hashlib.sha256(self.contents).hexdigest())
+
+        duplicate = SapelliLogFile.create('Copy', self.user, self.sapelli_project, get_test_file(self.file_name))
+        self.assertEqual(duplicate, log)
+        self.assertEqual(self.sapelli_project.logs.count(), 1)
+
+        other_project = SapelliProjectFactory.create()
+        other_log = SapelliLogFile.create(None, self.user, other_project, get_test_file(self.file_name))
+        self.assertNotEqual(other_log, log)
+
+    def test_create_locks_project(self):
+        with CaptureQueriesContext(connection) as queries:
+            SapelliLogFile.create(None, self.user, self.sapelli_project, get_test_file(self.file_name))
+
+        locks = [query['sql'] for query in queries.captured_queries if 'FOR UPDATE' in query['sql']]
+        self.assertEqual(len(locks), 1)
+        self.assertIn(SapelliProject._meta.db_table, locks[0])
+
+    def test_get_content_hash(self):
+        log = SapelliLogFile.create(None, self.user, self.sapelli_project, get_test_file(self.file_name))
+        SapelliLogFile.objects.filter(pk=log.pk).update(content_hash=None)
+        log = SapelliLogFile.objects.get(pk=log.pk)
+
+        self.assertEqual(log.get_content_hash(), hashlib.sha256(self.contents).hexdigest())
+        self.assertEqual(SapelliLogFile.objects.get(pk=log.pk).content_hash, log.content_hash)
+
+
+class SapelliLogRetentionTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.sapelli_project = SapelliProjectFactory.create()
+        self.january_log = SapelliLogFile.create(
+            None, self.user, self.sapelli_project, get_test_file('Collector_2015-01-20T18.02.12.log'))
+        self.february_log = SapelliLogFile.create(
+            None, self.user, self.sapelli_project,
+            ContentFile(b'Form started\n', name='Collector_2015-02-03T10.00.00.log'))
+        self.march_log = SapelliLogFile.create(
+            None, self.user, self.sapelli_project,
+            ContentFile(b'Form ended\n', name='Collector_2015-03-05T10.00.00.log'))
+        self.now = datetime(2015, 3, 10, tzinfo=utc)
+
+    def tearDown(self):
+        for sapelli_log_file in SapelliLogFile.objects.all():
+            sapelli_log_file.delete()
+        shutil.rmtree(get_project_archives_path(self.sapelli_project.pk), ignore_errors=True)
+
+    def test_without_retention(self):
+        result = apply_log_retention(self.sapelli_project, now=self.now)
+
+        self.assertEqual(result, {'compacted': 0, 'archives': 0, 'deleted_archives': 0})
+        self.assertEqual(self.sapelli_project.logs.count(), 3)
+
+    def test_dry_run(self):
+        self.sapelli_project.log_retention_days = 30
+        result = apply_log_retention(self.sapelli_project, now=self.now, dry_run=True)
+
+        self.assertEqual(result, {'compacted': 2, 'archives': 2, 'deleted_archives': 0})
+        self.assertEqual(self.sapelli_project.logs.count(), 3)
+        self.assertEqual(SapelliLogArchive.objects.count(), 0)
+
+    def test_compact_and_delete(self):
+        self.sapelli_project.log_retention_days = 30
+        january_path = self.january_log.file.path
+        with self.january_log.open_decompressed() as log_file:
+            january_contents = log_file.read()
+
+        result = apply_log_retention(self.sapelli_project, now=self.now, batch_size=1)
+
+        self.assertEqual(result, {'compacted': 2, 'archives': 2, 'deleted_archives': 0})
+        self.assertEqual(list(self.sapelli_project.logs.all()), [self.march_log])
+        self.assertFalse(exists(january_path))
+        self.assertFalse(exists(get_segment_path(self.sapelli_project.pk, datetime(2015, 1, 20).date())))
+        self.assertTrue(exists(get_segment_path(self.sapelli_project.pk, datetime(2015, 3, 5).date())))
+
+        archives = list(self.sapelli_project.log_archives.all())
+        self.assertEqual([archive.name for archive in archives], ['Logs_2015-02.zip', 'Logs_2015-01.zip'])
+        with zipfile.ZipFile(archives[1].get_path()) as zip_file:
+            self.assertEqual(len(zip_file.namelist()), 1)
+            self.assertTrue(zip_file.namelist()[0].endswith(self.january_log.name))
+            self.assertEqual(zip_file.read(zip_file.namelist()[0]), january_contents)
+
+        # Archives past their retention period (whole months) are deleted:
+        self.sapelli_project.log_archive_retention_days = 10
+        result = apply_log_retention(self.sapelli_project, now=self.now)
+
+        self.assertEqual(result, {'compacted': 0, 'archives': 0, 'deleted_archives': 1})
+        self.assertEqual(
+            [archive.name for archive in self.sapelli_project.log_archives.all()],
+            ['Logs_2015-02.zip'])
+        self.assertFalse(exists(archives[1].get_path()))
+
+    def test_append_to_archive(self):
+        month = datetime(2015, 1, 1).date()
+        archived, count = append_to_monthly_archive(self.sapelli_project.pk, month, [self.january_log])
+        self.assertEqual((archived, count), ([self.january_log.pk], 1))
+        path = get_monthly_archive_path(self.sapelli_project.pk, month)
+
+        def interrupted_logs():
+            yield SapelliLogFile.create(
+                None, self.user, self.sapelli_project,
+                ContentFile(b'Form saved\n', name='Collector_2015-01-21T10.00.00.log'))
+            raise RuntimeError('Interrupted')
+
+        # The archive is restored when appending to it fails:
+        self.assertRaises(RuntimeError, append_to_monthly_archive, self.sapelli_project.pk, month, interrupted_logs())
+        self.assertFalse(exists(path + '.journal'))
+        with zipfile.ZipFile(path) as zip_file:
+            self.assertEqual(zip_file.namelist(), [get_monthly_entry_name(self.january_log)])
+
+        archived, count = append_to_monthly_archive(
+            self.sapelli_project.pk, month, [self.january_log, self.february_log])
+        self.assertEqual((archived, count), ([self.january_log.pk, self.february_log.pk], 2))
+        with zipfile.ZipFile(path) as zip_file:
+            self.assertEqual(zip_file.read(get_monthly_entry_name(self.february_log)), b'Form started\n')
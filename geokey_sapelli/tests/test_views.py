@@ -1,15 +1,24 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import os
 import json
+import shutil
+import tempfile
+import zipfile
 from os.path import dirname, normpath, abspath, join
 from datetime import datetime
+from StringIO import StringIO
 from pytz import utc
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse, resolve
 from django.core.files import File
-from django.http import HttpRequest
+from django.core.files.base import ContentFile
+from django.http import HttpRequest, QueryDict, Http404
+from django.utils.http import urlencode
 from django.template.loader import render_to_string
 from django.contrib.sites.shortcuts import get_current_site
 from django.contrib.auth.models import AnonymousUser
@@ -31,6 +40,8 @@ from geokey.projects.tests.model_factories import ProjectFactory
 from .model_factories import (
     GeoKeySapelliApplicationFactory,
     SapelliProjectFactory,
+    SapelliLogFileFactory,
+    SapelliUploadJobFactory,
     create_horniman_sapelli_project, create_qr_link,
 )
 from .test_helpers import get_test_file
@@ -38,17 +49,38 @@ from ..models import (
     SapelliProject,
     SAPDownloadQRLink,
     SapelliLogFile,
+    SapelliUploadJob,
+    SapelliUploadSession,
 )
+from ..helper.upload_queue import process_next_upload_job
+from ..helper.upload_sessions import open_upload_session
+from ..helper.log_archives import get_segment_path, get_project_archives_path
+from ..helper.log_retention import apply_log_retention
+from ..helper.qr_cache import qr_image_cache
+from ..helper.metrics import metrics
+from ..helper.download_links import create_download_link_params, verify_download_link_params
+from ..helper.sapelli_exceptions import SapelliException
 from ..views import (
     ProjectList,
     ProjectUpload,
     DataCSVUpload,
     DataLogsDownload,
+    LogsZipView,
+    LogFileView,
+    LogSearchView,
+    LogArchiveView,
+    HealthAPI,
+    MetricsAPI,
     LoginAPI,
     SAPDownloadAPI,
     SAPDownloadQRLinkAPI,
+    UploadJobAPI,
     SapelliLogsViaPersonalInfo,
     SapelliLogsViaGeoKeyInfo,
+    SapelliLogsBundleAPI,
+    SapelliLogsMissingAPI,
+    UploadSessionsAPI,
+    UploadSessionAPI,
 )
 
 
@@ -187,6 +219,40 @@ class ProjectUploadTest(TestCase):
         self.assertEqual(Project.objects.count(), 1)
         self.assertEqual(geokey_project.islocked, True)
 
+    @override_settings(SAPELLI_BACKGROUND_UPLOADS=True)
+    def test_post_with_user_in_background(self):
+        path = normpath(join(dirname(abspath(__file__)), 'files/Horniman.sap'))
+        file = File(open(path, 'rb'))
+        user = UserFactory.create()
+
+        self.request.user = user
+        self.request.method = 'POST'
+        self.request.FILES = {
+            'sap_file': file
+        }
+
+        response = self.view(self.request)
+        job = SapelliUploadJob.objects.get(creator=user)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response['location'], reverse(
+                'geokey_sapelli:upload_job',
+                kwargs={'job_id': job.id}
+            )
+        )
+        self.assertEqual(job.phase, SapelliUploadJob.STORED)
+        self.assertEqual(Project.objects.count(), 0)
+
+        process_next_upload_job()
+
+        job = SapelliUploadJob.objects.get(pk=job.pk)
+        self.assertEqual(job.phase, SapelliUploadJob.DONE)
+        self.assertIsNotNone(job.extract_duration)
+        self.assertIsNotNone(job.mapping_duration)
+        self.assertEqual(Project.objects.count(), 1)
+        self.assertEqual(job.sapelli_project.geokey_project, Project.objects.first())
+
 
 class DataCSVUploadTest(TestCase):
     def setUp(self):
@@ -294,6 +360,26 @@ class DataCSVUploadTest(TestCase):
         self.assertEqual(response, rendered)
         self.assertEqual(sapelli_project.geokey_project.observations.count(), 5)
 
+    def test_post_with_timing(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+
+        path = normpath(join(dirname(abspath(__file__)), 'files/Horniman.csv'))
+        file = File(open(path, 'rb'))
+
+        self.request.method = 'POST'
+        self.request.FILES = {'csv_file': file}
+        self.request.POST = {'timing': '1'}
+        self.request.user = self.user
+
+        response = self.view(
+            self.request,
+            project_id=sapelli_project.geokey_project.id).render()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Import took')
+        self.assertContains(response, 'save: ')
+        self.assertEqual(sapelli_project.geokey_project.observations.count(), 5)
+
 
 class DataLogsDownloadTest(TestCase):
     """Test page for data logs download."""
@@ -376,6 +462,421 @@ class DataLogsDownloadTest(TestCase):
         self.assertEqual(response, rendered)
 
 
+class LogsZipViewTest(TestCase):
+    """Test ZIP archive download of data logs."""
+
+    def setUp(self):
+        """Set up test."""
+        self.admin = UserFactory.create()
+        self.regular_user = UserFactory.create()
+        self.sapelli_project = create_horniman_sapelli_project(self.admin)
+
+        self.view = LogsZipView.as_view()
+        self.request = HttpRequest()
+        self.request.method = 'GET'
+
+        setattr(self.request, 'session', 'session')
+        setattr(self.request, '_messages', FallbackStorage(self.request))
+
+    def tearDown(self):
+        """Tear down test."""
+        for sapelli_log_file in SapelliLogFile.objects.all():
+            sapelli_log_file.delete()
+        shutil.rmtree(get_project_archives_path(self.sapelli_project.pk), ignore_errors=True)
+
+    def test_get_without_logs(self):
+        """Test GET when there is nothing to archive."""
+        self.request.user = self.admin
+        response = self.view(
+            self.request,
+            project_id=self.sapelli_project.geokey_project.id,
+            file='logs')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response['location'],
+            reverse('geokey_sapelli:logs', kwargs={'project_id': self.sapelli_project.geokey_project.id}))
+
+    def test_get_with_admin(self):
+        """Test GET with admin streams the logs as ZIP archive."""
+        log = SapelliLogFileFactory.create(
+            creator=self.admin,
+            sapelli_project=self.sapelli_project)
+
+        self.request.user = self.admin
+        response = self.view(
+            self.request,
+            project_id=self.sapelli_project.geokey_project.id,
+            file='logs')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-zip-compressed')
+
+        zip_file = zipfile.ZipFile(StringIO(b''.join(response.streaming_content)))
+        self.assertIsNone(zip_file.testzip())
+        self.assertEqual(zip_file.namelist(), [log.name])
+        log.file.open('rb')
+        self.assertEqual(zip_file.read(log.name), log.file.read())
+        log.file.close()
+
+    def test_get_with_archived_log(self):
+        """Test GET with a log copied from the daily archives."""
+        log = SapelliLogFile.create(
+            None,
+            self.admin,
+            self.sapelli_project,
+            get_test_file('Collector_2015-01-20T18.02.12.log'))
+        segment = zipfile.ZipFile(get_segment_path(self.sapelli_project.pk, log.created_at.date()))
+        self.assertEqual(len(segment.namelist()), 1)
+
+        self.request.user = self.admin
+        response = self.view(
+            self.request,
+            project_id=self.sapelli_project.geokey_project.id,
+            file='logs')
+        self.assertEqual(response.status_code, 200)
+
+        zip_file = zipfile.ZipFile(StringIO(b''.join(response.streaming_content)))
+        self.assertIsNone(zip_file.testzip())
+        self.assertEqual(zip_file.namelist(), [log.name])
+        self.assertEqual(zip_file.read(log.name), segment.read(segment.namelist()[0]))
+
+    @override_settings(SAPELLI_DAILY_LOG_ARCHIVES=False)
+    def test_get_with_compressed_log(self):
+        """Test GET with a log copied from its gzip file."""
+        log = SapelliLogFile.create(
+            None,
+            self.admin,
+            self.sapelli_project,
+            get_test_file('Collector_2015-01-20T18.02.12.log'))
+        self.assertEqual(log.compression, 'gzip')
+
+        self.request.user = self.admin
+        response = self.view(
+            self.request,
+            project_id=self.sapelli_project.geokey_project.id,
+            file='logs')
+        self.assertEqual(response.status_code, 200)
+
+        zip_file = zipfile.ZipFile(StringIO(b''.join(response.streaming_content)))
+        self.assertIsNone(zip_file.testzip())
+        with log.open_decompressed() as log_file:
+            self.assertEqual(zip_file.read(log.name), log_file.read())
+
+
+class LogFileViewTest(TestCase):
+    """Test download of a single data log."""
+
+    def setUp(self):
+        """Set up test."""
+        self.admin = UserFactory.create()
+        self.regular_user = UserFactory.create()
+        self.sapelli_project = create_horniman_sapelli_project(self.admin)
+        self.file_name = 'Collector_2015-01-20T18.02.12.log'
+        self.log = SapelliLogFile.create(
+            None,
+            self.admin,
+            self.sapelli_project,
+            get_test_file(self.file_name))
+
+        self.view = LogFileView.as_view()
+        self.request = HttpRequest()
+        self.request.method = 'GET'
+
+    def tearDown(self):
+        """Tear down test."""
+        for sapelli_log_file in SapelliLogFile.objects.all():
+            sapelli_log_file.delete()
+        shutil.rmtree(get_project_archives_path(self.sapelli_project.pk), ignore_errors=True)
+
+    def test_url(self):
+        """Test URL."""
+        self.assertEqual(
+            reverse(
+                'geokey_sapelli:log_file',
+                kwargs={'project_id': 1, 'log_id': 2}
+            ),
+            '/admin/sapelli/projects/1/logs/2/file')
+
+        resolved = resolve('/admin/sapelli/projects/1/logs/2/file')
+        self.assertEqual(resolved.kwargs['log_id'], '2')
+        self.assertEqual(resolved.func.func_name, LogFileView.__name__)
+
+    def test_get_with_regular_user(self):
+        """Test GET with regular user."""
+        self.request.user = self.regular_user
+        self.assertRaises(
+            Http404,
+            self.view,
+            self.request,
+            project_id=self.sapelli_project.geokey_project.id,
+            log_id=self.log.id)
+
+    def test_get_with_admin(self):
+        """Test GET with admin, decompressing the log."""
+        self.request.user = self.admin
+        response = self.view(
+            self.request,
+            project_id=self.sapelli_project.geokey_project.id,
+            log_id=self.log.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        with get_test_file(self.file_name) as test_file:
+            self.assertEqual(b''.join(response.streaming_content), test_file.read())
+
+    def test_get_with_admin_accepting_gzip(self):
+        """Test GET with admin, passing the gzip file through."""
+        self.request.user = self.admin
+        self.request.META['HTTP_ACCEPT_ENCODING'] = 'gzip, deflate'
+        response = self.view(
+            self.request,
+            project_id=self.sapelli_project.geokey_project.id,
+            log_id=self.log.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.log.file.open('rb')
+        self.assertEqual(b''.join(response.streaming_content), self.log.file.read())
+        self.log.file.close()
+
+
+class LogArchiveViewTest(TestCase):
+    """Test download of a monthly archive of data logs."""
+
+    def setUp(self):
+        """Set up test."""
+        self.admin = UserFactory.create()
+        self.regular_user = UserFactory.create()
+        self.sapelli_project = create_horniman_sapelli_project(self.admin)
+        SapelliLogFile.create(
+            None,
+            self.admin,
+            self.sapelli_project,
+            get_test_file('Collector_2015-01-20T18.02.12.log'))
+        self.sapelli_project.log_retention_days = 30
+        apply_log_retention(self.sapelli_project, now=datetime(2015, 3, 1, tzinfo=utc))
+        self.archive = self.sapelli_project.log_archives.get()
+
+        self.view = LogArchiveView.as_view()
+        self.request = HttpRequest()
+        self.request.method = 'GET'
+
+    def tearDown(self):
+        """Tear down test."""
+        shutil.rmtree(get_project_archives_path(self.sapelli_project.pk), ignore_errors=True)
+
+    def test_url(self):
+        """Test URL."""
+        self.assertEqual(
+            reverse(
+                'geokey_sapelli:log_archive',
+                kwargs={'project_id': 1, 'archive_id': 2}
+            ),
+            '/admin/sapelli/projects/1/logs/archives/2/file')
+
+        resolved = resolve('/admin/sapelli/projects/1/logs/archives/2/file')
+        self.assertEqual(resolved.kwargs['archive_id'], '2')
+        self.assertEqual(resolved.func.func_name, LogArchiveView.__name__)
+
+    def test_get_with_regular_user(self):
+        """Test GET with regular user."""
+        self.request.user = self.regular_user
+        self.assertRaises(
+            Http404,
+            self.view,
+            self.request,
+            project_id=self.sapelli_project.geokey_project.id,
+            archive_id=self.archive.id)
+
+    def test_get_with_admin(self):
+        """Test GET with admin."""
+        self.request.user = self.admin
+        response = self.view(
+            self.request,
+            project_id=self.sapelli_project.geokey_project.id,
+            archive_id=self.archive.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=Logs_2015-01.zip')
+        with open(self.archive.get_path(), 'rb') as archive_file:
+            self.assertEqual(b''.join(response), archive_file.read())
+
+
+class LogSearchViewTest(TestCase):
+    """Test search of the contents of data logs."""
+
+    def setUp(self):
+        """Set up test."""
+        self.admin = UserFactory.create()
+        self.regular_user = UserFactory.create()
+        self.sapelli_project = create_horniman_sapelli_project(self.admin)
+        self.log = SapelliLogFile.create(
+            None,
+            self.admin,
+            self.sapelli_project,
+            ContentFile(
+                b'Collector started; DeviceID: 1234\n'
+                b'2015-01-20T18:02:12Z;Form started;Horniman\n'
+                b'2015-01-20T18:03:00Z;ERROR;Media;Failed to save photo\n'
+                b'2015-01-20T18:04:00Z;Form ended;Horniman\n',
+                name='Collector_2015-01-20T18.02.12.log'))
+
+        self.view = LogSearchView.as_view()
+        self.url = reverse(
+            'geokey_sapelli:log_search',
+            kwargs={'project_id': self.sapelli_project.geokey_project.id})
+
+    def tearDown(self):
+        """Tear down test."""
+        for sapelli_log_file in SapelliLogFile.objects.all():
+            sapelli_log_file.delete()
+        shutil.rmtree(get_project_archives_path(self.sapelli_project.pk), ignore_errors=True)
+
+    def get(self, user, **params):
+        request = RequestFactory().get(self.url, params)
+        request.user = user
+        response = self.view(request, project_id=self.sapelli_project.geokey_project.id)
+        return response, json.loads(response.content)
+
+    def test_url(self):
+        """Test URL."""
+        self.assertEqual(
+            reverse('geokey_sapelli:log_search', kwargs={'project_id': 1}),
+            '/admin/sapelli/projects/1/logs/search/')
+
+        resolved = resolve('/admin/sapelli/projects/1/logs/search/')
+        self.assertEqual(resolved.kwargs['project_id'], '1')
+        self.assertEqual(resolved.func.func_name, LogSearchView.__name__)
+
+    def test_get_with_regular_user(self):
+        """Test GET with regular user."""
+        response, result = self.get(self.regular_user)
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_with_admin(self):
+        """Test GET with admin, paging through all entries."""
+        response, result = self.get(self.admin, limit=3)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [entry['line_number'] for entry in result['entries']],
+            [4, 3, 2])
+        self.assertEqual(result['entries'][0]['device_id'], 1234)
+        self.assertIsNotNone(result['next'])
+
+        response, result = self.get(self.admin, limit=3, before=result['entries'][-1]['id'])
+        self.assertEqual(
+            [entry['line_number'] for entry in result['entries']],
+            [1])
+        self.assertIsNone(result['next'])
+
+    def test_get_with_filters(self):
+        """Test GET with admin, filtering the entries."""
+        response, result = self.get(self.admin, q='horniman')
+        self.assertEqual(
+            [entry['event_type'] for entry in result['entries']],
+            ['Form ended', 'Form started'])
+
+        response, result = self.get(self.admin, level='error')
+        self.assertEqual(len(result['entries']), 1)
+        self.assertEqual(result['entries'][0]['message'], 'Failed to save photo')
+
+        response, result = self.get(self.admin, date_from='2015-01-20T18:03:00Z', device_id=1234)
+        self.assertEqual(len(result['entries']), 2)
+
+        response, result = self.get(self.admin, device_id='abc')
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_with_limit_below_one(self):
+        """Test GET with admin, with a limit of less than one entry."""
+        for limit in (0, -5):
+            response, result = self.get(self.admin, limit=limit)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(result['entries']), 1)
+            self.assertIsNotNone(result['next'])
+
+
+class HealthAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.view = HealthAPI.as_view()
+        self.request = HttpRequest()
+        self.request.method = 'GET'
+        self.request.user = AnonymousUser()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_url(self):
+        self.assertEqual(reverse('geokey_sapelli:health_api'), '/api/sapelli/health/')
+
+        resolved = resolve('/api/sapelli/health/')
+        self.assertEqual(resolved.func.func_name, HealthAPI.__name__)
+
+    def test_get_when_healthy(self):
+        GeoKeySapelliApplicationFactory.create()
+
+        response = self.view(self.request)
+        self.assertEqual(response.status_code, 200)
+
+        response_json = json.loads(response.content)
+        self.assertEqual(response_json.get('status'), 'ok')
+        self.assertIsNotNone(response_json.get('checked_at'))
+
+    def test_get_when_not_registered(self):
+        response = self.view(self.request)
+        self.assertEqual(response.status_code, 503)
+
+        response_json = json.loads(response.content)
+        self.assertEqual(response_json.get('status'), 'error')
+        self.assertNotIn('error', response_json)
+
+        # Status is cached, even though the application now exists:
+        GeoKeySapelliApplicationFactory.create()
+        self.request.user = UserFactory.create(is_superuser=True)
+        response = self.view(self.request)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('error', json.loads(response.content))
+
+
+class MetricsAPITest(TestCase):
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.view = MetricsAPI.as_view()
+        self.request = HttpRequest()
+        self.request.method = 'GET'
+        self.request.user = AnonymousUser()
+
+    def tearDown(self):
+        shutil.rmtree(self.metrics_dir)
+
+    def test_url(self):
+        self.assertEqual(reverse('geokey_sapelli:metrics_api'), '/api/sapelli/metrics/')
+
+        resolved = resolve('/api/sapelli/metrics/')
+        self.assertEqual(resolved.func.func_name, MetricsAPI.__name__)
+
+    def test_get_when_disabled(self):
+        self.assertRaises(Http404, self.view, self.request)
+
+    def test_get(self):
+        with override_settings(SAPELLI_METRICS=True, SAPELLI_METRICS_PATH=join(self.metrics_dir, 'metrics.json')):
+            metrics.inc('sapelli_qr_renders_total', 3)
+            response = self.view(self.request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('# TYPE sapelli_qr_renders_total counter', response.content)
+        self.assertIn('\nsapelli_qr_renders_total 3\n', response.content)
+
+    def test_get_with_token(self):
+        with override_settings(
+                SAPELLI_METRICS=True,
+                SAPELLI_METRICS_PATH=join(self.metrics_dir, 'metrics.json'),
+                SAPELLI_METRICS_TOKEN='secret'):
+            self.assertRaises(PermissionDenied, self.view, self.request)
+
+            self.request.META['HTTP_AUTHORIZATION'] = 'Bearer secret'
+            response = self.view(self.request)
+            self.assertEqual(response.status_code, 200)
+
+
 class LoginAPITest(TestCase):
     def setUp(self):
         self.user = UserFactory.create()
@@ -418,6 +919,48 @@ class LoginAPITest(TestCase):
         self.assertIsNotNone(response_json.get('access_token'))
         self.assertIsNotNone(response_json.get('refresh_token'))
 
+        access_token = AccessToken.objects.get(token=response_json.get('access_token'))
+        self.assertEqual(access_token.user, self.user)
+        self.assertEqual(access_token.expires.isoformat(), response_json.get('expires_at'))
+        self.assertEqual(access_token.refresh_token.token, response_json.get('refresh_token'))
+
+    def test_post_with_wrong_password(self):
+        data = {
+            'username': self.user.email,
+            'password': '654321'
+        }
+
+        view = LoginAPI.as_view()
+        url = reverse('geokey_sapelli:login_api')
+
+        factory = RequestFactory()
+        request = factory.post(url, data)
+        response = view(request)
+        response.render()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content).get('error'), 'invalid_grant')
+        self.assertFalse(AccessToken.objects.filter(user=self.user).exists())
+
+    def test_post_refresh_token(self):
+        view = LoginAPI.as_view()
+        url = reverse('geokey_sapelli:login_api')
+        factory = RequestFactory()
+
+        request = factory.post(url, {'username': self.user.email, 'password': '123456'})
+        response = view(request)
+        response.render()
+        refresh_token = json.loads(response.content).get('refresh_token')
+
+        request = factory.post(url, {'grant_type': 'refresh_token', 'refresh_token': refresh_token})
+        response = view(request)
+        response.render()
+
+        response_json = json.loads(response.content)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response_json.get('refresh_token'), refresh_token)
+        self.assertIsNotNone(response_json.get('expires_at'))
+
     def test_get_with_anonymous(self):
         view = LoginAPI.as_view()
         url = reverse('geokey_sapelli:login_api')
@@ -478,6 +1021,168 @@ class SAPDownloadAPITest(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], '"%s"' % sapelli_project.get_sap_hash())
+        with open(sapelli_project.sap_path, 'rb') as sap_file:
+            self.assertEqual(b''.join(response.streaming_content), sap_file.read())
+
+    def test_get_not_modified(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+        self.request.user = self.user
+        self.request.META['HTTP_IF_NONE_MATCH'] = '"%s"' % sapelli_project.get_sap_hash()
+
+        response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_get_range(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+        size = os.path.getsize(sapelli_project.sap_path)
+        self.request.user = self.user
+        self.request.META['HTTP_RANGE'] = 'bytes=100-'
+        self.request.META['HTTP_IF_RANGE'] = '"%s"' % sapelli_project.get_sap_hash()
+
+        response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 100-%s/%s' % (size - 1, size))
+        with open(sapelli_project.sap_path, 'rb') as sap_file:
+            sap_file.seek(100)
+            self.assertEqual(b''.join(response.streaming_content), sap_file.read())
+
+    def test_get_range_with_changed_file(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+        self.request.user = self.user
+        self.request.META['HTTP_RANGE'] = 'bytes=100-'
+        self.request.META['HTTP_IF_RANGE'] = '"outdated"'
+
+        response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_unsatisfiable_range(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+        size = os.path.getsize(sapelli_project.sap_path)
+        self.request.user = self.user
+        self.request.META['HTTP_RANGE'] = 'bytes=%s-' % size
+
+        response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */%s' % size)
+
+    def test_get_with_signed_link(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+        self.request.GET = QueryDict(urlencode(create_download_link_params(sapelli_project, self.user)))
+
+        response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+
+    def test_get_with_tampered_signed_link(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+        params = create_download_link_params(sapelli_project, self.user)
+        params['expires'] += 3600
+        self.request.GET = QueryDict(urlencode(params))
+
+        response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_get_with_revoked_signed_link(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+        self.request.GET = QueryDict(urlencode(create_download_link_params(sapelli_project, self.user)))
+        sapelli_project.download_key_version += 1
+        sapelli_project.save()
+
+        response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_get_with_signed_link_of_revoked_user(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+        contributor = UserFactory.create()
+        self.request.GET = QueryDict(urlencode(create_download_link_params(sapelli_project, contributor)))
+        admin_request = HttpRequest()
+        admin_request.method = 'GET'
+        admin_request.GET = QueryDict(urlencode(create_download_link_params(sapelli_project, self.user)))
+
+        sapelli_project.revoke_download_links(contributor)
+        response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+        admin_response = self.view(admin_request, project_id=sapelli_project.geokey_project.id)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(admin_response.status_code, 200)
+
+    def test_get_with_signed_link_queries(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+        sapelli_project.get_sap_hash()
+        sapelli_project.revoke_download_links(self.user)
+        self.request.GET = QueryDict(urlencode(create_download_link_params(
+            SapelliProject.objects.get(pk=sapelli_project.pk), self.user)))
+
+        # Only the project is looked up:
+        with self.assertNumQueries(1):
+            response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_with_accel_redirect(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+        self.request.user = self.user
+
+        with override_settings(
+                SAPELLI_SENDFILE='x-accel-redirect',
+                SAPELLI_SENDFILE_ROOT=dirname(sapelli_project.sap_path),
+                SAPELLI_SENDFILE_URL='/internal/'):
+            response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/internal/Horniman.sap')
+        self.assertEqual(response.content, b'')
+
+
+class UploadJobAPITest(TestCase):
+    def setUp(self):
+        self.job = SapelliUploadJobFactory.create()
+        self.view = UploadJobAPI.as_view()
+        self.request = HttpRequest()
+        self.request.method = 'GET'
+        self.request.user = AnonymousUser()
+
+    def test_url(self):
+        self.assertEqual(
+            reverse(
+                'geokey_sapelli:upload_job_api',
+                kwargs={'job_id': 1}
+            ),
+            '/api/sapelli/uploads/1/'
+        )
+        resolved = resolve('/api/sapelli/uploads/1/')
+        self.assertEqual(resolved.kwargs['job_id'], '1')
+        self.assertEqual(resolved.func.func_name, UploadJobAPI.__name__)
+
+    def test_get_with_anonymous(self):
+        response = self.view(self.request, job_id=self.job.id)
+        self.assertEqual(response.status_code, 403)
+
+    def test_get_with_other_user(self):
+        self.request.user = UserFactory.create()
+        response = self.view(self.request, job_id=self.job.id)
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_with_creator(self):
+        self.request.user = self.job.creator
+        response = self.view(self.request, job_id=self.job.id).render()
+        self.assertEqual(response.status_code, 200)
+
+        response_json = json.loads(response.content)
+        self.assertEqual(response_json.get('id'), self.job.id)
+        self.assertEqual(response_json.get('phase'), 'stored')
+        self.assertIsNone(response_json.get('timings').get('extracting'))
+        self.assertNotIn('error', response_json)
 
 
 class SAPDownloadQRLinkAPITest(TestCase):
@@ -536,6 +1241,79 @@ class SAPDownloadQRLinkAPITest(TestCase):
         self.assertEqual(response['Content-Type'], 'image/png')
         self.assertEqual(response['X-QR-Access-Token'], qr_link.access_token.token)
         self.assertEqual(response['X-QR-Access-Token-Expires'], qr_link.access_token.expires.isoformat())
+        self.assertTrue(response['Cache-Control'].startswith('private, max-age='))
+
+    def test_get_cached(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+        self.request.user = self.user
+        qr_image_cache.clear()
+
+        response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(qr_image_cache.misses, 1)
+
+        # Same token, so the image is served from the cache:
+        cached_response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+        self.assertEqual(cached_response.status_code, 200)
+        self.assertEqual(cached_response.content, response.content)
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+        self.assertEqual(qr_image_cache.hits, 1)
+
+        # The browser's copy is still valid:
+        self.request.META['HTTP_IF_NONE_MATCH'] = response['ETag']
+        not_modified_response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+        self.assertEqual(not_modified_response.status_code, 304)
+
+    @override_settings(SAPELLI_SIGNED_DOWNLOAD_LINKS=True)
+    def test_get_with_user_signed(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+        self.request.user = self.user
+
+        response = self.view(self.request, project_id=sapelli_project.geokey_project.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('signature=', response['X-QR-URL'])
+        self.assertFalse(response.has_header('X-QR-Access-Token'))
+        self.assertFalse(SAPDownloadQRLink.objects.filter(sapelli_project=sapelli_project).exists())
+        self.assertFalse(AccessToken.objects.filter(user=self.user).exists())
+
+    @override_settings(SAPELLI_SIGNED_DOWNLOAD_LINKS=True)
+    def test_delete_with_user_signed(self):
+        delete_request = HttpRequest()
+        delete_request.method = 'DELETE'
+        delete_request.user = self.user
+        force_authenticate(delete_request, user=self.user)
+
+        sapelli_project = create_horniman_sapelli_project(self.user)
+
+        response = self.view(delete_request, project_id=sapelli_project.geokey_project.id).render()
+        response_json = json.loads(response.content)
+
+        self.assertTrue(response_json.get('deleted'))
+        self.assertEqual(SapelliProject.objects.get(pk=sapelli_project.pk).download_key_version, 1)
+
+    @override_settings(SAPELLI_SIGNED_DOWNLOAD_LINKS=True)
+    def test_delete_with_contributor_signed(self):
+        sapelli_project = create_horniman_sapelli_project(self.user)
+        sapelli_project.geokey_project.everyone_contributes = 'auth'
+        sapelli_project.geokey_project.save()
+        contributor = UserFactory.create()
+        admin_params = create_download_link_params(sapelli_project, self.user)
+        contributor_params = create_download_link_params(sapelli_project, contributor)
+
+        delete_request = HttpRequest()
+        delete_request.method = 'DELETE'
+        delete_request.user = contributor
+        force_authenticate(delete_request, user=contributor)
+
+        response = self.view(delete_request, project_id=sapelli_project.geokey_project.id).render()
+
+        self.assertTrue(json.loads(response.content).get('deleted'))
+        sapelli_project = SapelliProject.objects.get(pk=sapelli_project.pk)
+        self.assertEqual(sapelli_project.download_key_version, 0)
+        self.assertTrue(verify_download_link_params(sapelli_project, admin_params))
+        self.assertFalse(verify_download_link_params(sapelli_project, contributor_params))
 
     def test_delete_with_user(self):
         delete_request = HttpRequest()
@@ -779,3 +1557,370 @@ class SapelliLogsViaGeoKeyInfoTest(TestCase):
         self.assertEqual(
             reference.sapelli_project,
             self.sapelli_project)
+
+    def get_log_file(self, url):
+        """Follow the URL of an uploaded log file (without being logged in)."""
+        request = RequestFactory().get(url)
+        request.user = self.anonymous_user
+        match = resolve(request.path)
+        return match.func(request, **match.kwargs)
+
+    def test_follow_url_with_regular_user(self):
+        """Test following the URL of the log uploaded by regular user."""
+        response = self.post(self.regular_user)
+        self.assertEqual(response.status_code, 201)
+        url = json.loads(response.content)['url']
+
+        response = self.get_log_file(url)
+        self.assertEqual(response.status_code, 200)
+        with get_test_file(self.file_name) as test_file:
+            self.assertEqual(b''.join(response.streaming_content), test_file.read())
+
+    def test_follow_url_with_invalid_signature(self):
+        """Test following the URL of an uploaded log with a wrong signature."""
+        response = self.post(self.regular_user)
+        url = json.loads(response.content)['url']
+
+        self.assertRaises(PermissionDenied, self.get_log_file, url[:-1])
+
+
+class SapelliLogsBundleAPITest(TestCase):
+    """Test public API for uploading Sapelli logs as a ZIP archive."""
+
+    def setUp(self):
+        """Set up test."""
+        self.factory = APIRequestFactory()
+        self.user = UserFactory.create()
+        self.project = ProjectFactory(add_admins=[self.user])
+        self.sapelli_project = SapelliProjectFactory.create(
+            **{'geokey_project': self.project})
+
+    def tearDown(self):
+        """Tear down test."""
+        for sapelli_log_file in SapelliLogFile.objects.all():
+            sapelli_log_file.delete()
+        shutil.rmtree(get_project_archives_path(self.sapelli_project.pk), ignore_errors=True)
+
+    def post(self, file):
+        """Custom method for testing POST."""
+        url = reverse(
+            'geokey_sapelli:project_logs_bundle_api',
+            kwargs={'project_id': self.project.id})
+        request = self.factory.post(url, {'file': file})
+        force_authenticate(request, self.user)
+        view = SapelliLogsBundleAPI.as_view()
+        return view(
+            request,
+            project_id=self.project.id,
+        ).render()
+
+    def create_bundle(self, entries):
+        """Create a ZIP archive with the given (name, contents) entries."""
+        bundle = StringIO()
+        with zipfile.ZipFile(bundle, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for name, contents in entries:
+                zip_file.writestr(name, contents)
+        bundle.seek(0)
+        bundle.name = 'Logs.zip'
+        return bundle
+
+    def test_url(self):
+        """Test URL."""
+        self.assertEqual(
+            reverse('geokey_sapelli:project_logs_bundle_api', kwargs={'project_id': 1}),
+            '/api/sapelli/projects/1/logs/bundle/')
+
+        resolved = resolve('/api/sapelli/projects/1/logs/bundle/')
+        self.assertEqual(resolved.kwargs['project_id'], '1')
+        self.assertEqual(resolved.func.func_name, SapelliLogsBundleAPI.__name__)
+
+    def test_post(self):
+        """Test POST with a ZIP archive of logs."""
+        response = self.post(self.create_bundle([
+            ('logs/Collector_2015-01-20T18.02.12.log', b'Form started\n'),
+            ('logs/Collector_2015-01-21T09.30.00.log', b'Form ended\n'),
+            ('__MACOSX/logs/._Collector_2015-01-20T18.02.12.log', b'...'),
+        ]))
+
+        self.assertEqual(response.status_code, 201)
+        result = json.loads(response.content)
+        self.assertEqual(len(result['created']), 2)
+        self.assertEqual(result['duplicates'], [])
+        self.assertEqual(result['rejected'], [])
+
+        logs = list(self.sapelli_project.logs.all())
+        self.assertEqual(
+            [log.name for log in logs],
+            ['Collector_2015-01-20T18.02.12.log', 'Collector_2015-01-21T09.30.00.log'])
+        self.assertEqual(logs[1].created_at, datetime(2015, 1, 21, 9, 30, 0, tzinfo=utc))
+        with logs[1].open_decompressed() as log_file:
+            self.assertEqual(log_file.read(), b'Form ended\n')
+        self.assertTrue(os.path.isfile(get_segment_path(self.sapelli_project.pk, logs[1].created_at.date())))
+
+    @override_settings(SAPELLI_LOG_COMPRESSION=None)
+    def test_post_uncompressed(self):
+        """Test POST with a ZIP archive of logs, storing them uncompressed."""
+        response = self.post(self.create_bundle([
+            ('Collector_2015-01-20T18.02.12.log', b'Form started\n'),
+            ('Collector_2015-01-21T09.30.00.log', b'Form ended\n'),
+        ]))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [log.file.read() for log in self.sapelli_project.logs.all()],
+            [b'Form started\n', b'Form ended\n'])
+
+    def test_post_with_duplicates(self):
+        """Test POST with logs the project has already."""
+        self.post(self.create_bundle([
+            ('Collector_2015-01-20T18.02.12.log', b'Form started\n'),
+        ]))
+        response = self.post(self.create_bundle([
+            ('Collector_2015-01-20T18.02.12.log', b'Form started\n'),
+            ('Collector_2015-01-21T09.30.00.log', b'Form started\n'),
+        ]))
+
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content)
+        self.assertEqual(result['created'], [])
+        self.assertEqual(
+            result['duplicates'],
+            ['Collector_2015-01-20T18.02.12.log', 'Collector_2015-01-21T09.30.00.log'])
+        self.assertEqual(self.sapelli_project.logs.count(), 1)
+
+    def test_post_without_zip(self):
+        """Test POST with a file which is not a ZIP archive."""
+        response = self.post(get_test_file('Collector_2015-01-20T18.02.12.log'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.sapelli_project.logs.count(), 0)
+
+
+class SapelliLogsMissingAPITest(TestCase):
+    """Test public API for finding the logs a project does not have."""
+
+    def setUp(self):
+        """Set up test."""
+        self.factory = APIRequestFactory()
+        self.user = UserFactory.create()
+        self.project = ProjectFactory(add_admins=[self.user])
+        self.sapelli_project = SapelliProjectFactory.create(
+            **{'geokey_project': self.project})
+        self.log = SapelliLogFile.create(
+            None,
+            self.user,
+            self.sapelli_project,
+            get_test_file('Collector_2015-01-20T18.02.12.log'))
+
+    def tearDown(self):
+        """Tear down test."""
+        for sapelli_log_file in SapelliLogFile.objects.all():
+            sapelli_log_file.delete()
+        shutil.rmtree(get_project_archives_path(self.sapelli_project.pk), ignore_errors=True)
+
+    def post(self, data):
+        """Custom method for testing POST."""
+        url = reverse(
+            'geokey_sapelli:project_logs_missing_api',
+            kwargs={'project_id': self.project.id})
+        request = self.factory.post(url, data, format='json')
+        force_authenticate(request, self.user)
+        view = SapelliLogsMissingAPI.as_view()
+        return view(
+            request,
+            project_id=self.project.id,
+        ).render()
+
+    def test_url(self):
+        """Test URL."""
+        self.assertEqual(
+            reverse('geokey_sapelli:project_logs_missing_api', kwargs={'project_id': 1}),
+            '/api/sapelli/projects/1/logs/missing/')
+
+        resolved = resolve('/api/sapelli/projects/1/logs/missing/')
+        self.assertEqual(resolved.func.func_name, SapelliLogsMissingAPI.__name__)
+
+    def test_post(self):
+        """Test POST with stored and unknown hashes."""
+        unknown_hash = 'ab' * 32
+        response = self.post({'hashes': [self.log.content_hash.upper(), unknown_hash]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'missing': [unknown_hash]})
+
+    def test_post_with_invalid_hashes(self):
+        """Test POST with invalid hashes."""
+        response = self.post({'hashes': ['not a hash']})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.post({'hashes': 'ab' * 32})
+        self.assertEqual(response.status_code, 400)
+
+
+class UploadSessionAPITest(TestCase):
+    """Test public API for resumable (chunked) uploads."""
+
+    def setUp(self):
+        """Set up test."""
+        self.factory = APIRequestFactory()
+        self.admin = UserFactory.create()
+        self.project = ProjectFactory(add_admins=[self.admin])
+        self.sapelli_project = SapelliProjectFactory.create(
+            **{'geokey_project': self.project})
+
+        self.file_name = 'Collector_2015-01-20T18.02.12.log'
+        with get_test_file(self.file_name) as test_file:
+            self.contents = test_file.read()
+
+    def tearDown(self):
+        """Tear down test."""
+        for session in SapelliUploadSession.objects.all():
+            session.delete()
+        for sapelli_log_file in SapelliLogFile.objects.all():
+            sapelli_log_file.delete()
+        shutil.rmtree(get_project_archives_path(self.sapelli_project.pk), ignore_errors=True)
+
+    def open_session(self, size=None):
+        """Custom method for opening an upload session."""
+        url = reverse(
+            'geokey_sapelli:upload_sessions_api',
+            kwargs={'project_id': self.project.id})
+        request = self.factory.post(url, {
+            'kind': 'log',
+            'name': self.file_name,
+            'size': len(self.contents) if size is None else size})
+        force_authenticate(request, self.admin)
+        return UploadSessionsAPI.as_view()(request, project_id=self.project.id).render()
+
+    def session_request(self, method, key, data=None, **extra):
+        """Custom method for sending a request to an upload session."""
+        url = reverse('geokey_sapelli:upload_session_api', kwargs={'key': key})
+        if data is None:
+            request = getattr(self.factory, method)(url, **extra)
+        else:
+            request = getattr(self.factory, method)(url, data, content_type='application/octet-stream', **extra)
+        force_authenticate(request, self.admin)
+        return UploadSessionAPI.as_view()(request, key=key).render()
+
+    def put_chunk(self, key, start, end):
+        """Custom method for sending a chunk (end is inclusive)."""
+        return self.session_request(
+            'put', key, self.contents[start:end + 1],
+            HTTP_CONTENT_RANGE='bytes %s-%s/%s' % (start, end, len(self.contents)))
+
+    def test_url(self):
+        """Test URLs."""
+        self.assertEqual(
+            reverse('geokey_sapelli:upload_sessions_api', kwargs={'project_id': 1}),
+            '/api/sapelli/projects/1/upload_sessions/')
+        resolved = resolve('/api/sapelli/upload_sessions/%s/' % ('a' * 32))
+        self.assertEqual(resolved.kwargs['key'], 'a' * 32)
+        self.assertEqual(resolved.func.func_name, UploadSessionAPI.__name__)
+
+    def test_upload_log_in_chunks(self):
+        """Test opening a session, sending chunks out of order and finalising."""
+        response = self.open_session()
+        self.assertEqual(response.status_code, 201)
+        key = json.loads(response.content)['id']
+        size = len(self.contents)
+        middle = size // 2
+
+        response = self.put_chunk(key, middle, size - 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['missing'], [[0, middle - 1]])
+
+        # Finalising is refused while chunks are missing:
+        response = self.session_request('post', key)
+        self.assertEqual(response.status_code, 409)
+
+        response = self.put_chunk(key, 0, middle - 1)
+        self.assertEqual(json.loads(response.content)['missing'], [])
+        self.assertEqual(json.loads(response.content)['received'], size)
+
+        response = self.session_request('post', key)
+        self.assertEqual(response.status_code, 201)
+        log = SapelliLogFile.objects.get(pk=json.loads(response.content)['id'])
+        self.assertEqual(log.name, self.file_name)
+        self.assertEqual(log.created_at, datetime(2015, 01, 20, 18, 02, 12).replace(tzinfo=utc))
+        with log.open_decompressed() as log_file:
+            self.assertEqual(log_file.read(), self.contents)
+        self.assertFalse(SapelliUploadSession.objects.filter(key=key).exists())
+
+    def test_put_with_invalid_range(self):
+        """Test PUT with a chunk that does not match its Content-Range."""
+        key = json.loads(self.open_session().content)['id']
+        response = self.session_request(
+            'put', key, self.contents[:10],
+            HTTP_CONTENT_RANGE='bytes 0-19/%s' % len(self.contents))
+        self.assertEqual(response.status_code, 400)
+
+    def test_delete(self):
+        """Test aborting an upload."""
+        key = json.loads(self.open_session().content)['id']
+        path = SapelliUploadSession.objects.get(key=key).path
+        response = self.session_request('delete', key)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(SapelliUploadSession.objects.filter(key=key).exists())
+        self.assertFalse(os.path.exists(path))
+
+    @override_settings(SAPELLI_UPLOAD_MAX_SIZE=10)
+    def test_open_too_large(self):
+        """Test opening an upload of a file that is too large."""
+        response = self.open_session()
+        self.assertEqual(response.status_code, 400)
+
+    def test_open_does_not_allocate(self):
+        """Test that the file of a new upload is empty until chunks arrive."""
+        key = json.loads(self.open_session().content)['id']
+        path = SapelliUploadSession.objects.get(key=key).path
+        self.assertEqual(os.path.getsize(path), 0)
+
+        self.put_chunk(key, 0, 9)
+        self.assertEqual(os.path.getsize(path), 10)
+
+    @override_settings(SAPELLI_UPLOAD_MAX_OPEN_SESSIONS=2)
+    def test_open_too_many(self):
+        """Test opening more uploads than a user may have open."""
+        self.assertEqual(self.open_session().status_code, 201)
+        self.assertEqual(self.open_session().status_code, 201)
+        self.assertEqual(self.open_session().status_code, 400)
+
+    def test_open_too_large_in_total(self):
+        """Test opening uploads which are too large in total."""
+        with override_settings(SAPELLI_UPLOAD_MAX_OPEN_SIZE=len(self.contents) * 2 - 1):
+            self.assertEqual(self.open_session().status_code, 201)
+            self.assertEqual(self.open_session().status_code, 400)
+
+    @override_settings(SAPELLI_UPLOAD_MAX_OPEN_SESSIONS=1, SAPELLI_UPLOAD_MAX_ANONYMOUS_OPEN_SESSIONS=2)
+    def test_open_anonymously(self):
+        """Test that anonymous uploads have a limit of their own."""
+        for i in range(2):
+            open_upload_session(
+                SapelliUploadSession.LOG, self.file_name, 10, self.admin, self.sapelli_project, anonymous=True)
+        self.assertRaises(
+            SapelliException,
+            open_upload_session,
+            SapelliUploadSession.LOG, self.file_name, 10, self.admin, self.sapelli_project, anonymous=True)
+
+    def test_finalise_twice(self):
+        """Test finalising an upload that is being finalised already."""
+        key = json.loads(self.open_session().content)['id']
+        self.put_chunk(key, 0, len(self.contents) - 1)
+        SapelliUploadSession.objects.filter(key=key).update(status=SapelliUploadSession.FINALISING)
+
+        for method in ('post', 'delete'):
+            response = self.session_request(method, key)
+            self.assertEqual(response.status_code, 409)
+        response = self.put_chunk(key, 0, 9)
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(SapelliUploadSession.objects.filter(key=key).exists())
+        self.assertFalse(SapelliLogFile.objects.exists())
+
+    def test_open_csv_anonymously(self):
+        """Test opening an upload of a CSV file without logging in."""
+        url = reverse(
+            'geokey_sapelli:upload_sessions_api',
+            kwargs={'project_id': self.project.id})
+        request = self.factory.post(url, {'kind': 'csv', 'name': 'Horniman.csv', 'size': 100})
+        request.user = AnonymousUser()
+        response = UploadSessionsAPI.as_view()(request, project_id=self.project.id).render()
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(SapelliUploadSession.objects.exists())
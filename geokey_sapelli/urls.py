@@ -4,18 +4,30 @@ from rest_framework.urlpatterns import format_suffix_patterns
 
 from geokey_sapelli.views import (
     ProjectUpload,
+    UploadJobStatus,
     DataCSVUpload,
     ProjectList,
     LogsZipView,
+    LogFileView,
+    LogSearchView,
+    LogArchiveView,
+    HealthAPI,
+    MetricsAPI,
     LoginAPI,
     ProjectDescriptionAPI,
     ProjectUploadAPI,
+    UploadJobAPI,
     DataCSVUploadAPI,
     DataLogsDownload,
     FindObservationAPI,
     SAPDownloadAPI,
     SAPDownloadQRLinkAPI,
     SapelliLogsViaPersonalInfo, SapelliLogsViaGeoKeyInfo,
+    SapelliLogsBundleAPI,
+    SapelliLogsMissingAPI,
+    LogFileAPI,
+    UploadSessionsAPI,
+    UploadSessionAPI,
 )
 
 
@@ -43,6 +55,10 @@ urlpatterns = [
         r'^admin/sapelli/projects/new$',
         ProjectUpload.as_view(),
         name='project_upload'),
+    url(
+        r'^admin/sapelli/uploads/(?P<job_id>[0-9]+)/$',
+        UploadJobStatus.as_view(),
+        name='upload_job'),
     url(
         r'^admin/sapelli/projects/(?P<project_id>[0-9]+)/csv_upload/$',
         DataCSVUpload.as_view(),
@@ -51,11 +67,31 @@ urlpatterns = [
         r'^admin/sapelli/projects/(?P<project_id>[0-9]+)/logs/$',
         DataLogsDownload.as_view(),
         name='logs'),
+    url(
+        r'^admin/sapelli/projects/(?P<project_id>[0-9]+)/logs/(?P<log_id>[0-9]+)/file$',
+        LogFileView.as_view(),
+        name='log_file'),
+    url(
+        r'^admin/sapelli/projects/(?P<project_id>[0-9]+)/logs/search/$',
+        LogSearchView.as_view(),
+        name='log_search'),
+    url(
+        r'^admin/sapelli/projects/(?P<project_id>[0-9]+)/logs/archives/(?P<archive_id>[0-9]+)/file$',
+        LogArchiveView.as_view(),
+        name='log_archive'),
 
     #
     # API ENDPOINTS
     #
 
+    url(
+        r'^api/sapelli/health/$',
+        HealthAPI.as_view(),
+        name='health_api'),
+    url(
+        r'^api/sapelli/metrics/$',
+        MetricsAPI.as_view(),
+        name='metrics_api'),
     url(
         r'^api/sapelli/login/$',
         LoginAPI.as_view(),
@@ -72,6 +108,10 @@ urlpatterns = [
         r'^api/sapelli/projects/new/$',
         ProjectUploadAPI.as_view(),
         name='project_upload_api'),
+    url(
+        r'^api/sapelli/uploads/(?P<job_id>[0-9]+)/$',
+        UploadJobAPI.as_view(),
+        name='upload_job_api'),
     url(
         r'^api/sapelli/projects/(?P<project_id>[0-9]+)/csv_upload/$',
         DataCSVUploadAPI.as_view(),
@@ -92,4 +132,24 @@ urlpatterns = [
         r'^api/sapelli/projects/(?P<project_id>[0-9]+)/logs/$',
         SapelliLogsViaGeoKeyInfo.as_view(),
         name='project_logs_api_via_gk_info'),
+    url(
+        r'^api/sapelli/projects/(?P<project_id>[0-9]+)/logs/bundle/$',
+        SapelliLogsBundleAPI.as_view(),
+        name='project_logs_bundle_api'),
+    url(
+        r'^api/sapelli/projects/(?P<project_id>[0-9]+)/logs/missing/$',
+        SapelliLogsMissingAPI.as_view(),
+        name='project_logs_missing_api'),
+    url(
+        r'^api/sapelli/projects/(?P<project_id>[0-9]+)/logs/(?P<log_id>[0-9]+)/file/$',
+        LogFileAPI.as_view(),
+        name='log_file_api'),
+    url(
+        r'^api/sapelli/projects/(?P<project_id>[0-9]+)/upload_sessions/$',
+        UploadSessionsAPI.as_view(),
+        name='upload_sessions_api'),
+    url(
+        r'^api/sapelli/upload_sessions/(?P<key>[0-9a-f]{32})/$',
+        UploadSessionAPI.as_view(),
+        name='upload_session_api'),
 ]
@@ -2,11 +2,14 @@
 from __future__ import unicode_literals
 
 import os
+import re
 import json
-import qrcode
+import logging
+import shutil
+import tempfile
+import zlib
 
-from StringIO import StringIO
-from zipfile import ZipFile
+from zipfile import ZIP_DEFLATED, BadZipfile
 from dateutil import parser
 
 from django.views.generic import View, TemplateView
@@ -15,12 +18,15 @@ from django.shortcuts import redirect
 from django.core.urlresolvers import reverse
 from django.core.exceptions import PermissionDenied
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.core.files import File
 from django.conf import settings
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse, Http404
 from django.utils import timezone, dateformat
+from django.utils.http import urlencode
+from django.utils.crypto import constant_time_compare
+from django.db.models import Q
 
 from braces.views import LoginRequiredMixin
-from wsgiref.util import FileWrapper
 
 from rest_framework import status
 from rest_framework.views import APIView
@@ -36,19 +42,54 @@ from geokey.core.decorators import (
 )
 from geokey.projects.models import Project
 
-from .models import SapelliProject, SAPDownloadQRLink, SapelliLogFile
-from .helper.sapelli_loader import load_from_sap
+from .models import (
+    SapelliProject,
+    SAPDownloadQRLink,
+    SapelliLogFile,
+    SapelliLogEntry,
+    SapelliLogArchive,
+    SapelliUploadJob,
+    SapelliUploadSession,
+)
+from .helper.upload_queue import queue_sap_upload
+from .helper.upload_sessions import (
+    open_upload_session, claim_upload_session, release_upload_session, parse_content_range, write_chunk)
 from .helper.sapelli_exceptions import (
     SapelliException,
     SapelliSAPException,
     SapelliXMLException,
     SapelliDuplicateException,
-    SapelliCSVException
+    SapelliCSVException,
+    SapelliLoginException
+)
+from .helper.login_tokens import issue_password_token
+from .authentication import get_api_authentication_classes
+from .helper.install_checks import get_extension_status
+from .helper.zip_stream import ZipStream
+from .helper.log_archives import DailyArchiveReader
+from .helper.log_compression import GZIP, get_log_compression, get_gzip_member, read_file_range
+from .helper.log_bundles import iter_log_bundle
+from .helper.log_index import search_log_entries
+from .helper.import_timing import ImportTimer, get_profile_path
+from .helper.metrics import metrics, metrics_enabled, render_metrics
+from .helper.file_responses import serve_file, etag_matches
+from .helper.qr_cache import get_qr_image_key, get_qr_png
+from .helper.download_links import (
+    signed_download_links_enabled,
+    create_download_link_params,
+    get_expiry_datetime,
+    verify_download_link_params,
+    verify_log_file_signature
 )
-from .helper.install_checks import check_extension
 
 from geokey_sapelli.serializers import SapelliLogFileSerializer
 
+API_AUTHENTICATION_CLASSES = get_api_authentication_classes()
+
+logger = logging.getLogger(__name__)
+
+LOG_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
 
 # ############################################################################
 #
@@ -59,13 +100,12 @@ from geokey_sapelli.serializers import SapelliLogFileSerializer
 class AbstractSapelliView(LoginRequiredMixin, TemplateView):
 
     def check(self):
-        """Check if extension is correctly installed."""
-        try:
-            check_extension()
-        except SapelliException, se:
+        """Check if extension is correctly installed (using the cached status)."""
+        status = get_extension_status()
+        if not status['ok']:
             messages.error(
                 self.request,
-                'The Sapelli extension is not properly installed: ' + str(se))
+                'The Sapelli extension is not properly installed: ' + status['error'])
 
 
 class ProjectList(AbstractSapelliView):
@@ -110,12 +150,22 @@ class ProjectUpload(AbstractSapelliView):
             Redirecting to the data upload form
         """
         try:
-            sapelli_project = load_from_sap(request.FILES.get('sap_file'), request.user)
+            job = queue_sap_upload(
+                request.FILES.get('sap_file'),
+                request.user,
+                upgrade=request.POST.get('upgrade') == 'true')
+
+            if not job.is_finished:
+                messages.info(self.request, 'The project file has been uploaded and is being processed.')
+                return redirect('geokey_sapelli:upload_job', job_id=job.id)
 
-            messages.success(self.request, 'The project has been created.')
+            if job.upgraded:
+                messages.success(self.request, 'The project has been upgraded.')
+            else:
+                messages.success(self.request, 'The project has been created.')
             return redirect(
                 'geokey_sapelli:data_csv_upload',
-                project_id=sapelli_project.geokey_project.id
+                project_id=job.sapelli_project.geokey_project.id
             )
         except SapelliSAPException, e:
             messages.error(
@@ -149,6 +199,35 @@ class ProjectUpload(AbstractSapelliView):
         return self.render_to_response({})
 
 
+class UploadJobStatus(AbstractSapelliView):
+    """
+    Presents the progress of a queued project upload, polling the status API
+    until processing has finished.
+    """
+    template_name = 'sapelli/upload_job.html'
+
+    def get_context_data(self, job_id):
+        """
+        Returns the context to render the view. Contains the upload job.
+
+        Parameters
+        ----------
+        job_id : int
+            Identifies the upload job in the database.
+
+        Returns
+        -------
+        dict
+        """
+        try:
+            return {'job': SapelliUploadJob.objects.get_single_for_user(self.request.user, job_id)}
+        except SapelliUploadJob.DoesNotExist:
+            return {
+                'error_description': 'Upload not found.',
+                'error': 'Not found'
+            }
+
+
 class SapelliProjectMixin(LoginRequiredMixin):
     """Sapelli project mixin (requires a user to be logged in)."""
 
@@ -294,8 +373,14 @@ class DataCSVUpload(SapelliProjectAbstractView):
         if sapelli_project is not None:
             csv_file = request.FILES.get('csv_file')
             form_category_id = request.POST.get('form_category_id')
+            timer = ImportTimer() if request.POST.get('timing') else None
             try:
-                imported, imported_joined_locations, imported_no_location, updated, ignored_duplicate = sapelli_project.import_from_csv(request.user, csv_file, form_category_id)
+                imported, imported_joined_locations, imported_no_location, updated, ignored_duplicate = sapelli_project.import_from_csv(
+                    request.user,
+                    csv_file,
+                    form_category_id,
+                    timer=timer,
+                    profile_path=get_profile_path(sapelli_project) if timer else None)
                 messages.success(
                     self.request,
                     "Result:\n"
@@ -306,6 +391,8 @@ class DataCSVUpload(SapelliProjectAbstractView):
                     " - %s have been ignored because they were identical to existing contributions;"
                     % (imported, imported_joined_locations, imported_no_location, updated, ignored_duplicate)
                 )
+                if timer is not None:
+                    messages.info(self.request, timer.format())
             except SapelliCSVException, e:
                 messages.error(self.request, 'Failed to process CSV file, due to:\n\n' + str(e))
 
@@ -352,6 +439,7 @@ class DataLogsDownload(SapelliProjectMixin, TemplateView):
             context['logs'] = self.paginate_logs(
                 logs,
                 self.request.GET.get('page'))
+            context['log_archives'] = sapelli_project.log_archives.all()
 
         return context
 
@@ -414,16 +502,11 @@ class LogsZipView(SapelliProjectMixin, View):
                 data.get('date_from'),
                 data.get('date_to'))
 
-            if len(logs) == 0:
+            if not logs.exists():
                 messages.error(self.request, 'Nothing to archive.')
             else:
-                temp_file = StringIO()
-                with ZipFile(temp_file, 'w') as archive:
-                    for log in logs:
-                        archive.write(log.file.path, log.name)
-
-                response = HttpResponse(
-                    temp_file.getvalue(),
+                response = StreamingHttpResponse(
+                    self.stream_archive(sapelli_project, logs),
                     content_type='application/x-zip-compressed')
                 response['Content-Disposition'] = 'attachment; filename="%s - %s.zip"' % (
                     file,
@@ -433,6 +516,236 @@ class LogsZipView(SapelliProjectMixin, View):
 
         return redirect('geokey_sapelli:logs', project_id=project_id)
 
+    def stream_archive(self, sapelli_project, logs):
+        """
+        Generate the ZIP archive of the given logs chunk by chunk, so memory
+        use does not grow with the number of logs. Logs are copied compressed
+        from the daily archives (or their gzip files) where possible, or else
+        read and compressed one log file at a time.
+        """
+        archive = ZipStream()
+        segments = DailyArchiveReader(sapelli_project.pk)
+        try:
+            for log in logs.order_by('created_at', 'id').iterator():
+                date_time = timezone.localtime(log.created_at)
+                entry = segments.get_entry(log)
+                if entry:
+                    info, data_offset = entry
+                    for chunk in archive.add_raw(
+                            log.name, date_time, info.compress_type, info.CRC,
+                            info.compress_size, info.file_size,
+                            segments.read_raw(info, data_offset)):
+                        yield chunk
+                    continue
+
+                try:
+                    member = get_gzip_member(log.file.path) if log.compression == GZIP else None
+                    log_file = None if member else log.open_decompressed()
+                except (IOError, SapelliException), e:
+                    logger.warning('Skipping unreadable Sapelli log file %s: %s', log.file.name, str(e))
+                    continue
+                if member:
+                    # Copy the deflate stream of the gzip file as it is:
+                    data_offset, compress_size, crc, file_size = member
+                    for chunk in archive.add_raw(
+                            log.name, date_time, ZIP_DEFLATED, crc, compress_size, file_size,
+                            read_file_range(log.file.path, data_offset, compress_size)):
+                        yield chunk
+                    continue
+                with log_file:
+                    for chunk in archive.add_file(log.name, log_file, date_time):
+                        yield chunk
+        finally:
+            segments.close()
+        for chunk in archive.close():
+            yield chunk
+
+
+class LogFileResponseMixin(object):
+    """Responds with a single (compressed at rest) Sapelli log."""
+
+    def respond_with_log(self, request, log):
+        """
+        Respond with a log file.
+
+        Parameters
+        ----------
+        request : django.http.HttpRequest
+            Object representing the request.
+        log : geokey_sapelli.models.SapelliLogFile
+            The log file.
+
+        Returns
+        -------
+        django.http.StreamingHttpResponse
+            The (decompressed) log file, or its gzip file as is when the client
+            accepts gzip encoded responses.
+        """
+        if log.compression == GZIP and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response = StreamingHttpResponse(
+                read_file_range(log.file.path, 0, log.file.size),
+                content_type='text/plain')
+            response['Content-Encoding'] = 'gzip'
+            response['Content-Length'] = log.file.size
+        else:
+            response = StreamingHttpResponse(
+                self.stream_log(log),
+                content_type='text/plain')
+        response['Content-Disposition'] = 'attachment; filename="%s"' % log.name
+        return response
+
+    def stream_log(self, log):
+        """Generate the decompressed contents of a log chunk by chunk."""
+        with log.open_decompressed() as log_file:
+            for data in iter(lambda: log_file.read(64 * 1024), b''):
+                yield data
+
+
+class LogFileView(LogFileResponseMixin, SapelliProjectMixin, View):
+    """Admin page for downloading a single (compressed at rest) Sapelli log."""
+
+    def get(self, request, project_id, log_id):
+        """
+        Handle GET request.
+
+        Parameters
+        ----------
+        request : django.http.HttpRequest
+            Object representing the request.
+        project_id : int
+            Identifies the GeoKey project in the database.
+        log_id : int
+            Identifies the log file in the database.
+
+        Returns
+        -------
+        django.http.StreamingHttpResponse
+            The (decompressed) log file, or its gzip file as is when the client
+            accepts gzip encoded responses.
+        """
+        try:
+            sapelli_project = self.get_object(request.user, project_id)
+            log = sapelli_project.logs.get(pk=log_id)
+        except (SapelliProject.DoesNotExist, SapelliLogFile.DoesNotExist):
+            raise Http404('Sapelli log not found.')
+
+        return self.respond_with_log(request, log)
+
+
+class LogArchiveView(SapelliProjectMixin, View):
+    """Admin page for downloading a monthly archive of (compacted) Sapelli logs."""
+
+    def get(self, request, project_id, archive_id):
+        """
+        Handle GET request.
+
+        Parameters
+        ----------
+        request : django.http.HttpRequest
+            Object representing the request.
+        project_id : int
+            Identifies the GeoKey project in the database.
+        archive_id : int
+            Identifies the log archive in the database.
+
+        Returns
+        -------
+        django.http.HttpResponse
+            The ZIP archive.
+        """
+        try:
+            sapelli_project = self.get_object(request.user, project_id)
+            archive = sapelli_project.log_archives.get(pk=archive_id)
+        except (SapelliProject.DoesNotExist, SapelliLogArchive.DoesNotExist):
+            raise Http404('Sapelli log archive not found.')
+
+        if not os.path.isfile(archive.get_path()):
+            raise Http404('Sapelli log archive not found.')
+        return serve_file(request, archive.get_path(), 'application/zip', filename=archive.name)
+
+
+class LogSearchView(SapelliProjectMixin, View):
+    """
+    Admin endpoint for searching the (indexed) contents of Sapelli logs.
+
+    Entries are returned newest first, in pages linked by a cursor (`before`,
+    the ID of the last entry of the previous page), so that deep pages are as
+    cheap to fetch as the first one.
+    """
+
+    page_size = 50
+    max_page_size = 500
+
+    def get(self, request, project_id):
+        """
+        Handle GET request.
+
+        Parameters
+        ----------
+        request : django.http.HttpRequest
+            Object representing the request, optionally with the filters `q`
+            (full-text search), `level`, `event_type`, `device_id`,
+            `date_from`, `date_to`, and the paging parameters `limit` and
+            `before`.
+        project_id : int
+            Identifies the GeoKey project in the database.
+
+        Returns
+        -------
+        django.http.JsonResponse
+            The matching log entries, and the URL of the next page (if any).
+        """
+        try:
+            sapelli_project = self.get_object(request.user, project_id)
+        except SapelliProject.DoesNotExist:
+            return JsonResponse({'error': 'Sapelli project not found.'}, status=404)
+
+        data = request.GET
+        entries = sapelli_project.log_entries.all()
+        try:
+            if data.get('q'):
+                entries = search_log_entries(entries, data['q'])
+            if data.get('level'):
+                entries = entries.filter(level__in=data['level'].split(','))
+            if data.get('event_type'):
+                entries = entries.filter(event_type=data['event_type'])
+            if data.get('device_id'):
+                entries = entries.filter(device_id=int(data['device_id']))
+            if data.get('date_from'):
+                entries = entries.filter(timestamp__gte=self.parse_date(data['date_from']))
+            if data.get('date_to'):
+                entries = entries.filter(timestamp__lt=self.parse_date(data['date_to']))
+            limit = max(1, min(int(data.get('limit', self.page_size)), self.max_page_size))
+            if data.get('before'):
+                before = sapelli_project.log_entries.get(pk=int(data['before']))
+                entries = entries.filter(
+                    Q(timestamp__lt=before.timestamp) |
+                    Q(timestamp=before.timestamp, id__lt=before.id))
+        except (ValueError, OverflowError):
+            return JsonResponse({'error': 'Invalid search parameters.'}, status=400)
+        except SapelliLogEntry.DoesNotExist:
+            return JsonResponse({'error': 'Log entry `before` not found.'}, status=400)
+
+        page = list(entries.defer('search_vector').order_by('-timestamp', '-id')[:limit + 1])
+        next_url = None
+        if len(page) > limit:
+            page = page[:limit]
+            params = data.copy()
+            params['before'] = page[-1].id
+            next_url = '%s?%s' % (request.path, params.urlencode())
+
+        return JsonResponse({
+            'entries': [entry.to_dict() for entry in page],
+            'next': next_url,
+        })
+
+    def parse_date(self, value):
+        """Parse a date (assumed to be in UTC unless stated otherwise)."""
+        date = parser.parse(value)
+        if timezone.is_naive(date):
+            date = timezone.make_aware(date, timezone.utc)
+        return date
+
 
 # ############################################################################
 #
@@ -440,6 +753,73 @@ class LogsZipView(SapelliProjectMixin, View):
 #
 # ############################################################################
 
+class HealthAPI(View):
+    """
+    Cheap health check endpoint (e.g. for load balancers), reporting the
+    cached outcome of the extension installation checks.
+    api/sapelli/health/
+    """
+
+    def get(self, request):
+        """
+        Handles GET requests for the health of the extension.
+
+        Parameter
+        ---------
+        request : django.http.HttpRequest
+            Object representing the request.
+
+        Returns
+        -------
+        JSON with 'status' ('ok' or 'error') and 'checked_at' timestamp, with
+        HTTP status 200 when healthy and 503 otherwise. The 'error' message is
+        only included for superusers.
+        """
+        extension_status = get_extension_status()
+        response = {
+            'status': 'ok' if extension_status['ok'] else 'error',
+            'checked_at': extension_status['checked_at'],
+        }
+        if not extension_status['ok'] and request.user.is_superuser:
+            response['error'] = extension_status['error']
+        return JsonResponse(response, status=200 if extension_status['ok'] else 503)
+
+
+class MetricsAPI(View):
+    """
+    Metrics of the extension (totalled across server processes), in the
+    Prometheus text format.
+    api/sapelli/metrics/
+    """
+
+    def get(self, request):
+        """
+        Handles GET requests for the metrics.
+
+        Parameter
+        ---------
+        request : django.http.HttpRequest
+            Object representing the request. When SAPELLI_METRICS_TOKEN is set,
+            it must carry the token as 'Authorization: Bearer <token>' header
+            (unless made by a superuser).
+
+        Returns
+        -------
+        django.http.HttpResponse
+            The metrics, or 404 if metrics are disabled and 403 if the token
+            is missing or wrong.
+        """
+        if not metrics_enabled():
+            raise Http404('Metrics are disabled.')
+        token = getattr(settings, 'SAPELLI_METRICS_TOKEN', None)
+        if token and not request.user.is_superuser and not constant_time_compare(
+                request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer %s' % token):
+            raise PermissionDenied
+        return HttpResponse(
+            render_metrics(metrics.get_totals()),
+            content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class LoginAPI(TokenView, APIView):
     """
     This API allows Sapelli Collector instances (running on smartphones) to
@@ -453,6 +833,8 @@ class LoginAPI(TokenView, APIView):
     of the application/client (registered to the GeoKey server, as explained in
     README.rst) and let the smartphone app authenticate users through this API.
     """
+    authentication_classes = API_AUTHENTICATION_CLASSES
+
     def post(self, request, *args, **kwargs):
         """
         Handles POST requests for user authentication.
@@ -471,39 +853,63 @@ class LoginAPI(TokenView, APIView):
         containing error information.
         """
         try:
-            # Create new POST HttpRequest (the request we got is a rest_framework.request.Request) and copy the POST parameters:
-            httpRequest = HttpRequest()
-            httpRequest.method = 'POST'
-            httpRequest.POST = request.POST.copy()
-
             # Keep for backwards compatibility
-            httpRequest.POST['grant_type'] = httpRequest.POST.get('grant_type', 'password')
+            grant_type = request.POST.get('grant_type', 'password')
+            if grant_type != 'password':
+                # Leave other grants (e.g. refresh_token) to the TokenView:
+                return self.post_to_token_view(request, *args, **kwargs)
 
-            # Add client_id parameter:
             try:
-                httpRequest.POST['client_id'] = settings.SAPELLI_CLIENT_ID
-            except AttributeError, e:
-                raise SapelliException(
-                    'geokey-sapelli is not properly configured as an application on the server: ' + str(e))
+                token = issue_password_token(
+                    request.POST.get('username'),
+                    request.POST.get('password'),
+                    request.POST.get('scope'),
+                    request=request)
+            except SapelliLoginException, e:
+                return Response(
+                    {'error': e.error, 'error_description': e.description},
+                    status=e.status_code)
+            response = Response(token)
+            # As the token endpoint does (RFC 6749, section 5.1):
+            response['Cache-Control'] = 'no-store'
+            response['Pragma'] = 'no-cache'
+            return response
+        except BaseException, e:
+            return Response({'error': str(e)})
 
-            # Use super class to perform actual login:
-            response = super(LoginAPI, self).post(httpRequest, *args, **kwargs)
+    def post_to_token_view(self, request, *args, **kwargs):
+        """
+        Handles a token request through the TokenView (i.e. oauthlib), adding
+        the 'expires_at' timestamp to the response.
+        """
+        # Create new POST HttpRequest (the request we got is a rest_framework.request.Request) and copy the POST parameters:
+        httpRequest = HttpRequest()
+        httpRequest.method = 'POST'
+        httpRequest.POST = request.POST.copy()
 
-            # Check response:
-            if response.status_code != 200:
-                # return response as-is:
-                return response
-            try:
-                # add expires time:
-                response_json = json.loads(response.content)
-                access_token = AccessToken.objects.get(token=response_json.get('access_token'))
-                response_json['expires_at'] = access_token.expires.isoformat()
-                return Response(response_json)
-            except BaseException, e:
-                # return response as-is:
-                return response
+        # Add client_id parameter:
+        try:
+            httpRequest.POST['client_id'] = settings.SAPELLI_CLIENT_ID
+        except AttributeError, e:
+            raise SapelliException(
+                'geokey-sapelli is not properly configured as an application on the server: ' + str(e))
+
+        # Use super class to perform actual request:
+        response = super(LoginAPI, self).post(httpRequest, *args, **kwargs)
+
+        # Check response:
+        if response.status_code != 200:
+            # return response as-is:
+            return response
+        try:
+            # add expires time:
+            response_json = json.loads(response.content)
+            access_token = AccessToken.objects.get(token=response_json.get('access_token'))
+            response_json['expires_at'] = access_token.expires.isoformat()
+            return Response(response_json)
         except BaseException, e:
-            return Response({'error': str(e)})
+            # return response as-is:
+            return response
 
     def get(self, request):
         """
@@ -530,6 +936,8 @@ class ProjectDescriptionAPI(APIView):
     api/sapelli/projects/description/xxxx/yyyyyyy
     With xxxx = Sapelli Project ID; and yyyyyyy = Sapelli Project Fingerprint
     """
+    authentication_classes = API_AUTHENTICATION_CLASSES
+
     @handle_exceptions_for_ajax
     def get(self, request, sapelli_project_id, sapelli_project_fingerprint):
         """
@@ -565,29 +973,39 @@ class ProjectUploadAPI(APIView):
     API Endpoint for uploading a new Sapelli project.
     api/sapelli/projects/new/
     """
+    authentication_classes = API_AUTHENTICATION_CLASSES
+
     @handle_exceptions_for_ajax
     def post(self, request):
         """
-        TODO
+        POST request handler to deal with an uploaded SAP file.
 
         Parameter
         ---------
         request : rest_framework.request.Request
             Object representing the request.
-        TODO
+            Expected to contain a file identified as 'sap_file', and optionally
+            an 'upgrade' parameter ('true') to upgrade an existing version of
+            the project in-place rather than creating a new project.
 
         Returns
         -------
-        TODO
+        JSON with the status of the upload job (see UploadJobAPI), which
+        includes the project description once processing is done (HTTP 201),
+        or which can be polled until it is (HTTP 202); or an 'error' message.
 
         Raises
         ------
-        TODO
+        PermissionDenied
+            When the user is not logged in.
         """
         if request.user.is_anonymous():
             raise PermissionDenied('API access not authorised, please login.')
         try:
-            sapelli_project = load_from_sap(request.FILES.get('sap_file'), request.user)
+            job = queue_sap_upload(
+                request.FILES.get('sap_file'),
+                request.user,
+                upgrade=request.POST.get('upgrade') in ('1', 'true', 'True'))
         except SapelliSAPException, e:
             error_response = {'error': str(e)}
             if e.java_stacktrace is not None:
@@ -596,16 +1014,60 @@ class ProjectUploadAPI(APIView):
         except SapelliException, e:
             return Response({'error': str(e)})
         else:
-            # return project description (as json) to signal successful upload:
-            Response(sapelli_project.get_description())
+            # return job status (including the project description once done):
+            if not job.is_finished:
+                return Response(job.get_status(), status=status.HTTP_202_ACCEPTED)
+            return Response(job.get_status(), status=status.HTTP_201_CREATED)
 
 
+class CSVImportMixin(object):
+    """Imports Sapelli records from an uploaded CSV file."""
 
-class DataCSVUploadAPI(APIView):
+    def import_and_respond(self, sapelli_project, user, csv_file, timing=False):
+        """
+        Import the records of a CSV file and respond with the outcome.
+
+        Parameters
+        ----------
+        sapelli_project : geokey_sapelli.models.SapelliProject
+            Sapelli project the records belong to.
+        user : geokey.users.models.User
+            User importing the records.
+        csv_file : django.core.files.File
+            The CSV file.
+        timing : bool
+            Whether to time (and, if SAPELLI_IMPORT_PROFILE_DIR is set,
+            profile) the import (optional).
+
+        Returns
+        -------
+        rest_framework.response.Response
+            JSON with the number of 'added', 'added_joined_locs', 'added_no_loc',
+            'updated' and 'ignored_duplicates' records (and the 'timing' of the
+            import, if requested), or an 'error' message.
+        """
+        timer = ImportTimer() if timing else None
+        try:
+            imported, imported_joined_locations, imported_no_location, updated, ignored_duplicate = sapelli_project.import_from_csv(
+                user,
+                csv_file,
+                timer=timer,
+                profile_path=get_profile_path(sapelli_project) if timing else None)
+            result = {'added': imported, 'added_joined_locs': imported_joined_locations, 'added_no_loc': imported_no_location, 'updated': updated, 'ignored_duplicates': ignored_duplicate}
+            if timer is not None:
+                result['timing'] = timer.to_dict()
+            return Response(result)
+        except BaseException, e:
+            return Response({'error': str(e)})
+
+
+class DataCSVUploadAPI(CSVImportMixin, APIView):
     """
     API Endpoint for uploading Sapelli records as CSV.
     api/sapelli/projects/pppp/csv_upload/
     """
+    authentication_classes = API_AUTHENTICATION_CLASSES
+
     @handle_exceptions_for_ajax
     def post(self, request, project_id):
         """
@@ -625,8 +1087,8 @@ class DataCSVUploadAPI(APIView):
 
         Returns
         -------
-        JSON with feedback about record import (i.e. number of 'added', 'updated', 'ignored_duplicates' and 'ignored_no_loc' records),
-        or an 'error' message.
+        JSON with feedback about record import (i.e. number of 'added', 'added_joined_locs', 'added_no_loc', 'updated' and 'ignored_duplicates' records,
+        and the 'timing' of the import if the 'timing' query parameter is set), or an 'error' message.
         """
         user = request.user
         if user.is_anonymous():
@@ -636,12 +1098,11 @@ class DataCSVUploadAPI(APIView):
         except SapelliProject.DoesNotExist:
             return Response({'error': 'No such project (id: %s)' % project_id}, status=404)
         else:
-            try:
-                csv_file = request.FILES.get('csv_file')
-                imported, imported_joined_locations, imported_no_location, updated, ignored_duplicate = sapelli_project.import_from_csv(user, csv_file)
-                return Response({'added': imported, 'added_joined_locs': imported_joined_locations, 'added_no_loc': imported_no_location, 'updated': updated, 'ignored_duplicates': ignored_duplicate, 'ignored_no_loc': ignored_no_loc})
-            except BaseException, e:
-                return Response({'error': str(e)})
+            return self.import_and_respond(
+                sapelli_project,
+                user,
+                request.FILES.get('csv_file'),
+                timing=request.query_params.get('timing') in ('1', 'true', 'True'))
 
 
 class FindObservationAPI(APIView):
@@ -650,6 +1111,8 @@ class FindObservationAPI(APIView):
     assumed to exist on the server.
     api/sapelli/projects/pppp/find_observation/cccc/ssss/dddd/
     """
+    authentication_classes = API_AUTHENTICATION_CLASSES
+
     @handle_exceptions_for_ajax
     def post(self, request, project_id, category_id):
         """
@@ -689,6 +1152,8 @@ class FindObservationAPI(APIView):
 
 
 class SAPDownloadAPI(APIView):
+    authentication_classes = API_AUTHENTICATION_CLASSES
+
     @handle_exceptions_for_ajax
     def get(self, request, project_id):
         """
@@ -703,28 +1168,74 @@ class SAPDownloadAPI(APIView):
 
         Returns
         -------
-        SAP/ZIP file download
+        SAP/ZIP file download (or the requested byte range of it), or 304 Not
+        Modified when the client's copy (If-None-Match) is up to date
         """
-        # Check user access:
-        if request.user.is_anonymous():
-            raise PermissionDenied('API access not authorised, please login.')
-        # Check project access:
-        try:
-            sapelli_project = SapelliProject.objects.get_single_for_contribution(self.request.user, project_id)
-        except SapelliProject.DoesNotExist:
-            return Response({'error': 'No such project (id: %s)' % project_id}, status=404)
+        if 'signature' in request.GET:
+            # Signed download link (see SAPDownloadQRLinkAPI), checked against the project row only:
+            try:
+                sapelli_project = SapelliProject.objects.get(pk=project_id)
+            except (SapelliProject.DoesNotExist, ValueError):
+                return Response({'error': 'No such project (id: %s)' % project_id}, status=404)
+            if not verify_download_link_params(sapelli_project, request.GET):
+                raise PermissionDenied('Download link is invalid, expired or revoked.')
+        else:
+            # Check user access:
+            if request.user.is_anonymous():
+                raise PermissionDenied('API access not authorised, please login.')
+            # Check project access:
+            try:
+                sapelli_project = SapelliProject.objects.get_single_for_contribution(self.request.user, project_id)
+            except SapelliProject.DoesNotExist:
+                return Response({'error': 'No such project (id: %s)' % project_id}, status=404)
         # Check if we have a sap_path and whether the file is actually there:
         if sapelli_project.sap_path is None or not os.path.isfile(sapelli_project.sap_path):
             return Response({'error': 'No SAP file available for download'}, status=404)
-        # else:
-        wrapper = FileWrapper(file(sapelli_project.sap_path))
-        response = HttpResponse(wrapper, content_type='application/zip')
-        response['Content-Disposition'] = 'attachment; filename=%s' % os.path.basename(sapelli_project.sap_path)
-        response['Content-Length'] = os.path.getsize(sapelli_project.sap_path)
-        return response
+        # else (supports conditional & range requests, to resume interrupted downloads):
+        return serve_file(
+            request,
+            sapelli_project.sap_path,
+            'application/zip',
+            filename=os.path.basename(sapelli_project.sap_path),
+            etag_hash=sapelli_project.get_sap_hash())
+
+
+class UploadJobAPI(APIView):
+    """
+    API Endpoint for checking the processing status of an uploaded Sapelli project.
+    api/sapelli/uploads/jjjj/
+    """
+    authentication_classes = API_AUTHENTICATION_CLASSES
+
+    @handle_exceptions_for_ajax
+    def get(self, request, job_id):
+        """
+        Handles GET requests for the status of an upload job.
+
+        Parameter
+        ---------
+        request : rest_framework.request.Request
+            Object representing the request.
+        job_id : str
+            Identifies the upload job on the data base
+
+        Returns
+        -------
+        JSON with the phase ('stored', 'extracting', 'mapping', 'done' or 'failed'),
+        timing and outcome of the job, or an 'error' message.
+        """
+        if request.user.is_anonymous():
+            raise PermissionDenied('API access not authorised, please login.')
+        try:
+            job = SapelliUploadJob.objects.get_single_for_user(request.user, job_id)
+        except SapelliUploadJob.DoesNotExist:
+            return Response({'error': 'No such upload (id: %s)' % job_id}, status=404)
+        return Response(job.get_status())
 
 
 class SAPDownloadQRLinkAPI(APIView):
+    authentication_classes = API_AUTHENTICATION_CLASSES
+
     @handle_exceptions_for_ajax
     def get(self, request, project_id):
         """
@@ -750,38 +1261,45 @@ class SAPDownloadQRLinkAPI(APIView):
         except SapelliProject.DoesNotExist:
             return Response({'error': 'No such project (id: %s)' % project_id}, status=404)
         try:
-            qr_link = None
-            try:  # Try getting previously generated link/token:
-                qr_link = SAPDownloadQRLink.objects.filter(access_token__user=request.user, sapelli_project=sapelli_project).latest('access_token__expires')
-            except BaseException, e:
-                pass
-            if qr_link is None or qr_link.access_token.is_expired():
-                if (qr_link is not None):
-                    qr_link.access_token.delete()  # qr_link will be deleted as well
-                # Generate new access token (valid for 1 day):
-                qr_link = SAPDownloadQRLink.create(user=request.user, sapelli_project=sapelli_project, days_valid=1)
+            access_token = None
+            if signed_download_links_enabled():
+                # Signed link (valid for at least 1 day), nothing is stored:
+                download_params = create_download_link_params(sapelli_project, request.user)
+                expires = get_expiry_datetime(download_params)
+                query = urlencode(download_params)
+            else:
+                qr_link = None
+                try:  # Try getting previously generated link/token:
+                    qr_link = SAPDownloadQRLink.objects.filter(access_token__user=request.user, sapelli_project=sapelli_project).latest('access_token__expires')
+                except BaseException, e:
+                    pass
+                if qr_link is None or qr_link.access_token.is_expired():
+                    if (qr_link is not None):
+                        qr_link.access_token.delete()  # qr_link will be deleted as well
+                    # Generate new access token (valid for 1 day):
+                    qr_link = SAPDownloadQRLink.create(user=request.user, sapelli_project=sapelli_project, days_valid=1)
+                access_token = qr_link.access_token.token
+                expires = qr_link.access_token.expires
+                query = 'access_token=' + access_token
             # Generate download url:
             sap_download_url = (
                 request.build_absolute_uri(reverse('geokey_sapelli:sap_download_api', kwargs={'project_id': project_id})) +
-                '?access_token=' + qr_link.access_token.token)
-            # Generate QR code PNG image:
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_M,
-                box_size=5,
-                border=0)
-            qr.add_data(sap_download_url)
-            qr.make(fit=True)
-            img_buffer = StringIO()
-            qr.make_image().save(img_buffer, "PNG")
-            # Grab img file from in-memory, make response with correct MIME-type
-            response = HttpResponse(img_buffer.getvalue(), content_type='image/png')
-            # ..and correct content-disposition
-            response['Content-Disposition'] = 'attachment; filename=%s' % request.path[request.path.rfind('/') + 1:]
+                '?' + query)
+            # Get QR code PNG image (rendered only if not cached already), which
+            # the browser may cache for as long as the link remains valid:
+            etag = '"%s"' % get_qr_image_key(sap_download_url, expires)
+            if etag_matches(request.META.get('HTTP_IF_NONE_MATCH', ''), etag):
+                response = HttpResponse(status=304)
+            else:
+                response = HttpResponse(get_qr_png(sap_download_url, expires), content_type='image/png')
+                response['Content-Disposition'] = 'attachment; filename=%s' % request.path[request.path.rfind('/') + 1:]
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, max-age=%d' % max(0, int((expires - timezone.now()).total_seconds()))
             # Add additional info as response headers:
             response['X-QR-URL'] = sap_download_url
-            response['X-QR-Access-Token'] = qr_link.access_token.token
-            response['X-QR-Access-Token-Expires'] = qr_link.access_token.expires.isoformat()
+            if access_token:
+                response['X-QR-Access-Token'] = access_token
+            response['X-QR-Access-Token-Expires'] = expires.isoformat()
             return response
         except BaseException, e:
             return Response({'error': str(e)})
@@ -795,6 +1313,16 @@ class SAPDownloadQRLinkAPI(APIView):
             sapelli_project = SapelliProject.objects.get_single_for_contribution(request.user, project_id)
         except SapelliProject.DoesNotExist:
             return Response({'error': 'No such project (id: %s)' % project_id}, status=404)
+        if signed_download_links_enabled():
+            try:
+                SapelliProject.objects.get_single_for_administration(request.user, project_id)
+            except SapelliProject.DoesNotExist:
+                # Contributors only revoke the signed links issued to them:
+                sapelli_project.revoke_download_links(request.user)
+            else:
+                # Administrators revoke all signed links to the project:
+                sapelli_project.revoke_download_links()
+            return Response({'deleted': True})
         try:  # Try getting & deleting previously generated link/token:
             qr_link = SAPDownloadQRLink.objects.filter(access_token__user=request.user, sapelli_project=sapelli_project).latest('access_token__expires')
             qr_link.access_token.delete()  # qr_link will be deleted as well
@@ -806,6 +1334,8 @@ class SAPDownloadQRLinkAPI(APIView):
 class SapelliLogsAbstractAPIView(APIView):
     """Abstract API for Sapelli logs."""
 
+    authentication_classes = API_AUTHENTICATION_CLASSES
+
     def get_user(self, request):
         """
         Get user of a request.
@@ -858,6 +1388,28 @@ class SapelliLogsAbstractAPIView(APIView):
         if file is None:
             return Response({'error': 'No file attached.'}, status=406)
 
+        return self.store_and_respond(user, sapelli_project, name, file)
+
+    def store_and_respond(self, user, sapelli_project, name, file):
+        """
+        Store a log file and respond with it.
+
+        Parameters
+        ----------
+        user : geokey.users.models.User
+            User who uploaded the log file.
+        sapelli_project : geokey_sapelli.models.SapelliProject
+            Sapelli project the log file should be added to.
+        name : str
+            Name of the log file (optional, defaults to the file name).
+        file : django.core.files.File
+            The log file.
+
+        Returns
+        -------
+        rest_framework.response.Respone
+            Contains the serialized log file.
+        """
         log_file = SapelliLogFile.create(
             name=name,
             creator=user,
@@ -892,9 +1444,9 @@ class SapelliLogsViaPersonalInfo(SapelliLogsAbstractAPIView):
             Contains the serialised log file.
         """
         try:
-            sapelli_project = SapelliProject.objects.get(
-                sapelli_id=sapelli_project_id,
-                sapelli_fingerprint=sapelli_project_fingerprint)
+            sapelli_project = SapelliProject.objects.get_by_sapelli_info(
+                sapelli_project_id,
+                sapelli_project_fingerprint)
         except SapelliProject.DoesNotExist:
             return Response({'error': 'No such project.'}, status=404)
 
@@ -929,3 +1481,355 @@ class SapelliLogsViaGeoKeyInfo(SapelliLogsAbstractAPIView):
             return Response({'error': 'No such project.'}, status=404)
 
         return self.create_and_respond(request, sapelli_project)
+
+
+class SapelliLogsMissingAPI(SapelliLogsAbstractAPIView):
+    """
+    API endpoint telling devices which of their logs (identified by the SHA-256
+    hash of their contents) a project does not have yet, so only those need
+    to be uploaded.
+    api/sapelli/projects/pppp/logs/missing/
+    """
+
+    max_hashes = 1000
+
+    def post(self, request, project_id):
+        """
+        Handle POST request.
+
+        Parameters
+        ----------
+        request : rest_framework.request.Request
+            Object representing the request, with the list of (hex) `hashes`.
+        project_id : int
+            Identifies the GeoKey project in the database.
+
+        Returns
+        -------
+        rest_framework.response.Respone
+            Contains the hashes of the logs which the project does not have.
+        """
+        try:
+            sapelli_project = SapelliProject.objects.get(
+                geokey_project__id=project_id)
+        except SapelliProject.DoesNotExist:
+            return Response({'error': 'No such project.'}, status=404)
+
+        if hasattr(request.data, 'getlist'):
+            hashes = request.data.getlist('hashes')
+        else:
+            hashes = request.data.get('hashes')
+        if not isinstance(hashes, list) or len(hashes) > self.max_hashes:
+            return Response(
+                {'error': 'Expected a list of at most %s hashes.' % self.max_hashes},
+                status=400)
+        hashes = [unicode(content_hash).lower() for content_hash in hashes]
+        if not all(LOG_HASH_RE.match(content_hash) for content_hash in hashes):
+            return Response({'error': 'Invalid hash (expected hex SHA-256).'}, status=400)
+
+        stored = set(sapelli_project.logs.filter(
+            content_hash__in=set(hashes)).values_list('content_hash', flat=True))
+        return Response({
+            'missing': [content_hash for content_hash in hashes if content_hash not in stored],
+        })
+
+
+class SapelliLogsBundleAPI(SapelliLogsAbstractAPIView):
+    """
+    API endpoint for uploading many Sapelli logs at once, as a ZIP archive.
+    api/sapelli/projects/pppp/logs/bundle/
+    """
+
+    batch_size = 50
+
+    def post(self, request, project_id):
+        """
+        Handle POST request.
+
+        Add all log files in the attached ZIP archive to the Sapelli project.
+
+        Parameters
+        ----------
+        request : rest_framework.request.Request
+            Object representing the request.
+        project_id : int
+            Identifies the GeoKey project in the database.
+
+        Returns
+        -------
+        rest_framework.response.Respone
+            Contains the serialised log files created, the names of the files
+            the project has already (duplicates) and those rejected (with the
+            reason).
+        """
+        try:
+            sapelli_project = SapelliProject.objects.get(
+                geokey_project__id=project_id)
+        except SapelliProject.DoesNotExist:
+            return Response({'error': 'No such project.'}, status=404)
+
+        file = request.FILES.get('file')
+        if file is None:
+            return Response({'error': 'No file attached.'}, status=406)
+
+        user = self.get_user(request)
+        created = []
+        duplicates = []
+        rejected = []
+        batch = []
+        try:
+            compression = get_log_compression()
+            for name, log_file, error in iter_log_bundle(file):
+                if log_file is not None:
+                    try:
+                        if not compression:
+                            # Stored as it is, so copy the entry before the next is read:
+                            log_file = File(self.copy_to_temporary_file(log_file), name=name)
+                        batch.append(SapelliLogFile.build(None, user, sapelli_project, log_file))
+                    except (BadZipfile, zlib.error, IOError), e:
+                        error = 'Failed to read log file: %s' % str(e)
+                if error:
+                    rejected.append({'name': name, 'error': error})
+                if len(batch) >= self.batch_size:
+                    self.save_batch(batch, created, duplicates)
+                    batch = []
+            self.save_batch(batch, created, duplicates)
+        except SapelliException, e:
+            return Response({'error': str(e)}, status=400)
+
+        if not created and not duplicates:
+            return Response({'error': 'No log files stored.', 'rejected': rejected}, status=400)
+
+        serializer = SapelliLogFileSerializer(created, many=True, context={'user': user})
+        return Response({
+            'created': serializer.data,
+            'duplicates': duplicates,
+            'rejected': rejected,
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    def save_batch(self, batch, created, duplicates):
+        """Save a batch of log files, adding them to the created or duplicate ones."""
+        saved, skipped = SapelliLogFile.save_many(batch)
+        created.extend(saved)
+        duplicates.extend(log.name for log in skipped)
+
+    def copy_to_temporary_file(self, log_file):
+        """Copy a (streamed) file into a temporary file."""
+        temporary_file = tempfile.TemporaryFile()
+        shutil.copyfileobj(log_file, temporary_file)
+        temporary_file.seek(0)
+        return temporary_file
+
+
+class LogFileAPI(LogFileResponseMixin, View):
+    """
+    Download of a single (compressed at rest) Sapelli log via the signed link
+    returned when it was uploaded (see SapelliLogFile.get_url).
+    api/sapelli/projects/<project_id>/logs/<log_id>/file/
+    """
+
+    def get(self, request, project_id, log_id):
+        """
+        Handle GET request.
+
+        Parameters
+        ----------
+        request : django.http.HttpRequest
+            Object representing the request.
+        project_id : int
+            Identifies the GeoKey project in the database.
+        log_id : int
+            Identifies the log file in the database.
+
+        Returns
+        -------
+        django.http.StreamingHttpResponse
+            The (decompressed) log file, or its gzip file as is when the client
+            accepts gzip encoded responses.
+
+        Raises
+        ------
+        PermissionDenied
+            When the signature of the link is missing or invalid.
+        """
+        if not verify_log_file_signature(project_id, log_id, request.GET.get('signature')):
+            raise PermissionDenied('Log file link is invalid.')
+        try:
+            log = SapelliLogFile.objects.get(pk=log_id, sapelli_project_id=project_id)
+        except SapelliLogFile.DoesNotExist:
+            raise Http404('Sapelli log not found.')
+
+        return self.respond_with_log(request, log)
+
+
+class UploadSessionsAPI(SapelliLogsAbstractAPIView):
+    """
+    API Endpoint for opening a resumable (chunked) upload of a log or CSV file.
+    api/sapelli/projects/pppp/upload_sessions/
+    """
+
+    @handle_exceptions_for_ajax
+    def post(self, request, project_id):
+        """
+        Handle POST request.
+
+        Opens an upload session, to which the file is then sent in chunks (see
+        UploadSessionAPI).
+
+        Parameters
+        ----------
+        request : rest_framework.request.Request
+            Object representing the request, expected to contain POST parameters
+            'kind' ('log' or 'csv'), 'name' (the file name) and 'size' (in bytes).
+        project_id : int
+            Identifies the GeoKey project in the database.
+
+        Returns
+        -------
+        rest_framework.response.Respone
+            Contains the status of the new upload session, including its 'id'.
+        """
+        user = self.get_user(request)
+        kind = request.POST.get('kind')
+        name = request.POST.get('name')
+        try:
+            size = int(request.POST.get('size'))
+        except (TypeError, ValueError):
+            size = -1
+        if kind not in (SapelliUploadSession.LOG, SapelliUploadSession.CSV) or not name or size < 0:
+            return Response({'error': 'Expected kind (log or csv), name and size.'}, status=400)
+
+        if kind == SapelliUploadSession.CSV and request.user.is_anonymous():
+            raise PermissionDenied('API access not authorised, please login.')
+
+        try:
+            if kind == SapelliUploadSession.CSV:
+                sapelli_project = SapelliProject.objects.get_single_for_contribution(user, project_id)
+            else:
+                sapelli_project = SapelliProject.objects.get(geokey_project__id=project_id)
+        except SapelliProject.DoesNotExist:
+            return Response({'error': 'No such project (id: %s)' % project_id}, status=404)
+
+        try:
+            session = open_upload_session(
+                kind, name, size, user, sapelli_project, anonymous=request.user.is_anonymous())
+        except SapelliException, e:
+            return Response({'error': str(e)}, status=400)
+        return Response(session.get_status(), status=status.HTTP_201_CREATED)
+
+
+class UploadSessionAPI(CSVImportMixin, SapelliLogsAbstractAPIView):
+    """
+    API Endpoint for sending the chunks of a resumable upload, checking which
+    chunks are still missing, and finalising (or aborting) the upload.
+    api/sapelli/upload_sessions/kkkk/
+    """
+
+    def get_session(self, request, key):
+        """Get the upload session, only if it was opened by the same user."""
+        return SapelliUploadSession.objects.select_related('sapelli_project').get(
+            key=key,
+            creator=self.get_user(request))
+
+    @handle_exceptions_for_ajax
+    def get(self, request, key):
+        """
+        Handle GET request.
+
+        Returns
+        -------
+        rest_framework.response.Respone
+            Contains the status of the upload, incl. the 'missing' byte ranges.
+        """
+        try:
+            session = self.get_session(request, key)
+        except SapelliUploadSession.DoesNotExist:
+            return Response({'error': 'No such upload.'}, status=404)
+        return Response(session.get_status())
+
+    @handle_exceptions_for_ajax
+    def put(self, request, key):
+        """
+        Handle PUT request.
+
+        Writes the chunk in the request body at the position given by its
+        Content-Range header (e.g. 'bytes 0-65535/1048576').
+
+        Returns
+        -------
+        rest_framework.response.Respone
+            Contains the status of the upload, incl. the 'missing' byte ranges.
+        """
+        try:
+            session = self.get_session(request, key)
+        except SapelliUploadSession.DoesNotExist:
+            return Response({'error': 'No such upload.'}, status=404)
+        if session.status != SapelliUploadSession.OPEN:
+            return Response(dict(session.get_status(), error='Upload is being finalised.'), status=409)
+
+        content_range = parse_content_range(request.META.get('HTTP_CONTENT_RANGE'))
+        data = request.body
+        if (content_range is None or
+                content_range[2] != session.size or
+                content_range[1] >= session.size or
+                content_range[1] - content_range[0] + 1 != len(data)):
+            return Response({'error': 'Invalid or missing Content-Range header.'}, status=400)
+
+        session = write_chunk(session, content_range[0], data)
+        return Response(session.get_status())
+
+    @handle_exceptions_for_ajax
+    def post(self, request, key):
+        """
+        Handle POST request.
+
+        Finalises the upload, once all chunks have been received: the file is
+        stored as log file, or its records are imported.
+
+        Returns
+        -------
+        rest_framework.response.Respone
+            Contains the serialised log file, or the outcome of the CSV import.
+        """
+        try:
+            session = self.get_session(request, key)
+        except SapelliUploadSession.DoesNotExist:
+            return Response({'error': 'No such upload.'}, status=404)
+        if not session.is_complete:
+            return Response(dict(session.get_status(), error='Upload is incomplete.'), status=409)
+        # Only one request gets to process the upload:
+        if not claim_upload_session(session):
+            return Response(dict(session.get_status(), error='Upload is being finalised.'), status=409)
+
+        try:
+            with open(session.path, 'rb') as uploaded_file:
+                file = File(uploaded_file, name=session.name)
+                if session.kind == SapelliUploadSession.LOG:
+                    response = self.store_and_respond(session.creator, session.sapelli_project, session.name, file)
+                else:
+                    response = self.import_and_respond(
+                        session.sapelli_project,
+                        session.creator,
+                        file,
+                        timing=request.query_params.get('timing') in ('1', 'true', 'True'))
+        except:
+            release_upload_session(session)
+            raise
+        session.delete()
+        return response
+
+    @handle_exceptions_for_ajax
+    def delete(self, request, key):
+        """
+        Handle DELETE request.
+
+        Aborts the upload, discarding the chunks received so far.
+        """
+        try:
+            session = self.get_session(request, key)
+        except SapelliUploadSession.DoesNotExist:
+            return Response({'error': 'No such upload.'}, status=404)
+        if session.status != SapelliUploadSession.OPEN:
+            return Response(dict(session.get_status(), error='Upload is being finalised.'), status=409)
+        session.delete()
+        return Response({'deleted': True})